@@ -0,0 +1,73 @@
+"""
+Helpers shared by the benchmark scripts, which only rely on the standard library.
+"""
+import io
+import re
+import time
+import zipfile
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def request(url, data=None, content_type='application/octet-stream', method='POST'):
+    """
+    Sends a request and returns (status, body, seconds). HTTP errors are
+    returned rather than raised, so that they can be counted.
+    """
+    headers = {'Content-Type': content_type} if data is not None else {}
+    req = urllib.request.Request(url, data=data if data is not None else (b'' if method == 'POST' else None),
+                                 method=method, headers=headers)
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status = e.code
+    return status, body, time.perf_counter() - start
+
+
+def post(url, data=b'', content_type='application/octet-stream'):
+    status, body, _ = request(url, data, content_type)
+    if status >= 400:
+        raise RuntimeError(f"POST {url} failed with status {status}: {body[:200]!r}")
+    return body
+
+
+def endpoint_url(base_url, path, **params):
+    return f"{base_url}{path}?{urllib.parse.urlencode(params)}"
+
+
+def zip_files(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(name, content)
+    return buffer.getvalue()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+_STAGE_SAMPLE = re.compile(r'^beluga_stage_seconds_(sum|count)\{stage="([^"]+)"\} (\S+)$')
+
+
+def scrape_stages(base_url):
+    """
+    Returns the cumulated {stage: [seconds, count]} of the service, read from
+    /metrics (an empty dictionary if metrics are not available).
+    """
+    status, body, _ = request(f"{base_url}/metrics", method='GET')
+    stages = {}
+    if status != 200:
+        return stages
+    for line in body.decode().splitlines():
+        match = _STAGE_SAMPLE.match(line)
+        if match:
+            kind, name, value = match.groups()
+            stages.setdefault(name, [0.0, 0])[0 if kind == 'sum' else 1] = float(value)
+    return stages
@@ -0,0 +1,238 @@
+"""
+Load test of a running instance of the webservice, reporting the throughput,
+the latency percentiles of every endpoint and the per-stage breakdown read
+from /metrics.
+
+The load is either generated from a directory of problems, or replayed from a
+traffic file recorded by the webservice (see BELUGA_RECORD_TRAFFIC):
+
+    python benchmarks/load_test.py generate --url http://localhost:80 \
+        --problems problems/ --simulations 4 --steps 100 --plans 2 --concurrency 8
+
+    python benchmarks/load_test.py replay --url http://localhost:80 \
+        --traffic requests.jsonl --concurrency 8
+
+For generated loads, the problems directory holds <name>.json problem files;
+simulations are only run for the problems with a matching
+<name>.state_and_metadata.json file, whose content is sent at every step.
+
+Reports can be saved with --output, and compared with a previous report with
+--baseline: the script then exits with status 1 if the p95 latency of an
+endpoint grew by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+from common import request, endpoint_url, zip_files, percentile, scrape_stages
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from src.traffic import read_traffic
+
+STATE_SUFFIX = '.state_and_metadata.json'
+
+
+class Call:
+    """
+    A request of the load, labelled with its endpoint.
+    """
+
+    def __init__(self, endpoint, url, body=None, content_type='application/octet-stream'):
+        self.endpoint = endpoint
+        self.url = url
+        self.body = body
+        self.content_type = content_type
+
+
+def generate_phases(url, problems_dir, simulations, steps, plans):
+    """
+    Builds the load for the problems of a directory. The load is a list of
+    phases, run one after the other; each phase is a list of streams, run
+    concurrently; each stream is a list of calls, run in order.
+    """
+    submission_id = f"load-{uuid.uuid4().hex[:8]}"
+    setup_streams, simulation_streams = [], []
+
+    for file_name in sorted(os.listdir(problems_dir)):
+        if not file_name.endswith('.json') or file_name.endswith(STATE_SUFFIX):
+            continue
+        problem_id = file_name[:-len('.json')]
+        with open(os.path.join(problems_dir, file_name), 'rb') as fp:
+            problem_zip = zip_files({'problem.json': fp.read()})
+
+        setup_streams.append([Call('/setup_problem', endpoint_url(url, '/setup_problem', submission_id=submission_id,
+                                                                  problem_id=problem_id), problem_zip)])
+        for _ in range(plans):
+            simulation_streams.append([Call('/plan', endpoint_url(url, '/plan', submission_id=submission_id,
+                                                                  problem_id=problem_id), problem_zip)])
+
+        state_file = os.path.join(problems_dir, problem_id + STATE_SUFFIX)
+        if not os.path.exists(state_file):
+            continue
+        with open(state_file, 'rb') as fp:
+            state_zip = zip_files({'state_and_metadata.json': fp.read()})
+        for simulation in range(simulations):
+            ids = {'submission_id': submission_id, 'problem_id': problem_id, 'simulation_id': str(simulation)}
+            stream = [Call('/start_simulation', endpoint_url(url, '/start_simulation', **ids))]
+            stream.extend(Call('/next_action', endpoint_url(url, '/next_action', action_id=str(step), **ids), state_zip)
+                          for step in range(steps))
+            simulation_streams.append(stream)
+
+    setup = [[Call('/setup', endpoint_url(url, '/setup', submission_id=submission_id))]]
+    return [setup, setup_streams, simulation_streams]
+
+
+def replay_phases(url, traffic_file):
+    """
+    Builds the load from a recorded traffic file: submission setups first, then
+    problem setups, then everything else. The calls of a simulation are kept in
+    a single stream, in their recorded order.
+    """
+    setups, problem_setups, others = [], [], []
+    simulations = {}
+    for entry in read_traffic(traffic_file):
+        call = Call(entry['path'], endpoint_url(url, entry['path'], **entry['args']),
+                    entry['body'], entry['content_type'] or 'application/octet-stream')
+        if entry['path'] == '/setup':
+            setups.append([call])
+        elif entry['path'] == '/setup_problem':
+            problem_setups.append([call])
+        elif entry['path'] in ('/start_simulation', '/next_action'):
+            key = tuple(entry['args'].get(name) for name in ('submission_id', 'problem_id', 'simulation_id'))
+            if key not in simulations:
+                simulations[key] = []
+                others.append(simulations[key])
+            simulations[key].append(call)
+        else:
+            others.append([call])
+    return [setups, problem_setups, others]
+
+
+def run_phases(phases, concurrency):
+    """
+    Runs the load and returns the (endpoint, status, seconds) of every call and the wall-clock time.
+    """
+    results = []
+
+    def run_stream(stream):
+        stream_results = []
+        for call in stream:
+            status, _, seconds = request(call.url, call.body, call.content_type)
+            stream_results.append((call.endpoint, status, seconds))
+        return stream_results
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for phase in phases:
+            for stream_results in executor.map(run_stream, phase):
+                results.extend(stream_results)
+    return results, time.perf_counter() - start
+
+
+def build_report(results, wall_seconds, stages_before, stages_after):
+    endpoints = {}
+    for endpoint, status, seconds in results:
+        entry = endpoints.setdefault(endpoint, {'latencies': [], 'errors': 0})
+        entry['latencies'].append(seconds)
+        if status >= 400:
+            entry['errors'] += 1
+
+    report = {'requests': len(results), 'seconds': wall_seconds,
+              'throughput': len(results) / wall_seconds if wall_seconds else 0.0,
+              'endpoints': {}, 'stages': {}}
+    for endpoint, entry in sorted(endpoints.items()):
+        latencies = entry['latencies']
+        report['endpoints'][endpoint] = {
+            'requests': len(latencies),
+            'errors': entry['errors'],
+            'throughput': len(latencies) / wall_seconds if wall_seconds else 0.0,
+            'mean': statistics.mean(latencies),
+            'p50': percentile(latencies, 0.50),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+        }
+    for stage, (total, count) in sorted(stages_after.items()):
+        before_total, before_count = stages_before.get(stage, (0.0, 0))
+        if count > before_count:
+            report['stages'][stage] = {'calls': int(count - before_count), 'seconds': total - before_total,
+                                       'mean': (total - before_total) / (count - before_count)}
+    return report
+
+
+def print_report(report):
+    print(f"{report['requests']} requests in {report['seconds']:.2f}s ({report['throughput']:.1f} req/s)")
+    print()
+    print(f"{'endpoint':<20} {'requests':>8} {'errors':>7} {'req/s':>8} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for endpoint, entry in report['endpoints'].items():
+        print(f"{endpoint:<20} {entry['requests']:>8} {entry['errors']:>7} {entry['throughput']:>8.1f} "
+              f"{entry['mean'] * 1000:>9.3f} {entry['p50'] * 1000:>9.3f} {entry['p95'] * 1000:>9.3f} "
+              f"{entry['p99'] * 1000:>9.3f}")
+    if report['stages']:
+        print()
+        print(f"{'stage':<20} {'calls':>8} {'total s':>9} {'mean ms':>9}")
+        for stage, entry in report['stages'].items():
+            print(f"{stage:<20} {entry['calls']:>8} {entry['seconds']:>9.3f} {entry['mean'] * 1000:>9.3f}")
+
+
+def compare_reports(report, baseline, tolerance):
+    """
+    Returns the endpoints whose p95 latency grew by more than tolerance with respect to the baseline.
+    """
+    regressions = []
+    for endpoint, entry in report['endpoints'].items():
+        previous = baseline['endpoints'].get(endpoint)
+        if previous is not None and entry['p95'] > previous['p95'] * (1 + tolerance):
+            regressions.append((endpoint, previous['p95'], entry['p95']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=('generate', 'replay'))
+    parser.add_argument('--url', default='http://localhost:80')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--problems', help='Directory of problems (generate mode)')
+    parser.add_argument('--simulations', type=int, default=2, help='Simulations per problem (generate mode)')
+    parser.add_argument('--steps', type=int, default=50, help='Steps per simulation (generate mode)')
+    parser.add_argument('--plans', type=int, default=1, help='/plan calls per problem (generate mode)')
+    parser.add_argument('--traffic', help='Recorded traffic file (replay mode)')
+    parser.add_argument('--output', help='Save the report as JSON')
+    parser.add_argument('--baseline', help='Previous JSON report to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative growth of the p95 latencies')
+    args = parser.parse_args(argv)
+
+    if args.mode == 'generate':
+        if not args.problems:
+            parser.error('generate mode requires --problems')
+        phases = generate_phases(args.url, args.problems, args.simulations, args.steps, args.plans)
+    else:
+        if not args.traffic:
+            parser.error('replay mode requires --traffic')
+        phases = replay_phases(args.url, args.traffic)
+
+    stages_before = scrape_stages(args.url)
+    results, wall_seconds = run_phases(phases, args.concurrency)
+    report = build_report(results, wall_seconds, stages_before, scrape_stages(args.url))
+    print_report(report)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare_reports(report, json.load(fp), args.tolerance)
+        for endpoint, previous, current in regressions:
+            print(f"REGRESSION {endpoint}: p95 {previous * 1000:.3f} ms -> {current * 1000:.3f} ms")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
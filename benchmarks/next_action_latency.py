@@ -0,0 +1,69 @@
+"""
+Compares the per-step latency of /next_action over the zip transport and over
+the JSON fast path, against a running instance of the webservice.
+
+Example:
+
+    python benchmarks/next_action_latency.py --url http://localhost:80 \
+        --problem problem.json --state state_and_metadata.json --steps 500
+"""
+import sys
+import time
+import uuid
+import argparse
+import statistics
+
+from common import post, zip_files, percentile
+
+
+def run(url, submission_id, problem_id, state, transport, steps, warmup):
+    """
+    Runs a simulation with the given transport and returns the step latencies in seconds.
+    """
+    simulation_id = f"{transport}-{uuid.uuid4().hex[:8]}"
+    post(f"{url}/start_simulation?submission_id={submission_id}&problem_id={problem_id}&simulation_id={simulation_id}")
+
+    if transport == 'zip':
+        body, content_type = zip_files({'state_and_metadata.json': state}), 'application/octet-stream'
+    else:
+        body, content_type = state, 'application/json'
+
+    latencies = []
+    for action_id in range(warmup + steps):
+        start = time.perf_counter()
+        post(f"{url}/next_action?submission_id={submission_id}&problem_id={problem_id}"
+             f"&simulation_id={simulation_id}&action_id={action_id}", body, content_type)
+        if action_id >= warmup:
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:80')
+    parser.add_argument('--problem', required=True, help='Path to a problem.json file')
+    parser.add_argument('--state', required=True, help='Path to a state_and_metadata.json file for the problem')
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--warmup', type=int, default=10)
+    args = parser.parse_args(argv)
+
+    with open(args.problem, 'rb') as fp:
+        problem = fp.read()
+    with open(args.state, 'rb') as fp:
+        state = fp.read()
+
+    submission_id, problem_id = 'benchmark', f"problem-{uuid.uuid4().hex[:8]}"
+    post(f"{args.url}/setup?submission_id={submission_id}")
+    post(f"{args.url}/setup_problem?submission_id={submission_id}&problem_id={problem_id}",
+         zip_files({'problem.json': problem}))
+
+    print(f"{'transport':<10} {'steps':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for transport in ('zip', 'json'):
+        latencies = run(args.url, submission_id, problem_id, state, transport, args.steps, args.warmup)
+        print(f"{transport:<10} {len(latencies):>6} {statistics.mean(latencies) * 1000:>9.3f} "
+              f"{percentile(latencies, 0.50) * 1000:>9.3f} {percentile(latencies, 0.95) * 1000:>9.3f} "
+              f"{percentile(latencies, 0.99) * 1000:>9.3f}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+import time
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from src.metrics import registry as metrics
+from src.forks import fork_safe_lock
+
+# Priority classes, from the most to the least urgent
+INTERACTIVE = 'interactive'
+SETUP = 'setup'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, SETUP, BATCH)
+
+QUEUE_WAIT_SECONDS = metrics.histogram('beluga_admission_wait_seconds',
+                                       'Time spent by the calls waiting for admission in seconds', ['priority'])
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a call is shed: status is 429 when the queue of its priority
+    class is full, and 503 when it waited longer than the queue timeout.
+    """
+
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class PriorityClass:
+    """
+    Limits and state of a priority class: at most concurrency calls of the class
+    run at the same time, at most max_queue wait for their turn, for at most
+    queue_timeout seconds (0 waits indefinitely).
+
+    Waiting calls are grouped by submission and admitted round-robin across
+    submissions, so that one submission cannot monopolise its class.
+    """
+
+    def __init__(self, name, concurrency, max_queue, queue_timeout):
+        if concurrency < 1:
+            raise ValueError(f"The concurrency of the {name} class must be positive, got {concurrency}")
+        self.name = name
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+
+        self.running = 0
+        self.queued = 0
+        self.waiting = OrderedDict()
+
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def push(self, ticket):
+        self.waiting.setdefault(ticket.submission_id, deque()).append(ticket)
+        self.queued += 1
+
+    def pop(self):
+        # The submission served goes to the back of the rotation
+        submission_id, tickets = next(iter(self.waiting.items()))
+        ticket = tickets.popleft()
+        if tickets:
+            self.waiting.move_to_end(submission_id)
+        else:
+            del self.waiting[submission_id]
+        self.queued -= 1
+        return ticket
+
+    def remove(self, ticket):
+        tickets = self.waiting[ticket.submission_id]
+        tickets.remove(ticket)
+        if not tickets:
+            del self.waiting[ticket.submission_id]
+        self.queued -= 1
+
+    def stats(self):
+        return {
+            'concurrency': self.concurrency,
+            'max_queue': self.max_queue,
+            'queue_timeout': self.queue_timeout,
+            'running': self.running,
+            'queued': self.queued,
+            'admitted': self.admitted,
+            'rejected_full': self.rejected_full,
+            'rejected_timeout': self.rejected_timeout,
+            'wait_seconds': round(self.wait_seconds, 6),
+            'max_wait_seconds': round(self.max_wait_seconds, 6),
+        }
+
+
+class _Ticket:
+    __slots__ = ('submission_id', 'granted', 'event')
+
+    def __init__(self, submission_id):
+        self.submission_id = submission_id
+        self.granted = False
+        self.event = threading.Event()
+
+
+class AdmissionController:
+    """
+    Scheduler in front of the business logic calls. At most capacity calls run
+    at the same time; when a slot frees up, it goes to the waiting call of the
+    most urgent class that is below its own concurrency limit, so that
+    simulation steps are never stuck behind a burst of planning calls.
+
+    Calls are wrapped in admit(priority, submission_id), which waits for their
+    turn or raises AdmissionRejected when they are shed.
+    """
+
+    def __init__(self, capacity, classes, enabled=True):
+        if capacity < 1:
+            raise ValueError(f"The admission capacity must be positive, got {capacity}")
+        self.capacity = capacity
+        self.enabled = enabled
+        self.running = 0
+
+        # Ordered from the most to the least urgent
+        self._classes = OrderedDict((priority_class.name, priority_class) for priority_class in classes)
+        fork_safe_lock(self)
+
+    @contextmanager
+    def admit(self, priority, submission_id=None):
+        """
+        Runs the body of the with statement once the call is admitted.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        priority_class = self._classes[priority]
+        ticket = _Ticket(submission_id)
+        start = time.perf_counter()
+        with self._lock:
+            priority_class.push(ticket)
+            self._dispatch()
+            if not ticket.granted and priority_class.queued > priority_class.max_queue:
+                priority_class.remove(ticket)
+                priority_class.rejected_full += 1
+                raise AdmissionRejected(f"The {priority} queue is full ({priority_class.max_queue} calls waiting)",
+                                        429, 1)
+
+        if not ticket.granted:
+            ticket.event.wait(priority_class.queue_timeout or None)
+            with self._lock:
+                # Admission may have been granted right after the timeout
+                if not ticket.granted:
+                    priority_class.remove(ticket)
+                    priority_class.rejected_timeout += 1
+                    raise AdmissionRejected(f"Timed out after waiting {priority_class.queue_timeout}s in the {priority} queue",
+                                            503, max(1, int(priority_class.queue_timeout)))
+
+        waited = time.perf_counter() - start
+        with self._lock:
+            priority_class.admitted += 1
+            priority_class.wait_seconds += waited
+            priority_class.max_wait_seconds = max(priority_class.max_wait_seconds, waited)
+        if metrics.enabled:
+            QUEUE_WAIT_SECONDS.observe(waited, priority=priority)
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                priority_class.running -= 1
+                self.running -= 1
+                self._dispatch()
+
+    def _dispatch(self):
+        # Called with the lock held: hands the free slots over by priority
+        while self.running < self.capacity:
+            for priority_class in self._classes.values():
+                if priority_class.queued and priority_class.running < priority_class.concurrency:
+                    ticket = priority_class.pop()
+                    ticket.granted = True
+                    priority_class.running += 1
+                    self.running += 1
+                    ticket.event.set()
+                    break
+            else:
+                return
+
+    def stats(self):
+        """
+        Returns the limits and counters of every priority class.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'capacity': self.capacity,
+                'running': self.running,
+                'classes': {name: priority_class.stats() for name, priority_class in self._classes.items()},
+            }
@@ -1,23 +1,16 @@
-import os, time, logging
+import os, copy, time, logging
 
 # Add the tools directory to the path, to ensure consistent import names
 import sys
 sys.path.insert(0, os.path.join('/app', 'src', 'tools'))
 
 import json
-from beluga_lib.beluga_problem import BelugaProblemDecoder
-from beluga_lib.problem_state import BelugaProblemState
-from evaluation.planner_api import BelugaPlan, ProbabilisticPlanningMetatada
-
-# SECTION TO BE EDITED BY THE COMPETITORS ===================================
-
-# Import the planning implementation
-# NOTE in this template we build both a deterministc and and a probabilistic
-# (trivial) planner. In practice only oe solution is needed
-from evaluation.planner_examples import RandomProbabilisticPlanner
-from evaluation.planner_examples import RandomDeterministicPlanner
-
-# END OF SECTION TO BE EDITED BY THE COMPETITORS ============================
+from src.problem_cache import ProblemCache, problem_hash
+from src.snapshots import SnapshotStore, planner_name
+from src.compact_state import CompactState, StateLayout, uses_compact_states
+from src.rollouts import RolloutPool
+from src.sessions import SessionRegistry
+from src.metrics import stage
 
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
@@ -27,6 +20,36 @@ logger = logging.getLogger(__name__)
 
 logging.disable(logging.DEBUG)
 
+def _env_flag(name, default):
+    """
+    Reads a boolean flag from the environment.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+def _env_int(name, default):
+    """
+    Reads an integer setting from the environment.
+    """
+    value = os.environ.get(name)
+    if value is None or value.strip() == '':
+        return default
+    return int(value)
+
+def _env_choice(name, default, choices):
+    """
+    Reads a setting from the environment, which must be one of the given choices.
+    """
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    value = value.strip().lower()
+    if value not in choices:
+        raise ValueError(f"Invalid {name} {value!r}, expected one of {', '.join(repr(c) for c in choices)}")
+    return value
+
 class Configuration:
     def __init__(self):
         self.problem_file_name = 'problem.json'
@@ -34,40 +57,253 @@ class Configuration:
         self.state_and_metadata_name = 'state_and_metadata.json'
         self.action_file_name = 'action.json'
 
+        # Requests are handled entirely in memory. When enabled, the web service
+        # also stores every uploaded archive, its content and the produced output
+        # under the executions folder (for debugging and auditing only)
+        self.persist_executions = _env_flag('BELUGA_PERSIST_EXECUTIONS', False)
+
+        # Limits of the uploaded bodies: size as sent, total size of the content
+        # of zip archives once decompressed and number of archive entries.
+        # Bodies are read in chunks and kept in memory up to upload_spool_mb,
+        # in a temporary file beyond
+        self.max_upload_mb = _env_int('BELUGA_MAX_UPLOAD_MB', 100)
+        self.max_uncompressed_mb = _env_int('BELUGA_MAX_UNCOMPRESSED_MB', 512)
+        self.max_archive_entries = _env_int('BELUGA_MAX_ARCHIVE_ENTRIES', 10000)
+        self.upload_spool_mb = _env_int('BELUGA_UPLOAD_SPOOL_MB', 8)
+
+        # Profiling of the planner calls: requests are profiled when they ask for
+        # it (profile query parameter or X-Profile header) and at random with the
+        # given sample rate
+        self.profile_dir = os.environ.get('BELUGA_PROFILE_DIR', os.path.join('..', 'res', 'profiles'))
+        self.profile_sample_rate = float(os.environ.get('BELUGA_PROFILE_SAMPLE_RATE', 0))
+        self.profile_max_files = _env_int('BELUGA_PROFILE_MAX_FILES', 100)
+
+        # Retention of the persisted executions: 'all', 'none', 'failures',
+        # 'last_n' (keep the last retention_keep_last ones) or 'ttl' (keep them
+        # for retention_minutes minutes)
+        self.retention_mode = os.environ.get('BELUGA_RETENTION_MODE', 'all')
+        self.retention_keep_last = _env_int('BELUGA_RETENTION_KEEP_LAST', 100)
+        self.retention_minutes = _env_int('BELUGA_RETENTION_MINUTES', 60)
+        self.retention_sweep_interval = _env_int('BELUGA_RETENTION_SWEEP_INTERVAL', 60)
+
+        # Cache of decoded problems, keyed by the hash of the problem file
+        self.problem_cache_enabled = _env_flag('BELUGA_PROBLEM_CACHE', True)
+        self.problem_cache_max_entries = _env_int('BELUGA_PROBLEM_CACHE_MAX_ENTRIES', 32)
+        self.problem_cache_max_mb = _env_int('BELUGA_PROBLEM_CACHE_MAX_MB', 512)
+
+        # Snapshots of the prepared problems, restored after a restart instead of
+        # setting the problems up again. Bump the version whenever the planner
+        # code changes, to discard the snapshots of the previous planner
+        self.snapshots_enabled = _env_flag('BELUGA_SNAPSHOTS', False)
+        self.snapshot_dir = os.environ.get('BELUGA_SNAPSHOT_DIR', os.path.join('..', 'res', 'snapshots'))
+        self.snapshot_version = os.environ.get('BELUGA_SNAPSHOT_VERSION', '')
+
+        # Cache of the /plan results, keyed by the problem file, the identity of
+        # the deterministic planner (its class, its settings and the version, to
+        # bump whenever the planner code changes) and the time budget, kept in
+        # memory and under plan_cache_dir (empty to keep them in memory only),
+        # whose files are evicted beyond plan_cache_max_disk_mb
+        self.plan_cache_enabled = _env_flag('BELUGA_PLAN_CACHE', False)
+        self.plan_cache_dir = os.environ.get('BELUGA_PLAN_CACHE_DIR', os.path.join('..', 'res', 'plan_cache'))
+        self.plan_cache_max_entries = _env_int('BELUGA_PLAN_CACHE_MAX_ENTRIES', 256)
+        self.plan_cache_max_disk_mb = _env_int('BELUGA_PLAN_CACHE_MAX_DISK_MB', 1024)
+        self.plan_cache_version = os.environ.get('BELUGA_PLAN_CACHE_VERSION', '')
+
+        # Registry of the prepared problems and of the running simulations
+        self.session_idle_timeout = _env_int('BELUGA_SESSION_IDLE_TIMEOUT', 1800)
+        self.max_sessions = _env_int('BELUGA_MAX_SESSIONS', 256)
+        self.max_problems = _env_int('BELUGA_MAX_PROBLEMS', 16)
+        self.max_submission_sessions = _env_int('BELUGA_MAX_SUBMISSION_SESSIONS', self.max_sessions)
+
+        # Keep the last state of every simulation and only decode the states
+        # that do not match it (see src/state_tracking.py)
+        self.incremental_state = _env_flag('BELUGA_INCREMENTAL_STATE', False)
+
+        # Number of business logic workers (each with its own planners) serving
+        # requests in parallel
+        self.workers = _env_int('BELUGA_WORKERS', os.cpu_count() or 1)
+
+        # Admission control of the business logic calls (see src/admission.py):
+        # at most admission_capacity calls run at the same time, and every
+        # priority class has its own (concurrency, queue cap, queue timeout in
+        # seconds), batch calls leaving a worker to the simulations by default
+        self.admission_enabled = _env_flag('BELUGA_ADMISSION', True)
+        self.admission_capacity = _env_int('BELUGA_ADMISSION_CAPACITY', self.workers)
+        self.admission_limits = {
+            priority: (_env_int(f'BELUGA_ADMISSION_{priority.upper()}_CONCURRENCY', concurrency),
+                       _env_int(f'BELUGA_ADMISSION_{priority.upper()}_QUEUE', max_queue),
+                       float(os.environ.get(f'BELUGA_ADMISSION_{priority.upper()}_TIMEOUT', timeout)))
+            for priority, concurrency, max_queue, timeout in (('interactive', self.workers, 256, 30),
+                                                              ('setup', self.workers, 64, 120),
+                                                              ('batch', max(1, self.workers - 1), 64, 600))
+        }
+
+        # Backend for /plan: 'thread' runs on the worker pool, 'process' runs on
+        # a pool of worker processes that supports hard time budgets
+        self.plan_backend = os.environ.get('BELUGA_PLAN_BACKEND', 'thread')
+        self.plan_processes = _env_int('BELUGA_PLAN_PROCESSES', os.cpu_count() or 1)
+        # With the thread backend, /plan_batch plans on worker processes of its
+        # own, started by the first batch, so that a batch uses several cores
+        # (0 plans on the worker pool)
+        self.batch_processes = _env_int('BELUGA_BATCH_PROCESSES', os.cpu_count() or 1)
+        # Default wall-clock budget for /plan in seconds (0 means no budget),
+        # can be overridden by the time_budget query parameter
+        self.plan_time_budget = float(os.environ.get('BELUGA_PLAN_TIME_BUDGET', 0))
+
+        # Asynchronous jobs: number of executors, maximum number of queued or
+        # running jobs, and seconds for which finished jobs are kept
+        self.job_executors = _env_int('BELUGA_JOB_EXECUTORS', 2)
+        self.job_queue_size = _env_int('BELUGA_JOB_QUEUE_SIZE', 64)
+        self.job_retention = _env_int('BELUGA_JOB_RETENTION', 600)
+        self.job_max_finished = _env_int('BELUGA_JOB_MAX_FINISHED', 128)
+
+        # When set, the API requests are appended to this JSON lines file, to be
+        # replayed by benchmarks/load_test.py
+        self.record_traffic = os.environ.get('BELUGA_RECORD_TRAFFIC')
+
+        # Debug mode (with the reloader) of the development server started by
+        # python webservice.py
+        self.debug = _env_flag('BELUGA_DEBUG', False)
+
+        # Processes running the Monte-Carlo rollouts of the probabilistic planners
+        # (0 runs them inline), started on first use
+        self.rollout_processes = _env_int('BELUGA_ROLLOUT_PROCESSES', os.cpu_count() or 1)
+
+        # Optional pre-warm of the planners at startup: '' (none, the planners
+        # are built on first use), 'det', 'prob' or 'all'
+        self.prewarm = _env_choice('BELUGA_PREWARM', '', ('', 'det', 'prob', 'all'))
+
+        # Threads running the blocking work (business logic calls, zip handling
+        # and file writes) of the asyncio variant of the service
+        self.async_threads = _env_int('BELUGA_ASYNC_THREADS', 2 * self.workers + 4)
+
 configuration = Configuration()
 
+# Decoded problems are shared by all the business logic objects
+problem_cache = ProblemCache(max_entries=configuration.problem_cache_max_entries,
+                             max_bytes=configuration.problem_cache_max_mb * 1024 * 1024,
+                             enabled=configuration.problem_cache_enabled)
+
+# Problems and simulations are shared by all the business logic objects
+session_registry = SessionRegistry(idle_timeout=configuration.session_idle_timeout,
+                                   max_sessions=configuration.max_sessions,
+                                   max_problems=configuration.max_problems,
+                                   max_submission_sessions=configuration.max_submission_sessions)
+
+# Prepared problems survive restarts through their snapshots
+snapshots = SnapshotStore(configuration.snapshot_dir, configuration.snapshot_version,
+                          enabled=configuration.snapshots_enabled)
+
+# Rollouts are shared by all the business logic objects; probabilistic planners
+# use it with rollout_pool.evaluate(prb, rollout_fn, state, actions, horizon, ...)
+rollout_pool = RolloutPool(configuration.rollout_processes)
+
+# The toolkit modules are imported on first use, which keeps the startup of the
+# service fast; import_toolkit() imports them ahead of time
+def import_toolkit():
+    """
+    Imports the toolkit modules used by the business logic.
+    """
+    import beluga_lib.beluga_problem
+    import beluga_lib.problem_state
+    import evaluation.planner_api
+
+def decode_problem(raw_problem):
+    """
+    Decodes the raw content of a problem file into a BelugaProblem.
+    """
+    from beluga_lib.beluga_problem import BelugaProblemDecoder
+    return json.loads(raw_problem, cls=BelugaProblemDecoder)
+
+def empty_plan_files():
+    """
+    Returns the output files of an empty plan, used when no plan could be computed.
+    """
+    from evaluation.planner_api import BelugaPlan
+    return {configuration.plan_file_name: json.dumps(BelugaPlan().to_json_obj()).encode()}
+
 class CompetitorModelBusinessLogic:
 
     def __init__(self):
-        # SECTION TO BE EDITED BY THE COMPETITORS ===================================
+        # The planners are built on first use (see det_planner and prob_planner),
+        # since an evaluation only ever uses one of them
+        self._det_planner = None
+        self._prob_planner = None
+        self._setup_done = False
+
+    # SECTION TO BE EDITED BY THE COMPETITORS ===================================
+
+    # NOTE in this template we build both a deterministc and and a probabilistic
+    # (trivial) planner. In practice only oe solution is needed. Import the
+    # planning implementation within these methods, so that it is only loaded
+    # when the corresponding planner is needed.
+
+    def build_det_planner(self):
+        """
+        Builds the deterministic planner, used by the deterministic API (plan).
+        """
+        from evaluation.planner_examples import RandomDeterministicPlanner
+        return RandomDeterministicPlanner(max_steps=30)
+
+    def build_prob_planner(self):
+        """
+        Builds the probabilistic planner, used by the probabilistic API. Every
+        problem and every simulation works on its own copy of this planner (via
+        copy.deepcopy).
+        """
+        from evaluation.planner_examples import RandomProbabilisticPlanner
+        return RandomProbabilisticPlanner()
+
+    # END OF THE SECTION TO BE EDITED BY THE COMPETITORS ========================
 
-        # Build the deterministc planner
+    @property
+    def det_planner(self):
         # NOTE the web service code relies on the det_planner variable for the
         # deterministc API, so do not change that name.
-        self.det_planner = RandomDeterministicPlanner(max_steps=30)
-
-        # Build the deterministc planner
+        if self._det_planner is None:
+            with stage('build_planner'):
+                self._det_planner = self.build_det_planner()
+                # The submission may have been set up before the planner was built
+                if self._setup_done:
+                    self._det_planner.setup()
+        return self._det_planner
+
+    @property
+    def prob_planner(self):
         # NOTE the web service code relies on the prob_planner variable for the
-        # deterministc API, so do not change that name.
-        self.prob_planner = RandomProbabilisticPlanner()
+        # probabilistic API, so do not change that name.
+        if self._prob_planner is None:
+            with stage('build_planner'):
+                self._prob_planner = self.build_prob_planner()
+        return self._prob_planner
 
-        # END OF THE SECTION TO BE EDITED BY THE COMPETITORS ========================
+    def warm_up(self, planners=('det', 'prob')):
+        """
+        Builds the given planners ahead of their first use.
+        """
+        import_toolkit()
+        if 'det' in planners:
+            self.det_planner
+        if 'prob' in planners:
+            self.prob_planner
 
-    def explain(self, submission_id, plan_id, input_path, output_path):
+    def explain(self, submission_id, plan_id, input_files, output_files):
         """
         Business logic for processing input files and generating output.
+
+        input_files maps the names of the uploaded files to their raw content;
+        output_files should be filled in the same way with the files to return.
         """
         logger.info(f"[EXPLAIN] - Start processing - Submission ID: {submission_id}, Plan ID: {plan_id}")
-        logger.info(f"[EXPLAIN] - Input path: {input_path}, Output path: {output_path}")
+        logger.info(f"[EXPLAIN] - Input files: {sorted(input_files)}")
 
         try:
             # SECTION TO BE EDITED BY THE COMPETITORS ===================================
 
             # Generate an example output file (this should be replaced with actual logic)
-            output_file = os.path.join(output_path, f"output_{plan_id}.txt")
+            output_file = f"output_{plan_id}.txt"
             logger.info(f"[EXPLAIN] - Preparing to write output file: {output_file}")
-            with open(output_file, 'w') as f:
-                f.write(f"Explanation generated for submission {submission_id}, plan {plan_id}\n")
+            output_files[output_file] = f"Explanation generated for submission {submission_id}, plan {plan_id}\n".encode()
 
             # Simulating a delay in processing (15 seconds)
             logger.info(f"[EXPLAIN] - Processing... ")
@@ -84,34 +320,39 @@ class CompetitorModelBusinessLogic:
             return False
 
 
-    def plan(self, submission_id, problem_id, input_path, output_path):
+    def plan(self, submission_id, problem_id, input_files, output_files):
         """
         Business logic for processing input files and generating output.
+
+        input_files maps the names of the uploaded files to their raw content;
+        the plan is stored in output_files.
         """
         logger.debug(f"[PLAN] - Start processing - Submission ID: {submission_id}, Problem ID: {problem_id}")
-        logger.debug(f"[PLAN] - Input path: {input_path}, Output path: {output_path}")
+        logger.debug(f"[PLAN] - Input files: {sorted(input_files)}")
 
         try:
             # Read the problem data
-            input_file = os.path.join(input_path, configuration.problem_file_name)
+            input_file = configuration.problem_file_name
             logger.debug(f"[PLAN] - Preparing to read input file: {input_file}")
-            with open(input_file) as fp:
-                prb = json.load(fp, cls=BelugaProblemDecoder)
+            with stage('decode_problem'):
+                prb = problem_cache.get_or_decode(input_files[input_file], decode_problem)
             logger.debug(f"[PLAN] - Completed reading - Submission ID: {submission_id}, Problem ID: {problem_id}")
 
             # Call the planning method
             logger.debug(f"[PLAN] - Processing...")
-            plan = self.det_planner.build_plan(prb)
+            with stage('build_plan'):
+                plan = self.det_planner.build_plan(prb)
             # Null plans are considered the same as emtpy plans
             if plan is None:
+                from evaluation.planner_api import BelugaPlan
                 plan = BelugaPlan()
             logger.debug(f"[PLAN] - Completed processing - Submission ID: {submission_id}, Problem ID: {problem_id}")
 
             # Generate output file
-            output_file = os.path.join(output_path, configuration.plan_file_name)
+            output_file = configuration.plan_file_name
             logger.debug(f"[PLAN] - Preparing to write output file: {output_file}")
-            with open(output_file, 'w') as fp:
-                json.dump(plan.to_json_obj(), fp)
+            with stage('encode_plan'):
+                output_files[output_file] = json.dumps(plan.to_json_obj()).encode()
             logger.debug(f"[PLAN] - Completed writing - Submission ID: {submission_id}, Problem ID: {problem_id}")
 
             return True
@@ -126,12 +367,15 @@ class CompetitorModelBusinessLogic:
         """
         logger.debug(f"[SETUP] - Start setup - Submission ID: {submission_id}")
 
-        self.det_planner.setup()
+        # The deterministic planner is set up when it is built, if it is not yet
+        self._setup_done = True
+        if self._det_planner is not None:
+            self._det_planner.setup()
 
         # time.sleep(15)
         logger.debug(f"[SETUP] - Setup complete - Submission ID: {submission_id}")
 
-    def setup_problem(self, submission_id, problem_id, input_path):
+    def setup_problem(self, submission_id, problem_id, input_files):
         """
         Setup method for initializing resources or configurations specific to a problem within the submission.
         """
@@ -139,53 +383,107 @@ class CompetitorModelBusinessLogic:
 
         try:
             # Read the problem data
-            input_file = os.path.join(input_path, f'problem.json')
+            input_file = configuration.problem_file_name
             logger.debug(f"[SETUP PROBLEM] - Preparing to read input file: {input_file}")
-            with open(input_file) as fp:
-                prb = json.load(fp, cls=BelugaProblemDecoder)
-            logger.debug(f"[SETUP PROBLEM] - Completed reading - Submission ID: {submission_id}, Problem ID: {problem_id}")
-
-            # Setup the planner for the problem
-            logger.debug(f"[SETUP PROBLEM] - Processing... Simulating a 15-second delay")
-            self.prob_planner.setup(prb)
+            raw_problem = input_files[input_file]
+
+            # Restore the problem prepared by a previous run of the service, as
+            # long as the problem file has not changed
+            snapshot = None
+            if snapshots.enabled:
+                raw_hash = problem_hash(raw_problem)
+                with stage('restore_snapshot'):
+                    snapshot = snapshots.load(submission_id, problem_id, planner_name(self.prob_planner), raw_hash)
+
+            if snapshot is not None:
+                prb, planner, layout = snapshot
+                problem_cache.put(raw_hash, prb, len(raw_problem))
+            else:
+                with stage('decode_problem'):
+                    prb = problem_cache.get_or_decode(raw_problem, decode_problem)
+                logger.debug(f"[SETUP PROBLEM] - Completed reading - Submission ID: {submission_id}, Problem ID: {problem_id}")
+
+                # Setup a copy of the planner for the problem
+                logger.debug(f"[SETUP PROBLEM] - Processing...")
+                with stage('setup_planner'):
+                    planner = copy.deepcopy(self.prob_planner, {id(prb): prb})
+                    planner.setup(prb)
+
+                # Index the jigs, racks, trailers and hangars once for the
+                # planners working on compact states
+                layout = None
+                if uses_compact_states(planner):
+                    with stage('state_layout'):
+                        layout = StateLayout.from_problem_json(json.loads(raw_problem))
+                if snapshots.enabled:
+                    with stage('save_snapshot'):
+                        snapshots.save(submission_id, problem_id, raw_hash, prb, planner, layout)
+            session_registry.add_problem(submission_id, problem_id, prb, planner, layout)
             logger.debug(f"[SETUP PROBLEM] - Problem setup complete - Submission ID: {submission_id}, Problem ID: {problem_id}")
 
         except Exception as e:
             logger.error(f"[SETUP PROBLEM] - Error during problem setup for Submission ID: {submission_id}, Problem ID: {problem_id}: {str(e)}", exc_info=True)
             return False
 
-    def start_simulation(self, submission_id, problem_id, simulation_id):
+    def start_simulation(self, submission_id, problem_id, simulation_id, initial_state=None):
         """
         Start a simulation process for a given submission, problem, and simulation ID.
+
+        The JSON initial_state, when given, primes the state cache of the simulation,
+        so that the first next_action call can send a state delta.
         """
 
         # Setup the simulation
         logger.debug(f"[START SIMULATION] - Simulation setup started - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}")
-        self.prob_planner.setup_episode()
+        session = self._start_session(submission_id, problem_id, simulation_id)
+        if initial_state is not None and configuration.incremental_state:
+            with session.lock:
+                session.states.resolve({'state': initial_state}, session.prb, self._state_decoder(session))
         logger.debug(f"[START SIMULATION] - Simulation setup complete - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}")
 
-    def next_action(self, submission_id, problem_id, simulation_id, action_id, input_path, output_path):
+    def next_action(self, submission_id, problem_id, simulation_id, action_id, input_files, output_files):
         """
         Handle the next action in a series for a specific simulation.
         """
 
         try:
             # Read the state and metadata
-            input_file = os.path.join(input_path, configuration.state_and_metadata_name)
+            input_file = configuration.state_and_metadata_name
             logger.debug(f"[NEXT ACTION] - Preparing to read input file: {input_file} - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
-            with open(input_file) as fp:
-                data = json.load(fp)
-                state = BelugaProblemState.from_json_obj(data['state'], self.prob_planner.prb)
-                metadata = ProbabilisticPlanningMetatada.from_json_obj(data['metadata'])
-
-            # Retrieve the next action
-            ba = self.prob_planner.next_action(state, metadata)
+            session = session_registry.get_session(submission_id, problem_id, simulation_id)
+            if session is None:
+                logger.warning(f"[NEXT ACTION] - No running simulation, starting one - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}")
+                session = self._start_session(submission_id, problem_id, simulation_id)
+            with stage('parse_state'):
+                data = json.loads(input_files[input_file])
+
+            from beluga_lib.problem_state import BelugaProblemState
+            from evaluation.planner_api import ProbabilisticPlanningMetatada
+
+            # Steps of the same simulation are served one at a time
+            with session.lock:
+                with stage('decode_state'):
+                    decode = self._state_decoder(session)
+                    if configuration.incremental_state:
+                        # Reuse the cached state when it matches, decode it otherwise
+                        state = session.states.resolve(data, session.prb, decode)
+                    elif decode is not None:
+                        state = decode(data['state'])
+                    else:
+                        state = BelugaProblemState.from_json_obj(data['state'], session.prb)
+                    metadata = ProbabilisticPlanningMetatada.from_json_obj(data['metadata'])
+
+                # Retrieve the next action
+                with stage('next_action'):
+                    ba = session.planner.next_action(state, metadata)
+                if configuration.incremental_state:
+                    session.states.advance(session.planner, ba)
 
             # Generate the output file
-            output_file = os.path.join(output_path, configuration.action_file_name)
+            output_file = configuration.action_file_name
             logger.debug(f"[NEXT ACTION] - Preparing to write output file: {output_file} - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
-            with open(output_file, 'w') as fp:
-                json.dump(ba.to_json_obj(), fp)
+            with stage('encode_action'):
+                output_files[output_file] = json.dumps(ba.to_json_obj()).encode()
             logger.debug(f"[NEXT ACTION] - Completed writing - Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
 
             return True
@@ -193,3 +491,33 @@ class CompetitorModelBusinessLogic:
         except Exception as e:
             logger.error(f"[NEXT ACTION] - Error during execution for Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}: {str(e)}", exc_info=True)
             return False
+
+    def _start_session(self, submission_id, problem_id, simulation_id):
+        """
+        Registers a new simulation, with its own copy of the planner prepared by
+        setup_problem, restored from its snapshot if the service was restarted since.
+        """
+        problem = session_registry.get_problem(submission_id, problem_id)
+        if problem is None and snapshots.enabled:
+            with stage('restore_snapshot'):
+                snapshot = snapshots.load(submission_id, problem_id, planner_name(self.prob_planner))
+            if snapshot is not None:
+                problem = session_registry.add_problem(submission_id, problem_id, *snapshot)
+        if problem is None:
+            raise ValueError(f"Problem {problem_id} has not been set up for submission {submission_id}")
+
+        planner = problem.new_planner()
+        planner.setup_episode()
+        return session_registry.add_session(submission_id, problem_id, simulation_id, problem.prb, planner,
+                                            problem.layout)
+
+    @staticmethod
+    def _state_decoder(session):
+        """
+        Returns the function decoding the JSON states of a simulation into
+        CompactState objects, or None for the planners using BelugaProblemState.
+        """
+        layout = session.layout
+        if layout is None:
+            return None
+        return lambda state_obj: CompactState.from_json_obj(state_obj, layout)
@@ -0,0 +1,260 @@
+import json
+import hashlib
+from array import array
+
+# Fields of the JSON state holding a jig (or null) per trailer or hangar
+SLOT_FIELDS = ('trailers_beluga', 'trailers_factory', 'hangars')
+# Field holding the list of jigs of every rack, and the jig map
+RACK_FIELD = 'racks'
+JIG_FIELD = 'jigs'
+
+# Values of CompactState.jig_empty
+JIG_ABSENT = -1
+JIG_LOADED = 0
+JIG_EMPTY = 1
+
+
+def uses_compact_states(planner):
+    """
+    Returns whether a planner opted into CompactState states, by setting its
+    compact_states attribute.
+    """
+    return bool(getattr(planner, 'compact_states', False))
+
+
+def _names(entries):
+    """
+    Returns the names of problem entities given as a name-keyed dictionary, or
+    a list of names or of objects with a name.
+    """
+    if isinstance(entries, dict):
+        return list(entries)
+    return [entry['name'] if isinstance(entry, dict) else entry for entry in entries or ()]
+
+
+class StateLayout:
+    """
+    Fixed integer indexing of the jigs, jig types, racks, trailers and hangars
+    of a problem, shared by all the CompactState objects of the problem.
+    """
+
+    __slots__ = ('jigs', 'jig_index', 'jig_types', 'jig_type_index', 'racks', 'rack_size', 'slots')
+
+    def __init__(self, jigs, jig_types, racks, rack_size, slots):
+        self.jigs = list(jigs)
+        self.jig_index = {name: index for index, name in enumerate(self.jigs)}
+        self.jig_types = list(jig_types)
+        self.jig_type_index = {name: index for index, name in enumerate(self.jig_types)}
+        self.racks = list(racks)
+        self.rack_size = array('i', rack_size)
+        # Number of trailers or hangars of every slot field
+        self.slots = dict(slots)
+
+    @classmethod
+    def from_problem_json(cls, problem_obj):
+        """
+        Derives the layout from the JSON content of a problem file.
+        """
+        racks = problem_obj.get('racks') or []
+        return cls(jigs=_names(problem_obj.get('jigs')),
+                   jig_types=_names(problem_obj.get('jig_types')),
+                   racks=_names(racks),
+                   rack_size=[rack.get('size', 0) if isinstance(rack, dict) else 0 for rack in racks],
+                   slots={field: len(problem_obj.get(field) or ()) for field in SLOT_FIELDS})
+
+
+class CompactState:
+    """
+    Array-backed representation of a BelugaProblemState, for planners that
+    explore many states per step: jigs are referred to by their index in the
+    layout of the problem, so that a state is a handful of flat buffers instead
+    of an object graph, and states can be copied, compared and hashed cheaply.
+
+    - jig_empty and jig_type hold the flags and type index of every jig of the
+      layout (JIG_ABSENT and -1 for the jigs missing from the state),
+    - slots maps the trailer and hangar fields to the jig index in every slot
+      (-1 when the slot is free),
+    - the jigs of rack r are rack_jigs[rack_offsets[r]:rack_offsets[r + 1]].
+
+    Fields of the JSON state without a compact representation (or not in the
+    expected shape) are kept as they are in extra, so that to_json_obj always
+    reproduces the original state. They are shared between copies, so they must
+    not be modified.
+    """
+
+    __slots__ = ('layout', 'jig_empty', 'jig_type', 'jig_names', 'slots', 'rack_jigs', 'rack_offsets',
+                 'extra', '_key')
+
+    def __init__(self, layout):
+        self.layout = layout
+        self.jig_empty = None
+        self.jig_type = None
+        # Whether the jig entries of the JSON state repeat the name of the jig
+        self.jig_names = False
+        self.slots = {}
+        self.rack_jigs = None
+        self.rack_offsets = None
+        self.extra = {}
+        self._key = None
+
+    @classmethod
+    def from_json_obj(cls, state_obj, layout):
+        """
+        Encodes the JSON content of a state.
+        """
+        state = cls(layout)
+        for field, value in state_obj.items():
+            if field == JIG_FIELD:
+                encoded = state._encode_jigs(value)
+            elif field == RACK_FIELD:
+                encoded = state._encode_racks(value)
+            elif field in SLOT_FIELDS:
+                encoded = state._encode_slots(field, value)
+            else:
+                encoded = False
+            if not encoded:
+                state.extra[field] = value
+        return state
+
+    @classmethod
+    def from_problem_state(cls, problem_state, layout):
+        return cls.from_json_obj(problem_state.to_json_obj(), layout)
+
+    def to_json_obj(self):
+        """
+        Returns the JSON content of the state.
+        """
+        layout = self.layout
+        state_obj = dict(self.extra)
+        if self.jig_empty is not None:
+            jigs = {}
+            for index, empty in enumerate(self.jig_empty):
+                if empty == JIG_ABSENT:
+                    continue
+                name = layout.jigs[index]
+                entry = {'name': name} if self.jig_names else {}
+                entry['type'] = layout.jig_types[self.jig_type[index]]
+                entry['empty'] = empty == JIG_EMPTY
+                jigs[name] = entry
+            state_obj[JIG_FIELD] = jigs
+        if self.rack_jigs is not None:
+            offsets = self.rack_offsets
+            state_obj[RACK_FIELD] = [[layout.jigs[index] for index in self.rack_jigs[offsets[rack]:offsets[rack + 1]]]
+                                     for rack in range(len(offsets) - 1)]
+        for field, slots in self.slots.items():
+            state_obj[field] = [layout.jigs[index] if index >= 0 else None for index in slots]
+        return state_obj
+
+    def to_problem_state(self, prb):
+        """
+        Decodes the state into a BelugaProblemState of the problem prb.
+        """
+        from beluga_lib.problem_state import BelugaProblemState
+        return BelugaProblemState.from_json_obj(self.to_json_obj(), prb)
+
+    def rack(self, rack):
+        """
+        Returns the indexes of the jigs of a rack.
+        """
+        return self.rack_jigs[self.rack_offsets[rack]:self.rack_offsets[rack + 1]]
+
+    def copy(self):
+        """
+        Returns a copy of the state whose buffers can be modified independently.
+        """
+        state = CompactState(self.layout)
+        state.jig_empty = None if self.jig_empty is None else array('b', self.jig_empty)
+        state.jig_type = None if self.jig_type is None else array('h', self.jig_type)
+        state.jig_names = self.jig_names
+        state.slots = {field: array('i', slots) for field, slots in self.slots.items()}
+        state.rack_jigs = None if self.rack_jigs is None else array('i', self.rack_jigs)
+        state.rack_offsets = None if self.rack_offsets is None else array('i', self.rack_offsets)
+        state.extra = self.extra
+        return state
+
+    def key(self):
+        """
+        Returns a bytes key identifying the content of the state, cached until
+        invalidate() is called (after the buffers are modified in place).
+        """
+        if self._key is None:
+            digest = hashlib.blake2b(digest_size=16)
+            for buffer in (self.jig_empty, self.jig_type, self.rack_jigs, self.rack_offsets):
+                digest.update(b'|' if buffer is None else buffer.tobytes() + b'|')
+            for field in sorted(self.slots):
+                digest.update(field.encode() + self.slots[field].tobytes())
+            if self.extra:
+                digest.update(json.dumps(self.extra, sort_keys=True, separators=(',', ':')).encode())
+            self._key = digest.digest()
+        return self._key
+
+    def invalidate(self):
+        self._key = None
+
+    def __eq__(self, other):
+        return isinstance(other, CompactState) and self.layout is other.layout and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def _encode_jigs(self, jigs):
+        layout = self.layout
+        if not isinstance(jigs, dict):
+            return False
+        jig_empty = array('b', [JIG_ABSENT]) * len(layout.jigs)
+        jig_type = array('h', [-1]) * len(layout.jigs)
+        jig_names = None
+        for name, entry in jigs.items():
+            index = layout.jig_index.get(name)
+            if index is None or not isinstance(entry, dict) or not isinstance(entry.get('empty'), bool):
+                return False
+            type_index = layout.jig_type_index.get(entry.get('type'))
+            if type_index is None:
+                return False
+            # Entries either all repeat the jig name or none does, and have no other field
+            has_name = 'name' in entry
+            if jig_names is None:
+                jig_names = has_name
+            if has_name != jig_names or (has_name and entry['name'] != name) or len(entry) != 2 + has_name:
+                return False
+            jig_empty[index] = JIG_EMPTY if entry['empty'] else JIG_LOADED
+            jig_type[index] = type_index
+        self.jig_empty = jig_empty
+        self.jig_type = jig_type
+        self.jig_names = bool(jig_names)
+        return True
+
+    def _encode_racks(self, racks):
+        jig_index = self.layout.jig_index
+        if not isinstance(racks, list) or len(racks) != len(self.layout.racks):
+            return False
+        rack_jigs = array('i')
+        rack_offsets = array('i', [0])
+        for jigs in racks:
+            if not isinstance(jigs, list):
+                return False
+            for name in jigs:
+                index = jig_index.get(name) if isinstance(name, str) else None
+                if index is None:
+                    return False
+                rack_jigs.append(index)
+            rack_offsets.append(len(rack_jigs))
+        self.rack_jigs = rack_jigs
+        self.rack_offsets = rack_offsets
+        return True
+
+    def _encode_slots(self, field, slots):
+        jig_index = self.layout.jig_index
+        if not isinstance(slots, list) or len(slots) != self.layout.slots.get(field):
+            return False
+        encoded = array('i')
+        for name in slots:
+            if name is None:
+                encoded.append(-1)
+                continue
+            index = jig_index.get(name) if isinstance(name, str) else None
+            if index is None:
+                return False
+            encoded.append(index)
+        self.slots[field] = encoded
+        return True
@@ -0,0 +1,31 @@
+import os
+import weakref
+import threading
+
+# Objects owning fork-safe locks, mapped to the names of their lock attributes
+_owners = weakref.WeakKeyDictionary()
+_owners_lock = threading.Lock()
+
+
+def fork_safe_lock(owner, attr='_lock'):
+    """
+    Sets owner.attr to a new lock and returns it. Forked child processes get a
+    fresh lock in its place, since they may inherit it while another thread of
+    the parent holds it.
+    """
+    lock = threading.Lock()
+    setattr(owner, attr, lock)
+    with _owners_lock:
+        _owners.setdefault(owner, set()).add(attr)
+    return lock
+
+
+def _reset_locks():
+    global _owners_lock
+    _owners_lock = threading.Lock()
+    for owner, attrs in list(_owners.items()):
+        for attr in attrs:
+            setattr(owner, attr, threading.Lock())
+
+
+os.register_at_fork(after_in_child=_reset_locks)
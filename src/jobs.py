@@ -0,0 +1,124 @@
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when a job is submitted while the queue is at capacity.
+    """
+
+
+class Job:
+    """
+    A long-running call executed in the background. Its status goes from
+    'queued' to 'running' and then to 'done' or 'failed'.
+    """
+
+    def __init__(self, kind, params):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_json_obj(self):
+        return {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    Bounded queue of background jobs, run by a fixed number of executors.
+
+    At most max_pending jobs can be queued or running at the same time; further
+    submissions raise JobQueueFull. Finished jobs are kept for retention seconds,
+    so that their results can be fetched (and fetched again on retries), and at
+    most max_finished of them are kept (the oldest ones are dropped first), as
+    their results can be whole plan zips.
+    """
+
+    def __init__(self, executors, max_pending, retention, max_finished=128):
+        self.max_pending = max_pending
+        self.retention = retention
+        self.max_finished = max_finished
+
+        self._executor = ThreadPoolExecutor(max_workers=executors, thread_name_prefix='job')
+        self._jobs = {}
+        self._pending = 0
+        # Ids of the finished jobs, oldest first
+        self._finished = OrderedDict()
+        self._evicted = 0
+        self._lock = threading.Lock()
+
+    def submit(self, kind, params, fn, *args):
+        """
+        Schedules fn(*args) and returns the corresponding job. The value returned
+        by fn becomes the job result.
+        """
+        with self._lock:
+            self._expire(time.time())
+            if self._pending >= self.max_pending:
+                raise JobQueueFull(f"The job queue is full ({self.max_pending} pending jobs)")
+            job = Job(kind, params)
+            self._jobs[job.job_id] = job
+            self._pending += 1
+
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            self._expire(time.time())
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {'jobs': len(self._jobs), 'pending': self._pending, 'max_pending': self.max_pending,
+                    'finished': len(self._finished), 'max_finished': self.max_finished, 'evicted': self._evicted}
+
+    def _run(self, job, fn, args):
+        job.status = 'running'
+        job.started_at = time.time()
+        try:
+            job.result = fn(*args)
+            job.status = 'done'
+        except Exception as e:
+            logger.error(f"[JOB] - Job {job.job_id} ({job.kind}) failed: {str(e)}", exc_info=True)
+            job.error = str(e)
+            job.status = 'failed'
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                self._pending -= 1
+                self._finished[job.job_id] = None
+                while len(self._finished) > self.max_finished:
+                    job_id, _ = self._finished.popitem(last=False)
+                    del self._jobs[job_id]
+                    self._evicted += 1
+
+    def _expire(self, now):
+        # Finished jobs are kept in the order in which they finished
+        while self._finished:
+            job_id = next(iter(self._finished))
+            if now - self._jobs[job_id].finished_at <= self.retention:
+                break
+            del self._finished[job_id]
+            del self._jobs[job_id]
@@ -0,0 +1,217 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from src.forks import fork_safe_lock
+
+logger = logging.getLogger(__name__)
+
+PLAN_EXTENSION = '.zip'
+
+# Types of the planner attributes that make up its settings in the cache keys
+SETTING_TYPES = (bool, int, float, str, type(None))
+
+
+def planner_settings(planner):
+    """
+    Returns the settings of a planner as a canonical string: its public
+    attributes of scalar types (e.g. max_steps or time_limit), or the result of
+    its plan_cache_settings() method when it defines one.
+    """
+    settings_fn = getattr(planner, 'plan_cache_settings', None)
+    if settings_fn is not None:
+        settings = settings_fn()
+    else:
+        settings = {name: value for name, value in vars(planner).items()
+                    if not name.startswith('_') and isinstance(value, SETTING_TYPES)}
+    return json.dumps(settings, sort_keys=True, default=repr)
+
+
+class PlanCache:
+    """
+    Cache of the /plan results (the output zip, served as it is), keyed by the
+    hash of the problem file, the identity of the planner (its class, settings
+    and the configured version) and the time budget of the call.
+
+    Results are kept in a bounded in-memory LRU and, when a directory is given,
+    in one file per result on disk, so that they survive restarts. The files
+    least recently used are deleted once they exceed max_disk_bytes. Concurrent
+    calls for the same key wait for a single computation instead of planning
+    the same problem in parallel.
+    """
+
+    def __init__(self, directory=None, max_entries=256, max_disk_bytes=1024 * 1024 * 1024, enabled=True):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.enabled = enabled
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.stored = 0
+        self.evicted_files = 0
+
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        fork_safe_lock(self)
+
+    @staticmethod
+    def key(problem_hash, planner_identity, time_budget=None):
+        return hashlib.sha256(f"{problem_hash}:{planner_identity}:{time_budget or 0}".encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + PLAN_EXTENSION)
+
+    def get(self, key):
+        """
+        Returns the cached output zip for key, or None.
+        """
+        with self._lock:
+            output_zip = self._entries.get(key)
+            if output_zip is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return output_zip
+
+        if self.directory is None:
+            return None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                output_zip = f.read()
+            # The modification time orders the files for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"[PLAN CACHE] - Could not read the cached plan {key}: {str(e)}")
+            return None
+
+        self._remember(key, output_zip)
+        with self._lock:
+            self.disk_hits += 1
+        return output_zip
+
+    def put(self, key, output_zip):
+        """
+        Stores an output zip in memory and, if enabled, on disk. Disk failures
+        are logged and otherwise ignored.
+        """
+        self._remember(key, output_zip)
+        with self._lock:
+            self.stored += 1
+        if self.directory is None:
+            return
+
+        path = self.path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                f.write(output_zip)
+            # Readers only ever see complete files
+            os.replace(temp_path, path)
+            self._trim_disk()
+        except OSError as e:
+            logger.warning(f"[PLAN CACHE] - Could not store the cached plan {key}: {str(e)}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _trim_disk(self):
+        """
+        Deletes the least recently used files until the directory fits in
+        max_disk_bytes. The directory is scanned rather than tracked, since it
+        may be shared by several worker processes.
+        """
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(PLAN_EXTENSION):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            with self._lock:
+                self.evicted_files += 1
+
+    def get_or_compute(self, key, compute):
+        """
+        Returns (output_zip, plan_status, cache_status) for key. On a miss,
+        compute() returns (output_zip, plan_status, cacheable) and its result is
+        shared with the identical calls made in the meantime; it is only stored
+        when cacheable. cache_status is 'hit', 'shared' or 'miss'.
+        """
+        output_zip = self.get(key)
+        if output_zip is not None:
+            return output_zip, 'ok', 'hit'
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.misses += 1
+            else:
+                self.shared += 1
+        if not leader:
+            output_zip, plan_status = future.result()
+            return output_zip, plan_status, 'shared'
+
+        try:
+            output_zip, plan_status, cacheable = compute()
+            if cacheable:
+                self.put(key, output_zip)
+            future.set_result((output_zip, plan_status))
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return output_zip, plan_status, 'miss'
+
+    def clear(self):
+        """
+        Removes the cached plans from memory (the files on disk are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'shared': self.shared,
+                'stored': self.stored,
+                'evicted_files': self.evicted_files,
+                'in_flight': len(self._in_flight),
+            }
+
+    def _remember(self, key, output_zip):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = output_zip
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
@@ -0,0 +1,167 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+
+from src.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+
+class PlanTimeout(Exception):
+    """
+    Raised when a planning call exceeds its time budget. The worker process
+    running it has already been killed and replaced.
+    """
+
+    def __init__(self, time_budget):
+        super().__init__(f"Planning exceeded the time budget of {time_budget} seconds")
+        self.time_budget = time_budget
+
+
+class PlanWorkerError(Exception):
+    """
+    Raised when a worker process dies while serving a call.
+    """
+
+
+def _plan_worker(conn, factory, submission_ids):
+    """
+    Main loop of a worker process: builds its own business logic object and
+    serves the commands sent by the parent process.
+    """
+    logic = factory()
+    for submission_id in submission_ids:
+        logic.setup(submission_id)
+
+    while True:
+        try:
+            command, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if command == 'setup':
+            logic.setup(*args)
+            conn.send((True, None))
+        elif command == 'plan':
+            *args, profile_path = args
+            output_files = {}
+            with profiled(profile_path):
+                success = logic.plan(*args, output_files)
+            conn.send((success, output_files))
+
+
+class PlanProcess:
+    """
+    A worker process, together with the pipe used to talk to it.
+    """
+
+    def __init__(self, context, factory, submission_ids):
+        self.context = context
+        self.factory = factory
+        self.process = None
+        self.conn = None
+        self.start(submission_ids)
+
+    def start(self, submission_ids):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_plan_worker, args=(child_conn, self.factory, list(submission_ids)),
+                                            daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def stop(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+    def call(self, command, args, timeout=None):
+        """
+        Sends a command to the worker and waits for its result. Returns None if
+        the result is not available within timeout seconds.
+        """
+        try:
+            self.conn.send((command, args))
+            if not self.conn.poll(timeout):
+                return None
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise PlanWorkerError(f"Plan worker process {self.process.pid} died: {str(e)}") from e
+
+
+class PlanProcessPool:
+    """
+    Pool of worker processes serving /plan calls, so that planning can use
+    several cores and can be hard-cancelled when it exceeds its time budget
+    (the worker is killed and a fresh one takes its place). The workers start
+    with the setup of the given submissions.
+    """
+
+    def __init__(self, factory, size, submission_ids=()):
+        if size < 1:
+            raise ValueError(f"The pool size must be positive, got {size}")
+        self.size = size
+        self.factory = factory
+        self.context = multiprocessing.get_context('fork')
+
+        # Submissions that have been set up, replayed on replacement workers
+        self._submission_ids = list(submission_ids)
+        self._setup_lock = threading.Lock()
+
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(PlanProcess(self.context, factory, self._submission_ids))
+
+    def setup(self, submission_id):
+        """
+        Runs the submission setup on every worker process.
+        """
+        with self._setup_lock:
+            if submission_id not in self._submission_ids:
+                self._submission_ids.append(submission_id)
+            workers = [self._idle.get() for _ in range(self.size)]
+            try:
+                for worker in workers:
+                    try:
+                        worker.call('setup', (submission_id,))
+                    except PlanWorkerError:
+                        self._replace(worker)
+                        raise
+            finally:
+                for worker in workers:
+                    self._idle.put(worker)
+
+    def plan(self, submission_id, problem_id, input_files, time_budget=None, profile_path=None):
+        """
+        Runs the planning business logic in a worker process and returns its
+        output files. Raises PlanTimeout if no result is available within
+        time_budget seconds (None means no limit). When profile_path is given,
+        the call is profiled by the worker.
+        """
+        worker = self._idle.get()
+        try:
+            start = time.monotonic()
+            result = worker.call('plan', (submission_id, problem_id, input_files, profile_path), time_budget)
+            if result is None:
+                logger.warning(f"[PLAN PROCESS] - Time budget of {time_budget}s exceeded, recycling worker {worker.process.pid} - Submission ID: {submission_id}, Problem ID: {problem_id}")
+                self._replace(worker)
+                raise PlanTimeout(time_budget)
+            logger.debug(f"[PLAN PROCESS] - Plan computed in {time.monotonic() - start:.3f}s by worker {worker.process.pid}")
+            _, output_files = result
+            return output_files
+        except PlanWorkerError:
+            self._replace(worker)
+            raise
+        finally:
+            self._idle.put(worker)
+
+    def shutdown(self):
+        for _ in range(self.size):
+            self._idle.get().stop()
+
+    def _replace(self, worker):
+        worker.stop()
+        worker.start(self._submission_ids)
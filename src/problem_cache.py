@@ -0,0 +1,100 @@
+import hashlib
+from collections import OrderedDict
+
+from src.forks import fork_safe_lock
+
+
+def problem_hash(raw_problem):
+    """
+    Returns the content hash used to identify a raw problem file.
+    """
+    if isinstance(raw_problem, str):
+        raw_problem = raw_problem.encode()
+    return hashlib.sha256(raw_problem).hexdigest()
+
+
+class ProblemCache:
+    """
+    Bounded LRU cache of decoded Beluga problems, keyed by the hash of the raw
+    problem file.
+
+    The memory limit is enforced on the size of the raw problem files, which is
+    a cheap and stable proxy for the size of the decoded objects. Cached
+    problems are shared between calls, so planners must not modify them.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=512 * 1024 * 1024, enabled=True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._size = 0
+        fork_safe_lock(self)
+
+    def get_or_decode(self, raw_problem, decode):
+        """
+        Returns the decoded problem for the given raw content, calling decode
+        on a cache miss.
+        """
+        if not self.enabled:
+            return decode(raw_problem)
+
+        key = problem_hash(raw_problem)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # Decode outside of the lock, so that misses do not serialize the callers
+        prb = decode(raw_problem)
+        self.put(key, prb, len(raw_problem))
+        return prb
+
+    def put(self, key, prb, size):
+        """
+        Stores a decoded problem, evicting the least recently used ones if needed.
+        """
+        if not self.enabled or size > self.max_bytes:
+            return
+
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous[1]
+            self._entries[key] = (prb, size)
+            self._size += size
+
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all the cached problems.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def stats(self):
+        """
+        Returns the cache counters as a dictionary.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
@@ -0,0 +1,109 @@
+import io
+import os
+import re
+import time
+import pstats
+import random
+import logging
+import cProfile
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PROFILE_EXTENSION = '.prof'
+SUMMARY_EXTENSION = '.txt'
+
+
+def write_profile(profile, path):
+    """
+    Writes a finished profile as a pstats dump (path + '.prof'), readable with
+    pstats, snakeviz or flameprof, and as a text summary sorted by cumulative
+    time (path + '.txt').
+    """
+    profile.dump_stats(path + PROFILE_EXTENSION)
+    summary = io.StringIO()
+    pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(50)
+    with open(path + SUMMARY_EXTENSION, 'w') as f:
+        f.write(summary.getvalue())
+
+
+@contextmanager
+def profiled(path):
+    """
+    Runs the block under cProfile and writes the profile to path. Does nothing
+    if path is None, or if another profiler is already active.
+    """
+    if path is None:
+        yield
+        return
+
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError as e:
+        logger.warning(f"[PROFILING] - Could not start the profiler: {str(e)}")
+        yield
+        return
+
+    try:
+        yield
+    finally:
+        profile.disable()
+        try:
+            write_profile(profile, path)
+            logger.info(f"[PROFILING] - Profile written to {path}{PROFILE_EXTENSION}")
+        except Exception as e:
+            logger.error(f"[PROFILING] - Failed to write the profile {path}: {str(e)}", exc_info=True)
+
+
+class ProfileStore:
+    """
+    Directory of the captured profiles. Requests are profiled when they ask
+    for it, or at random with the given sample rate; only the max_profiles most
+    recent profiles are kept.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, max_profiles=100):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_profiles = max_profiles
+
+    def should_profile(self, requested):
+        return requested or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def new_path(self, kind, *ids):
+        """
+        Returns the path (without extension) of a new profile for a call of the given kind.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        self._trim()
+        parts = [kind, *ids, time.strftime('%Y%m%d-%H%M%S'), f"{time.time_ns() % 1000000:06d}"]
+        name = '-'.join(re.sub(r'[^A-Za-z0-9_.]+', '_', str(part)) for part in parts)
+        return os.path.join(self.directory, name)
+
+    def list(self):
+        """
+        Returns the captured profiles, most recent first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file():
+                stat = entry.stat()
+                profiles.append({'name': entry.name, 'bytes': stat.st_size, 'created_at': stat.st_mtime})
+        return sorted(profiles, key=lambda profile: profile['created_at'], reverse=True)
+
+    def _trim(self):
+        # Make room for the new profile, dropping the oldest ones
+        names = []
+        for profile in self.list():
+            name = os.path.splitext(profile['name'])[0]
+            if name not in names:
+                names.append(name)
+        for name in names[max(0, self.max_profiles - 1):]:
+            for extension in (PROFILE_EXTENSION, SUMMARY_EXTENSION):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except OSError:
+                    pass
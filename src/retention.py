@@ -0,0 +1,212 @@
+import os
+import time
+import queue
+import shutil
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Sub-directories that make up a persisted execution
+EXECUTION_DIRS = ('input', 'output', 'temp')
+
+# Marker file stored in the temp directory of failed executions
+FAILED_MARKER = 'failed'
+
+RETENTION_MODES = ('all', 'none', 'failures', 'last_n', 'ttl')
+
+# Number of locks the execution paths are spread over
+PATH_LOCKS = 64
+
+
+class RetentionManager:
+    """
+    Applies the retention policy of the executions persisted under base_path:
+
+    - 'all' keeps every execution;
+    - 'none' deletes every execution once its request is complete;
+    - 'failures' only keeps failed executions;
+    - 'last_n' keeps the keep_last most recent executions;
+    - 'ttl' keeps executions for keep_minutes minutes.
+
+    Deletions happen on a background thread, off the request path, which also
+    periodically measures the disk usage of base_path. Identical requests share
+    their execution path, so an execution is never deleted while a request
+    writes it (see writing).
+    """
+
+    def __init__(self, base_path, mode='all', keep_last=100, keep_minutes=60, sweep_interval=60):
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"Unknown retention mode {mode}, expected one of {', '.join(RETENTION_MODES)}")
+        self.base_path = base_path
+        self.mode = mode
+        self.keep_last = keep_last
+        self.keep_minutes = keep_minutes
+        self.sweep_interval = sweep_interval
+
+        self.deleted_executions = 0
+        self.deleted_bytes = 0
+        self.usage = {'bytes': 0, 'files': 0, 'directories': 0, 'executions': 0, 'measured_at': None}
+
+        self._recent = deque()
+        self._deletions = queue.Queue()
+        self._lock = threading.Lock()
+        self._path_locks = [threading.Lock() for _ in range(PATH_LOCKS)]
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background thread, after scanning the executions already on disk.
+        """
+        if self._thread is not None:
+            return
+        if self.mode == 'last_n':
+            executions = sorted(self._scan(), key=lambda execution: execution[1])
+            self._recent.extend(path for path, _, _ in executions)
+            self._trim_recent()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    @contextmanager
+    def writing(self, execution_path):
+        """
+        Holds off the deletion of an execution while the body of the with
+        statement writes it.
+        """
+        with self._path_lock(execution_path):
+            yield
+
+    def record(self, execution_path, failed=False):
+        """
+        Records a persisted execution, scheduling its deletion if the policy says so.
+        """
+        marker_path = os.path.join(execution_path, 'temp', FAILED_MARKER)
+        if failed:
+            # Leave a marker, so that failures can be told apart on later scans
+            with open(marker_path, 'w'):
+                pass
+        else:
+            # The execution overwrote a failure persisted to the same path
+            try:
+                os.remove(marker_path)
+            except FileNotFoundError:
+                pass
+
+        if self.mode == 'none' or (self.mode == 'failures' and not failed):
+            self._deletions.put(execution_path)
+        elif self.mode == 'last_n':
+            with self._lock:
+                if execution_path in self._recent:
+                    self._recent.remove(execution_path)
+                self._recent.append(execution_path)
+                self._trim_recent()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'pending_deletions': self._deletions.qsize(),
+                'deleted_executions': self.deleted_executions,
+                'deleted_bytes': self.deleted_bytes,
+                'usage': dict(self.usage),
+            }
+
+    def _trim_recent(self):
+        while len(self._recent) > self.keep_last:
+            self._deletions.put(self._recent.popleft())
+
+    def _run(self):
+        next_sweep = time.monotonic()
+        while True:
+            try:
+                execution_path = self._deletions.get(timeout=max(0.0, next_sweep - time.monotonic()))
+                self._delete(execution_path)
+            except queue.Empty:
+                pass
+            except Exception as e:
+                logger.error(f"[RETENTION] - Error while deleting an execution: {str(e)}", exc_info=True)
+
+            if time.monotonic() >= next_sweep:
+                try:
+                    self._sweep()
+                except Exception as e:
+                    logger.error(f"[RETENTION] - Error while sweeping {self.base_path}: {str(e)}", exc_info=True)
+                next_sweep = time.monotonic() + self.sweep_interval
+
+    def _sweep(self):
+        """
+        Deletes expired executions (in 'ttl' mode) and measures the disk usage.
+        """
+        now = time.time()
+        executions = self._scan()
+        if self.mode == 'ttl':
+            for path, modified_at, _ in executions:
+                if now - modified_at > self.keep_minutes * 60:
+                    self._delete(path)
+
+        usage = {'bytes': 0, 'files': 0, 'directories': 0, 'executions': 0, 'measured_at': now}
+        for root, dirs, files in os.walk(self.base_path):
+            usage['directories'] += len(dirs)
+            usage['files'] += len(files)
+            for name in files:
+                try:
+                    usage['bytes'] += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+            if 'temp' in dirs:
+                usage['executions'] += 1
+        with self._lock:
+            self.usage = usage
+
+    def _scan(self):
+        """
+        Returns the (path, modification time, failed) triples of the executions on disk.
+        """
+        executions = []
+        for root, dirs, _ in os.walk(self.base_path):
+            if 'temp' in dirs:
+                temp_path = os.path.join(root, 'temp')
+                failed = os.path.exists(os.path.join(temp_path, FAILED_MARKER))
+                executions.append((root, os.path.getmtime(temp_path), failed))
+        return executions
+
+    def _path_lock(self, execution_path):
+        return self._path_locks[hash(os.path.abspath(execution_path)) % PATH_LOCKS]
+
+    def _delete(self, execution_path):
+        """
+        Deletes the input/output/temp directories of an execution, then the
+        parent directories left empty (nested executions are preserved). In
+        'failures' mode, an execution that failed since its deletion was
+        scheduled is kept.
+        """
+        with self._path_lock(execution_path):
+            if self.mode == 'failures' and os.path.exists(os.path.join(execution_path, 'temp', FAILED_MARKER)):
+                return
+
+            size = 0
+            for name in EXECUTION_DIRS:
+                path = os.path.join(execution_path, name)
+                for root, _, files in os.walk(path):
+                    for file_name in files:
+                        try:
+                            size += os.path.getsize(os.path.join(root, file_name))
+                        except OSError:
+                            pass
+                shutil.rmtree(path, ignore_errors=True)
+
+            base_path = os.path.abspath(self.base_path)
+            path = os.path.abspath(execution_path)
+            while path != base_path and path.startswith(base_path):
+                try:
+                    os.rmdir(path)
+                except OSError:
+                    break
+                path = os.path.dirname(path)
+
+        with self._lock:
+            self.deleted_executions += 1
+            self.deleted_bytes += size
+        logger.debug(f"[RETENTION] - Deleted execution {execution_path} ({size} bytes)")
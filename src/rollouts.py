@@ -0,0 +1,324 @@
+import io
+import os
+import math
+import time
+import queue
+import pickle
+import random
+import logging
+import multiprocessing
+from collections import OrderedDict
+
+from src.forks import fork_safe_lock
+
+logger = logging.getLogger(__name__)
+
+# Seconds a worker may overrun the deadline (to finish its current rollout)
+# before it is killed and replaced
+DEADLINE_GRACE = 0.05
+
+
+class RolloutStats:
+    """
+    Aggregated returns of the rollouts of a candidate action.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._m2 = 0.0
+
+    def add(self, value):
+        # Welford's online algorithm
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    @property
+    def std(self):
+        return math.sqrt(self._m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    def to_json_obj(self):
+        return {'count': self.count, 'mean': self.mean, 'std': self.std,
+                'min': self.min if self.count else None, 'max': self.max if self.count else None}
+
+
+def _run_jobs(prb, rollout_fn, jobs, deadline):
+    """
+    Runs rollout jobs (index, state, action, horizon, seed) until the deadline,
+    returning the (index, value) of the completed ones. A rollout is only
+    started when the longest one so far would still end before the deadline.
+    """
+    results = []
+    longest = 0.0
+    for index, state, action, horizon, seed in jobs:
+        start = time.time()
+        if deadline is not None and start + longest >= deadline:
+            break
+        results.append((index, rollout_fn(prb, state, action, horizon, random.Random(seed))))
+        longest = max(longest, time.time() - start)
+    return results
+
+
+class _ProblemPickler(pickle.Pickler):
+    """
+    Pickles the references to a problem (e.g. from the states of the jobs) as
+    its key, since the workers already hold their own copy of it.
+    """
+
+    def __init__(self, file, prb, key):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.prb = prb
+        self.key = key
+
+    def persistent_id(self, obj):
+        if obj is self.prb and obj is not None:
+            return self.key
+        return None
+
+
+class _ProblemUnpickler(pickle.Unpickler):
+    """
+    Resolves the problem keys pickled by _ProblemPickler to the copies held by a worker.
+    """
+
+    def __init__(self, file, problems):
+        super().__init__(file)
+        self.problems = problems
+
+    def persistent_load(self, key):
+        return self.problems[key]
+
+
+def _dump_batch(prb, key, batch):
+    buffer = io.BytesIO()
+    _ProblemPickler(buffer, prb, key).dump(batch)
+    return buffer.getvalue()
+
+
+def _rollout_worker(conn):
+    """
+    Main loop of a worker process: keeps the problems it is sent, and runs the
+    batches of rollouts sent by the parent process.
+    """
+    problems = {}
+    while True:
+        try:
+            command, args = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if command == 'problem':
+            key, prb = args
+            problems[key] = prb
+        elif command == 'drop':
+            for key in args:
+                problems.pop(key, None)
+        elif command == 'run':
+            try:
+                key, rollout_fn, jobs, deadline = _ProblemUnpickler(io.BytesIO(args), problems).load()
+                conn.send((_run_jobs(problems[key], rollout_fn, jobs, deadline), None))
+            except Exception as e:
+                conn.send(([], f"{type(e).__name__}: {str(e)}"))
+
+
+class RolloutProcess:
+    """
+    A worker process, the pipe used to talk to it, and the keys of the problems it holds.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.problems = set()
+        self.start()
+
+    def start(self):
+        parent_conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(target=_rollout_worker, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+        self.problems = set()
+
+    def stop(self):
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+
+
+class RolloutPool:
+    """
+    Pool of worker processes running Monte-Carlo rollouts for the probabilistic
+    planners, so that a step can evaluate many rollouts on every core.
+
+    A rollout is computed by rollout_fn(prb, state, action, horizon, rng), a
+    module-level function provided by the planner, which returns the value of
+    the rollout (e.g. its cumulated reward). Every worker keeps its own copy of
+    the decoded problems, sent once; states and actions are sent with every
+    batch, with their references to the problem replaced by its key. Jobs are
+    spread over the idle workers and cut off at the time budget: workers stop
+    starting new rollouts at the deadline, and a worker still busy shortly
+    after it is killed and replaced.
+
+    The processes are started on first use, in the process that uses the pool.
+    With size 0, rollouts run inline in the calling thread.
+    """
+
+    def __init__(self, size, max_problems=8):
+        if size < 0:
+            raise ValueError(f"The pool size must not be negative, got {size}")
+        self.size = size
+        self.max_problems = max_problems
+
+        self.batches = 0
+        self.rollouts = 0
+        self.recycled = 0
+
+        self._pid = None
+        self._idle = None
+        self._problems = OrderedDict()
+        self._next_key = 0
+        fork_safe_lock(self)
+
+    def evaluate(self, prb, rollout_fn, state, actions, horizon, *, time_budget, samples=1, seed=None):
+        """
+        Runs samples rollouts of the given horizon for each candidate action
+        from state, within time_budget seconds, and returns a RolloutStats per
+        action. The budget is required, since the step deadline is up to the
+        planner; pass None explicitly to run every rollout. Samples are
+        interleaved across the actions, so that the rollouts cut off by the
+        deadline are spread evenly.
+        """
+        rng = random.Random(seed)
+        jobs = [(index, state, action, horizon, rng.getrandbits(64))
+                for _ in range(samples) for index, action in enumerate(actions)]
+        stats = [RolloutStats() for _ in actions]
+        for index, value in self.run(prb, rollout_fn, jobs, time_budget):
+            stats[index].add(value)
+        return stats
+
+    def run(self, prb, rollout_fn, jobs, time_budget):
+        """
+        Runs a batch of rollout jobs (index, state, action, horizon, seed) and
+        returns the (index, value) of the ones completed within time_budget
+        seconds (None means no limit).
+        """
+        deadline = time.time() + time_budget if time_budget is not None else None
+        with self._lock:
+            self.batches += 1
+
+        if self.size == 0:
+            results = _run_jobs(prb, rollout_fn, jobs, deadline)
+            with self._lock:
+                self.rollouts += len(results)
+            return results
+
+        self._ensure_started()
+        key, live_keys = self._problem_key(prb)
+
+        # Use every idle worker, waiting for one if they are all busy
+        workers = [self._idle.get()]
+        while len(workers) < self.size:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+
+        results = []
+        try:
+            sent = []
+            for offset, worker in enumerate(workers):
+                worker_jobs = jobs[offset::len(workers)]
+                if not worker_jobs:
+                    continue
+                try:
+                    stale = worker.problems - live_keys
+                    if stale:
+                        worker.conn.send(('drop', list(stale)))
+                        worker.problems -= stale
+                    if key not in worker.problems:
+                        worker.conn.send(('problem', (key, prb)))
+                        worker.problems.add(key)
+                    worker.conn.send(('run', _dump_batch(prb, key, (key, rollout_fn, worker_jobs, deadline))))
+                    sent.append(worker)
+                except (EOFError, OSError) as e:
+                    logger.warning(f"[ROLLOUTS] - Worker {worker.process.pid} died, replacing it: {str(e)}")
+                    self._replace(worker)
+
+            for worker in sent:
+                timeout = None if deadline is None else max(0.0, deadline + DEADLINE_GRACE - time.time())
+                try:
+                    if not worker.conn.poll(timeout):
+                        logger.warning(f"[ROLLOUTS] - Worker {worker.process.pid} exceeded the time budget, recycling it")
+                        self._replace(worker)
+                        continue
+                    worker_results, error = worker.conn.recv()
+                except (EOFError, OSError) as e:
+                    logger.warning(f"[ROLLOUTS] - Worker {worker.process.pid} died, replacing it: {str(e)}")
+                    self._replace(worker)
+                    continue
+                if error is not None:
+                    logger.error(f"[ROLLOUTS] - Rollout failed in worker {worker.process.pid}: {error}")
+                results.extend(worker_results)
+        finally:
+            for worker in workers:
+                self._idle.put(worker)
+
+        with self._lock:
+            self.rollouts += len(results)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            for _ in range(self.size):
+                self._idle.get().stop()
+            self._pid = None
+
+    def stats(self):
+        with self._lock:
+            return {'processes': self.size, 'batches': self.batches, 'rollouts': self.rollouts,
+                    'recycled': self.recycled}
+
+    def _ensure_started(self):
+        # Forked processes (e.g. server workers) start their own pool
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            context = multiprocessing.get_context('fork')
+            self._idle = queue.LifoQueue()
+            for _ in range(self.size):
+                self._idle.put(RolloutProcess(context))
+            self._problems = OrderedDict()
+            self._pid = os.getpid()
+
+    def _problem_key(self, prb):
+        """
+        Returns the key under which the workers hold prb, and the keys of all
+        the problems still held. The pool keeps a reference to the most
+        recently used problems, so that their ids cannot be reused.
+        """
+        with self._lock:
+            entry = self._problems.get(id(prb))
+            if entry is None:
+                entry = (self._next_key, prb)
+                self._next_key += 1
+                self._problems[id(prb)] = entry
+                while len(self._problems) > self.max_problems:
+                    self._problems.popitem(last=False)
+            else:
+                self._problems.move_to_end(id(prb))
+            return entry[0], {key for key, _ in self._problems.values()}
+
+    def _replace(self, worker):
+        with self._lock:
+            self.recycled += 1
+        worker.stop()
+        worker.start()
@@ -0,0 +1,143 @@
+import copy
+import time
+import threading
+from collections import OrderedDict
+
+from src.state_tracking import StateTracker
+
+
+class ProblemSetup:
+    """
+    A problem prepared by setup_problem: the decoded problem, a planner on
+    which setup has already been called and, for planners using compact states,
+    the StateLayout of the problem. Simulations get their own copy of the planner.
+    """
+
+    def __init__(self, key, prb, planner, layout=None):
+        self.key = key
+        self.prb = prb
+        self.planner = planner
+        self.layout = layout
+        self.last_used = time.monotonic()
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+    def new_planner(self):
+        """
+        Returns an independent copy of the prepared planner, sharing the decoded problem.
+        """
+        return copy.deepcopy(self.planner, {id(self.prb): self.prb})
+
+
+class Session:
+    """
+    A running simulation, with its own planner instance and decoded problem.
+
+    The planner is stateful, so the steps of a simulation must be served one at
+    a time while holding the session lock. The lock is reentrant, so that the
+    web service can take it before admitting the step and checking out a
+    worker, and the business logic again around the planner call.
+    """
+
+    def __init__(self, key, prb, planner, layout=None):
+        self.key = key
+        self.prb = prb
+        self.planner = planner
+        self.layout = layout
+        self.lock = threading.RLock()
+        self.states = StateTracker()
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    def touch(self):
+        self.last_used = time.monotonic()
+
+
+class SessionRegistry:
+    """
+    Registry of the prepared problems, keyed by (submission_id, problem_id), and
+    of the running simulations, keyed by (submission_id, problem_id, simulation_id).
+
+    Entries that have not been used for idle_timeout seconds are evicted, and the
+    number of entries of each kind is capped (least recently used entries go
+    first). The simulations of a submission are also capped, so that a single
+    submission cannot evict the simulations of all the others.
+    """
+
+    def __init__(self, idle_timeout=1800, max_sessions=256, max_problems=16, max_submission_sessions=None):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_problems = max_problems
+        self.max_submission_sessions = max_submission_sessions
+
+        self._problems = OrderedDict()
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add_problem(self, submission_id, problem_id, prb, planner, layout=None):
+        key = (submission_id, problem_id)
+        with self._lock:
+            self._evict(time.monotonic())
+            self._problems.pop(key, None)
+            self._problems[key] = ProblemSetup(key, prb, planner, layout)
+            self._trim(self._problems, self.max_problems)
+            return self._problems[key]
+
+    def get_problem(self, submission_id, problem_id):
+        key = (submission_id, problem_id)
+        with self._lock:
+            self._evict(time.monotonic())
+            problem = self._problems.get(key)
+            if problem is not None:
+                problem.touch()
+                self._problems.move_to_end(key)
+            return problem
+
+    def add_session(self, submission_id, problem_id, simulation_id, prb, planner, layout=None):
+        key = (submission_id, problem_id, simulation_id)
+        with self._lock:
+            self._evict(time.monotonic())
+            self._sessions.pop(key, None)
+            self._sessions[key] = Session(key, prb, planner, layout)
+            if self.max_submission_sessions is not None:
+                self._trim_submission(submission_id)
+            self._trim(self._sessions, self.max_sessions)
+            return self._sessions[key]
+
+    def get_session(self, submission_id, problem_id, simulation_id):
+        key = (submission_id, problem_id, simulation_id)
+        with self._lock:
+            self._evict(time.monotonic())
+            session = self._sessions.get(key)
+            if session is not None:
+                session.touch()
+                self._sessions.move_to_end(key)
+            return session
+
+    def remove_session(self, submission_id, problem_id, simulation_id):
+        with self._lock:
+            return self._sessions.pop((submission_id, problem_id, simulation_id), None)
+
+    def stats(self):
+        with self._lock:
+            return {'problems': len(self._problems), 'sessions': len(self._sessions)}
+
+    def _evict(self, now):
+        # Entries are kept in least recently used order
+        for entries in (self._problems, self._sessions):
+            while entries:
+                key, entry = next(iter(entries.items()))
+                if now - entry.last_used <= self.idle_timeout:
+                    break
+                del entries[key]
+
+    def _trim_submission(self, submission_id):
+        keys = [key for key in self._sessions if key[0] == submission_id]
+        for key in keys[:max(0, len(keys) - self.max_submission_sessions)]:
+            del self._sessions[key]
+
+    @staticmethod
+    def _trim(entries, max_entries):
+        while len(entries) > max_entries:
+            entries.popitem(last=False)
@@ -0,0 +1,154 @@
+import os
+import pickle
+import hashlib
+import logging
+import threading
+
+from src.forks import fork_safe_lock
+
+logger = logging.getLogger(__name__)
+
+# Version of the snapshot file layout, bumped when it changes
+SNAPSHOT_FORMAT = 2
+SNAPSHOT_EXTENSION = '.snapshot'
+
+
+def planner_name(planner):
+    """
+    Returns the qualified class name of a planner, recorded in its snapshots.
+    """
+    return f"{type(planner).__module__}.{type(planner).__qualname__}"
+
+
+class SnapshotStore:
+    """
+    Snapshots of the prepared problems (the decoded problem together with the
+    planner on which setup has been called and the optional state layout),
+    keyed by (submission_id, problem_id), so that a restarted service can
+    restore them instead of decoding the problem and setting up the planner
+    again.
+
+    Every snapshot file starts with a small pickled header holding the format
+    version, the planner version and the hash of the problem file, followed by
+    the pickled problem, planner and layout. Snapshots whose header does not
+    match the current versions, or the hash of the problem being set up, are
+    discarded.
+    """
+
+    def __init__(self, directory, version='', enabled=True):
+        self.directory = directory
+        self.version = version
+        self.enabled = enabled
+
+        self.saved = 0
+        self.restored = 0
+        self.invalidated = 0
+
+        fork_safe_lock(self)
+
+    def path(self, submission_id, problem_id):
+        """
+        Returns the snapshot file of a problem. The ids come from the requests,
+        so the file is named after their hash and must resolve under directory.
+        """
+        name = hashlib.sha256(f"{submission_id}\0{problem_id}".encode()).hexdigest()
+        root = os.path.realpath(self.directory)
+        path = os.path.realpath(os.path.join(root, name + SNAPSHOT_EXTENSION))
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError(f"The snapshot of Submission ID: {submission_id}, Problem ID: {problem_id} resolves outside of {root}")
+        return path
+
+    def _header(self, planner_name, problem_hash):
+        return {'format': SNAPSHOT_FORMAT, 'version': self.version, 'planner': planner_name,
+                'problem_hash': problem_hash}
+
+    def save(self, submission_id, problem_id, problem_hash, prb, planner, layout=None):
+        """
+        Writes the snapshot of a prepared problem. Failures (e.g. planners that
+        cannot be pickled) are logged and otherwise ignored.
+        """
+        if not self.enabled:
+            return False
+
+        temp_path = None
+        try:
+            path = self.path(submission_id, problem_id)
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(temp_path, 'wb') as f:
+                pickle.dump(self._header(planner_name(planner), problem_hash), f, pickle.HIGHEST_PROTOCOL)
+                # Pickled together, so that the planner keeps sharing the problem object
+                pickle.dump((prb, planner, layout), f, pickle.HIGHEST_PROTOCOL)
+            # Readers only ever see complete snapshots
+            os.replace(temp_path, path)
+        except Exception as e:
+            logger.warning(f"[SNAPSHOT] - Could not save the snapshot of Submission ID: {submission_id}, Problem ID: {problem_id}: {str(e)}")
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            return False
+
+        with self._lock:
+            self.saved += 1
+        logger.debug(f"[SNAPSHOT] - Snapshot saved to {path}")
+        return True
+
+    def load(self, submission_id, problem_id, planner_name, problem_hash=None):
+        """
+        Returns the (prb, planner, layout) of a snapshot, or None if there is
+        no valid snapshot. The snapshot must have been taken for a planner of
+        the class planner_name and, when problem_hash is given, for the same
+        problem file. Stale snapshots are deleted.
+        """
+        if not self.enabled:
+            return None
+
+        try:
+            path = self.path(submission_id, problem_id)
+        except ValueError as e:
+            logger.warning(f"[SNAPSHOT] - {str(e)}")
+            return None
+        try:
+            with open(path, 'rb') as f:
+                header = pickle.load(f)
+                if header != self._header(planner_name, header.get('problem_hash')):
+                    reason = 'planner or snapshot version changed'
+                elif problem_hash is not None and header['problem_hash'] != problem_hash:
+                    reason = 'problem changed'
+                else:
+                    reason = None
+                if reason is not None:
+                    logger.info(f"[SNAPSHOT] - Discarding the snapshot of Submission ID: {submission_id}, Problem ID: {problem_id} ({reason})")
+                    self.remove(submission_id, problem_id)
+                    with self._lock:
+                        self.invalidated += 1
+                    return None
+                prb, planner, layout = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"[SNAPSHOT] - Could not restore the snapshot of Submission ID: {submission_id}, Problem ID: {problem_id}: {str(e)}")
+            self.remove(submission_id, problem_id)
+            return None
+
+        with self._lock:
+            self.restored += 1
+        logger.info(f"[SNAPSHOT] - Restored the snapshot of Submission ID: {submission_id}, Problem ID: {problem_id}")
+        return prb, planner, layout
+
+    def remove(self, submission_id, problem_id):
+        try:
+            os.remove(self.path(submission_id, problem_id))
+        except (FileNotFoundError, ValueError):
+            pass
+
+    def stats(self):
+        """
+        Returns the snapshot counters as a dictionary.
+        """
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'saved': self.saved,
+                'restored': self.restored,
+                'invalidated': self.invalidated,
+            }
@@ -0,0 +1,75 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """
+    Startup timings and readiness of the service.
+
+    Phases are recorded with mark(), each one lasting from the previous mark (or
+    the creation of the tracker). The service is ready once mark_ready() has been
+    called, e.g. after the optional background pre-warm.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.phases = {}
+        self.ready_after = None
+        self.prewarm_error = None
+        self._last_mark = self.started_at
+        self._ready = threading.Event()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = round(now - self._last_mark, 6)
+        self._last_mark = now
+        logger.info(f"[STARTUP] - {phase} took {self.phases[phase]:.3f}s")
+
+    def mark_ready(self):
+        if not self._ready.is_set():
+            self.ready_after = round(time.perf_counter() - self.started_at, 6)
+            self._ready.set()
+            logger.info(f"[STARTUP] - Ready {self.ready_after:.3f}s after startup")
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def prewarm(self, fn, background=True):
+        """
+        Runs fn on a background thread (or in the calling thread), recording its
+        duration as the 'prewarm' phase, and marks the service as ready once it
+        is done. A failing pre-warm is logged and does not prevent the service
+        from becoming ready, since planners are also built on first use.
+        """
+        def run():
+            start = time.perf_counter()
+            try:
+                fn()
+            except Exception as e:
+                self.prewarm_error = str(e)
+                logger.error(f"[STARTUP] - Pre-warm failed: {str(e)}", exc_info=True)
+            self.phases['prewarm'] = round(time.perf_counter() - start, 6)
+            logger.info(f"[STARTUP] - prewarm took {self.phases['prewarm']:.3f}s")
+            self.mark_ready()
+
+        if not background:
+            run()
+            return None
+        thread = threading.Thread(target=run, name='prewarm', daemon=True)
+        thread.start()
+        return thread
+
+    def status(self):
+        return {
+            'ready': self.is_ready(),
+            'ready_after': self.ready_after,
+            'phases': dict(self.phases),
+            'prewarm_error': self.prewarm_error,
+        }
+
+
+# Created as early as possible, so that the import of the service is measured
+startup = Startup()
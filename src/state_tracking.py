@@ -0,0 +1,141 @@
+import copy
+import json
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class StateMismatch(Exception):
+    """
+    Raised when a state delta cannot be applied to the cached state.
+    """
+
+
+def state_checksum(state_obj):
+    """
+    Returns the checksum of a JSON state: the SHA-256 of its canonical encoding
+    (sorted keys, no whitespace).
+    """
+    canonical = json.dumps(state_obj, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def merge_patch(target, patch):
+    """
+    Applies a JSON merge patch (RFC 7386) to target, returning the patched copy.
+    """
+    if not isinstance(patch, dict):
+        return copy.deepcopy(patch)
+    result = dict(target) if isinstance(target, dict) else {}
+    for key, value in patch.items():
+        if value is None:
+            result.pop(key, None)
+        else:
+            result[key] = merge_patch(result.get(key), value)
+    return result
+
+
+class StateTracker:
+    """
+    Keeps the last state of a simulation, so that next_action can skip decoding
+    the state when it is already known.
+
+    A step can carry either the full 'state' or a 'state_delta': a JSON merge
+    patch (RFC 7386) against the previous state, identified by 'base_checksum'
+    and/or checked against the 'checksum' of the patched state (at least one of
+    them is required). Full states are always hashed here, so that a stale
+    checksum sent by the client can never select the wrong cached state. The
+    state is decoded with BelugaProblemState.from_json_obj only when it does not
+    match the cached one, i.e. the last state seen or the state predicted by the
+    planner's optional predict_state(state, action) method.
+
+    Cached states are reused across steps, so planners must not modify them.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.state_obj = None
+        self.checksum = None
+
+        # Prediction of the next state, computed from the returned action
+        self.predicted = None
+        self.predicted_checksum = None
+
+        self.hits = 0
+        self.decodes = 0
+
+    def resolve(self, data, prb, decode=None):
+        """
+        Returns the state for the step described by data, decoded by
+        decode(state_obj) when given (e.g. into a CompactState), and as a
+        BelugaProblemState otherwise.
+        """
+        if 'state_delta' in data:
+            try:
+                state_obj, checksum = self._apply_delta(data)
+            except StateMismatch as e:
+                if 'state' not in data:
+                    raise
+                logger.warning(f"[STATE] - {str(e)}, decoding the full state")
+                state_obj, checksum = data['state'], None
+        else:
+            state_obj, checksum = data['state'], None
+
+        if checksum is None:
+            checksum = state_checksum(state_obj)
+
+        if checksum == self.checksum:
+            self.hits += 1
+            return self.state
+        if checksum == self.predicted_checksum:
+            self.hits += 1
+            self._store(self.predicted, state_obj, checksum)
+            return self.state
+
+        self.decodes += 1
+        if decode is None:
+            from beluga_lib.problem_state import BelugaProblemState
+            state = BelugaProblemState.from_json_obj(state_obj, prb)
+        else:
+            state = decode(state_obj)
+        self._store(state, state_obj, checksum)
+        return self.state
+
+    def advance(self, planner, action):
+        """
+        Records the prediction of the next state, if the planner supports it.
+        """
+        self.predicted = None
+        self.predicted_checksum = None
+
+        predict_state = getattr(planner, 'predict_state', None)
+        if predict_state is None:
+            return
+        try:
+            predicted = predict_state(self.state, action)
+            if predicted is not None:
+                self.predicted = predicted
+                self.predicted_checksum = state_checksum(predicted.to_json_obj())
+        except Exception as e:
+            logger.warning(f"[STATE] - State prediction failed: {str(e)}")
+
+    def _apply_delta(self, data):
+        if self.state_obj is None:
+            raise StateMismatch("No cached state to apply the delta to")
+        base_checksum = data.get('base_checksum')
+        if base_checksum is None and data.get('checksum') is None:
+            raise StateMismatch("The delta has neither a base_checksum nor a checksum")
+        if base_checksum is not None and base_checksum != self.checksum:
+            raise StateMismatch("The delta base does not match the cached state")
+
+        state_obj = merge_patch(self.state_obj, data['state_delta'])
+        checksum = state_checksum(state_obj)
+        if data.get('checksum') not in (None, checksum):
+            raise StateMismatch("The patched state does not match the expected checksum")
+        return state_obj, checksum
+
+    def _store(self, state, state_obj, checksum):
+        self.state = state
+        self.state_obj = state_obj
+        self.checksum = checksum
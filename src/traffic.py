@@ -0,0 +1,45 @@
+import json
+import time
+import base64
+import threading
+
+
+class TrafficRecorder:
+    """
+    Appends the API requests served by the webservice to a JSON lines file, so
+    that they can be replayed by benchmarks/load_test.py. Every line holds the
+    method, path, query parameters, content type and base64 body of a request,
+    together with the response status and the service time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def record(self, method, path, args, content_type, body, status, seconds):
+        line = json.dumps({
+            'timestamp': time.time(),
+            'method': method,
+            'path': path,
+            'args': args,
+            'content_type': content_type,
+            'body': base64.b64encode(body).decode('ascii'),
+            'status': status,
+            'seconds': seconds,
+        })
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+def read_traffic(path):
+    """
+    Reads a recorded traffic file, decoding the request bodies.
+    """
+    requests = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                entry['body'] = base64.b64decode(entry['body'])
+                requests.append(entry)
+    return requests
@@ -0,0 +1,205 @@
+import io
+import os
+import shutil
+import zipfile
+import posixpath
+import tempfile
+
+# Size of the chunks in which request bodies and archive entries are read
+CHUNK_SIZE = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """
+    Raised when an upload is refused: status is 413 when it exceeds the size or
+    entry limits, and 400 when it is not a valid or safe archive.
+    """
+
+    def __init__(self, message, status=413):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadLimits:
+    """
+    Limits of the uploaded bodies: their size as sent (max_body_bytes), and for
+    zip archives the total size of their content once decompressed and their
+    number of entries.
+    """
+
+    def __init__(self, max_body_bytes, max_uncompressed_bytes, max_entries, spool_bytes=8 * 1024 * 1024):
+        self.max_body_bytes = max_body_bytes
+        self.max_uncompressed_bytes = max_uncompressed_bytes
+        self.max_entries = max_entries
+        # Bodies larger than this are spooled to a temporary file instead of memory
+        self.spool_bytes = spool_bytes
+
+
+def check_content_length(content_length, limits):
+    """
+    Rejects a body from its Content-Length header, before reading it.
+    """
+    if content_length is not None and content_length > limits.max_body_bytes:
+        raise UploadRejected(f"The request body ({content_length} bytes) exceeds the limit of {limits.max_body_bytes} bytes")
+
+
+def spool_body(chunks, content_length, limits):
+    """
+    Reads a request body from an iterable of chunks into a spooled buffer,
+    which stays in memory up to limits.spool_bytes and goes to a temporary file
+    beyond. The buffer is returned positioned at the start.
+    """
+    check_content_length(content_length, limits)
+    buffer = spooled_buffer(limits)
+    try:
+        for chunk in chunks:
+            add_chunk(buffer, chunk, limits)
+    except BaseException:
+        buffer.close()
+        raise
+    buffer.seek(0)
+    return buffer
+
+
+def spooled_buffer(limits):
+    """
+    Returns an empty buffer for a request body.
+    """
+    return tempfile.SpooledTemporaryFile(max_size=limits.spool_bytes)
+
+
+def add_chunk(buffer, chunk, limits):
+    """
+    Appends a chunk to a spooled body, enforcing the body size limit (for bodies
+    without Content-Length, or with a wrong one).
+    """
+    if buffer.tell() + len(chunk) > limits.max_body_bytes:
+        raise UploadRejected(f"The request body exceeds the limit of {limits.max_body_bytes} bytes")
+    buffer.write(chunk)
+
+
+def stream_chunks(stream, chunk_size=CHUNK_SIZE):
+    """
+    Iterates over the chunks of a file-like stream.
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return
+        yield chunk
+
+
+def body_bytes(body):
+    """
+    Returns the whole content of a body given as bytes or as a spooled buffer.
+    """
+    if isinstance(body, (bytes, bytearray)):
+        return bytes(body)
+    position = body.tell()
+    body.seek(0)
+    data = body.read()
+    body.seek(position)
+    return data
+
+
+def safe_member_name(name):
+    """
+    Returns the normalized name of an archive entry, rejecting the names that
+    would be extracted outside of the target folder.
+    """
+    normalized = posixpath.normpath(name.replace('\\', '/'))
+    if (normalized.startswith('/') or normalized == '..' or normalized.startswith('../')
+            or ':' in normalized.split('/')[0] or '\0' in normalized):
+        raise UploadRejected(f"Unsafe path in the archive: {name!r}", 400)
+    return normalized
+
+
+def _open_archive(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = io.BytesIO(data)
+    else:
+        data.seek(0)
+    try:
+        return zipfile.ZipFile(data, 'r')
+    except zipfile.BadZipFile as e:
+        raise UploadRejected(f"The request body is not a valid zip file: {str(e)}", 400)
+
+
+def _checked_members(zip_ref, limits):
+    """
+    Returns the file entries of an archive with their safe names, after checking
+    the entry count and the declared sizes against the limits.
+    """
+    infos = zip_ref.infolist()
+    if len(infos) > limits.max_entries:
+        raise UploadRejected(f"The archive has {len(infos)} entries, more than the limit of {limits.max_entries}")
+    declared = sum(info.file_size for info in infos)
+    if declared > limits.max_uncompressed_bytes:
+        raise UploadRejected(f"The archive content ({declared} bytes) exceeds the limit of {limits.max_uncompressed_bytes} bytes")
+    return [(safe_member_name(info.filename), info) for info in infos if not info.is_dir()]
+
+
+def _read_member(zip_ref, info, budget):
+    """
+    Decompresses an entry in chunks, counting the bytes actually produced
+    rather than trusting the declared sizes. Returns the chunks.
+    """
+    chunks = []
+    with zip_ref.open(info) as member:
+        for chunk in stream_chunks(member):
+            budget[0] -= len(chunk)
+            if budget[0] < 0:
+                raise UploadRejected("The archive content exceeds the uncompressed size limit")
+            chunks.append(chunk)
+    return chunks
+
+
+def read_archive(data, limits):
+    """
+    Reads the files of a zip archive (bytes or a file-like buffer) within the
+    limits, returning a dictionary that maps their names to their raw content.
+    """
+    with _open_archive(data) as zip_ref:
+        budget = [limits.max_uncompressed_bytes]
+        try:
+            return {name: b''.join(_read_member(zip_ref, info, budget)) for name, info in _checked_members(zip_ref, limits)}
+        except (zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+            raise UploadRejected(f"The archive is corrupted: {str(e)}", 400)
+
+
+def extract_archive(data, destination, limits):
+    """
+    Extracts a zip archive (bytes or a file-like buffer) into destination within
+    the limits, never writing outside of it.
+    """
+    root = os.path.realpath(destination)
+    with _open_archive(data) as zip_ref:
+        budget = [limits.max_uncompressed_bytes]
+        try:
+            for name, info in _checked_members(zip_ref, limits):
+                path = os.path.realpath(os.path.join(root, *name.split('/')))
+                if os.path.commonpath([root, path]) != root:
+                    raise UploadRejected(f"Unsafe path in the archive: {info.filename!r}", 400)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with zip_ref.open(info) as member, open(path, 'wb') as f:
+                    for chunk in stream_chunks(member):
+                        budget[0] -= len(chunk)
+                        if budget[0] < 0:
+                            raise UploadRejected("The archive content exceeds the uncompressed size limit")
+                        f.write(chunk)
+        except (zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+            raise UploadRejected(f"The archive is corrupted: {str(e)}", 400)
+
+
+def copy_body(body, path):
+    """
+    Writes a body given as bytes or as a spooled buffer to a file.
+    """
+    with open(path, 'wb') as f:
+        if isinstance(body, (bytes, bytearray)):
+            f.write(body)
+        else:
+            position = body.tell()
+            body.seek(0)
+            shutil.copyfileobj(body, f, CHUNK_SIZE)
+            body.seek(position)
@@ -0,0 +1,73 @@
+import threading
+from contextlib import contextmanager
+
+from src.metrics import stage
+
+
+class LogicPool:
+    """
+    Pool of business logic objects, each owning its own planner instances.
+
+    A request checks a worker out of the pool for the duration of the business
+    logic call, so that at most `size` calls run at the same time and no planner
+    instance is ever used by two requests at once.
+    """
+
+    def __init__(self, factory, size):
+        if size < 1:
+            raise ValueError(f"The pool size must be positive, got {size}")
+        self.size = size
+        self._workers = [factory() for _ in range(size)]
+        # Idle workers, the most recently used last
+        self._idle = list(self._workers)
+        self._condition = threading.Condition()
+        # Whether a broadcast is waiting for the workers to be idle
+        self._broadcasting = False
+        self._broadcast_lock = threading.Lock()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Checks out an idle worker, waiting until one is available (and until
+        the pending broadcast, if any, is complete).
+        """
+        with stage('worker_wait'), self._condition:
+            self._condition.wait_for(lambda: self._idle and not self._broadcasting)
+            worker = self._idle.pop()
+        try:
+            yield worker
+        finally:
+            self._release([worker])
+
+    def broadcast(self, fn):
+        """
+        Calls fn on every worker of the pool (e.g. for submission-wide setup),
+        waiting for each of them to be idle. No worker is checked out in the
+        meantime, so that a busy pool cannot starve the broadcast.
+        """
+        with self._broadcast_lock:
+            # Check out all the workers, so that each is called exactly once
+            with self._condition:
+                self._broadcasting = True
+                try:
+                    self._condition.wait_for(lambda: len(self._idle) == self.size)
+                finally:
+                    self._broadcasting = False
+                workers = self._idle
+                self._idle = []
+            try:
+                return [fn(worker) for worker in workers]
+            finally:
+                self._release(workers)
+
+    def busy(self):
+        """
+        Returns the number of workers currently checked out.
+        """
+        with self._condition:
+            return self.size - len(self._idle)
+
+    def _release(self, workers):
+        with self._condition:
+            self._idle.extend(workers)
+            self._condition.notify_all()
@@ -0,0 +1,131 @@
+import time
+import threading
+
+import pytest
+
+from src.admission import AdmissionController, AdmissionRejected, PriorityClass, PRIORITIES, INTERACTIVE, SETUP, BATCH
+
+
+def make_controller(max_queue=8, queue_timeout=5):
+    return AdmissionController(1, [PriorityClass(name, 1, max_queue, queue_timeout) for name in PRIORITIES])
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def queued(controller, priority):
+    return controller.stats()['classes'][priority]['queued']
+
+
+class Holder:
+    """
+    Holds the only slot of a controller until release() is called.
+    """
+
+    def __init__(self, controller, priority=BATCH):
+        self.controller = controller
+        self.admitted = threading.Event()
+        self.released = threading.Event()
+        self.thread = threading.Thread(target=self._run, args=(priority,))
+        self.thread.start()
+        assert self.admitted.wait(5)
+
+    def _run(self, priority):
+        with self.controller.admit(priority, 'holder'):
+            self.admitted.set()
+            self.released.wait(5)
+
+    def release(self):
+        self.released.set()
+        self.thread.join(5)
+
+
+def enqueue(controller, calls):
+    """
+    Queues the (priority, submission_id, label) calls one after the other and
+    returns their threads and the list the labels are appended to on admission.
+    """
+    order = []
+    threads = []
+    for priority, submission_id, label in calls:
+        expected = queued(controller, priority) + 1
+
+        def call(priority=priority, submission_id=submission_id, label=label):
+            with controller.admit(priority, submission_id):
+                order.append(label)
+
+        thread = threading.Thread(target=call)
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: queued(controller, priority) == expected)
+    return threads, order
+
+
+def test_more_urgent_classes_are_admitted_first():
+    controller = make_controller()
+    holder = Holder(controller)
+    threads, order = enqueue(controller, [(BATCH, 's', 'batch'), (SETUP, 's', 'setup'),
+                                          (INTERACTIVE, 's', 'interactive')])
+    holder.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['interactive', 'setup', 'batch']
+
+
+def test_submissions_are_admitted_round_robin_within_a_class():
+    controller = make_controller()
+    holder = Holder(controller)
+    threads, order = enqueue(controller, [(BATCH, 'a', 'a1'), (BATCH, 'a', 'a2'), (BATCH, 'a', 'a3'),
+                                          (BATCH, 'b', 'b1'), (BATCH, 'b', 'b2')])
+    holder.release()
+    for thread in threads:
+        thread.join(5)
+    assert order == ['a1', 'b1', 'a2', 'b2', 'a3']
+
+
+def test_calls_over_the_queue_limit_are_rejected_with_429():
+    controller = make_controller(max_queue=1)
+    holder = Holder(controller)
+    threads, order = enqueue(controller, [(BATCH, 's', 'queued')])
+
+    with pytest.raises(AdmissionRejected) as e:
+        with controller.admit(BATCH, 's'):
+            pass
+    assert e.value.status == 429
+    assert controller.stats()['classes'][BATCH]['rejected_full'] == 1
+
+    holder.release()
+    threads[0].join(5)
+    assert order == ['queued']
+
+
+def test_calls_waiting_past_the_queue_timeout_are_rejected_with_503():
+    controller = make_controller(queue_timeout=0.05)
+    holder = Holder(controller)
+
+    with pytest.raises(AdmissionRejected) as e:
+        with controller.admit(SETUP, 's'):
+            pass
+    assert e.value.status == 503
+    assert e.value.retry_after >= 1
+    stats = controller.stats()['classes'][SETUP]
+    assert (stats['queued'], stats['rejected_timeout']) == (0, 1)
+    holder.release()
+
+
+def test_the_slot_is_released_when_the_call_raises():
+    controller = make_controller()
+    with pytest.raises(RuntimeError):
+        with controller.admit(INTERACTIVE, 's'):
+            raise RuntimeError('planner failure')
+    stats = controller.stats()
+    assert stats['running'] == 0
+    assert stats['classes'][INTERACTIVE]['running'] == 0
+
+    # The freed slot goes to the next call right away
+    with controller.admit(BATCH, 's'):
+        assert controller.stats()['running'] == 1
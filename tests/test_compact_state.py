@@ -0,0 +1,97 @@
+import copy
+
+import pytest
+
+from src.compact_state import CompactState, StateLayout, JIG_ABSENT
+
+PROBLEM = {
+    'jig_types': {'typeA': {'name': 'typeA'}, 'typeB': {'name': 'typeB'}},
+    'jigs': {'jig0001': {'name': 'jig0001'}, 'jig0002': {'name': 'jig0002'}, 'jig0003': {'name': 'jig0003'}},
+    'racks': [{'name': 'rack00', 'size': 20}, {'name': 'rack01', 'size': 30}],
+    'trailers_beluga': [{'name': 'beluga_trailer_1'}],
+    'trailers_factory': [{'name': 'factory_trailer_1'}, {'name': 'factory_trailer_2'}],
+    'hangars': ['hangar1'],
+}
+
+STATE = {
+    'jigs': {'jig0001': {'type': 'typeA', 'empty': False}, 'jig0002': {'type': 'typeB', 'empty': True}},
+    'racks': [['jig0001'], []],
+    'trailers_beluga': [None],
+    'trailers_factory': ['jig0002', None],
+    'hangars': [None],
+    'current_beluga': 0,
+}
+
+
+@pytest.fixture
+def layout():
+    return StateLayout.from_problem_json(PROBLEM)
+
+
+def test_layout_indexes_the_problem(layout):
+    assert layout.jigs == ['jig0001', 'jig0002', 'jig0003']
+    assert layout.jig_types == ['typeA', 'typeB']
+    assert layout.racks == ['rack00', 'rack01']
+    assert list(layout.rack_size) == [20, 30]
+    assert layout.slots == {'trailers_beluga': 1, 'trailers_factory': 2, 'hangars': 1}
+
+
+def test_round_trip(layout):
+    state = CompactState.from_json_obj(copy.deepcopy(STATE), layout)
+    assert state.extra == {'current_beluga': 0}
+    assert state.jig_empty[2] == JIG_ABSENT
+    assert list(state.rack(0)) == [0]
+    assert state.to_json_obj() == STATE
+
+
+def test_round_trip_with_named_jig_entries(layout):
+    state_obj = copy.deepcopy(STATE)
+    for name, entry in state_obj['jigs'].items():
+        entry['name'] = name
+    assert CompactState.from_json_obj(state_obj, layout).to_json_obj() == state_obj
+
+
+@pytest.mark.parametrize('field, value', [
+    ('jigs', {'jig0001': {'type': 'typeA', 'empty': False, 'size': 4}}),
+    ('jigs', {'jig9999': {'type': 'typeA', 'empty': False}}),
+    ('jigs', {'jig0001': {'type': 'typeZ', 'empty': False}}),
+    ('jigs', {'jig0001': {'name': 'jig0001', 'type': 'typeA', 'empty': False},
+              'jig0002': {'type': 'typeB', 'empty': True}}),
+    ('racks', [['jig0001']]),
+    ('racks', [['jig9999'], []]),
+    ('trailers_factory', ['jig0002']),
+    ('hangars', 'hangar1'),
+])
+def test_irregular_fields_are_kept_in_extra(layout, field, value):
+    state_obj = dict(STATE, **{field: value})
+    state = CompactState.from_json_obj(state_obj, layout)
+    assert state.extra[field] == value
+    assert state.to_json_obj() == state_obj
+
+
+def test_copies_are_independent(layout):
+    state = CompactState.from_json_obj(STATE, layout)
+    clone = state.copy()
+    assert clone == state and hash(clone) == hash(state)
+
+    clone.jig_empty[0] = 1
+    clone.slots['hangars'][0] = 0
+    clone.rack_jigs[0] = 2
+    clone.invalidate()
+    assert clone != state
+    assert state.to_json_obj() == STATE
+    assert clone.to_json_obj()['hangars'] == ['jig0001']
+
+
+def test_key_is_stable(layout):
+    state = CompactState.from_json_obj(STATE, layout)
+    key = state.key()
+    assert CompactState.from_json_obj(copy.deepcopy(STATE), layout).key() == key
+    assert state.copy().key() == key
+    assert CompactState.from_json_obj(dict(STATE, current_beluga=1), layout).key() != key
+
+    # The key is cached until the state is invalidated
+    state.jig_empty[0] = 1
+    assert state.key() == key
+    state.invalidate()
+    assert state.key() != key
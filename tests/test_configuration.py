@@ -0,0 +1,15 @@
+import pytest
+
+from src.business_logic import Configuration
+
+
+@pytest.mark.parametrize('value, prewarm', [('', ''), ('det', 'det'), (' Prob ', 'prob'), ('ALL', 'all')])
+def test_prewarm_setting(monkeypatch, value, prewarm):
+    monkeypatch.setenv('BELUGA_PREWARM', value)
+    assert Configuration().prewarm == prewarm
+
+
+def test_unknown_prewarm_setting_is_refused(monkeypatch):
+    monkeypatch.setenv('BELUGA_PREWARM', 'planners')
+    with pytest.raises(ValueError, match='BELUGA_PREWARM'):
+        Configuration()
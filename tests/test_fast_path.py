@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+
+import pytest
+
+pytest.importorskip('flask')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'web_service'))
+import webservice
+from webservice import ApiRequest, JSON_MIMETYPE
+
+QUERY = {'submission_id': 's', 'problem_id': 'p1', 'simulation_id': 'sim1', 'action_id': 'a1'}
+BODY = json.dumps({'state': {}, 'metadata': {}}).encode()
+
+
+def next_action_request(mimetype, body):
+    return ApiRequest(QUERY, {}, mimetype, mimetype, len(body), lambda: body)
+
+
+@pytest.fixture
+def no_action(monkeypatch):
+    monkeypatch.setattr(webservice, 'run_next_action', lambda *args: {})
+
+
+def test_steps_without_action_get_an_empty_reply_on_both_paths(no_action):
+    reply = webservice.next_action(next_action_request(JSON_MIMETYPE, BODY))
+    assert (reply.status, reply.body, reply.mimetype) == (200, b'', JSON_MIMETYPE)
+
+    zip_body = webservice.zip_payload({'state_and_metadata.json': BODY})
+    reply = webservice.next_action(next_action_request('application/octet-stream', zip_body))
+    assert reply.status == 200
+    assert webservice.unzip_payload(reply.body) == {}
+
+
+def test_actions_are_returned_as_json(monkeypatch):
+    monkeypatch.setattr(webservice, 'run_next_action', lambda *args: {'action.json': b'{"name": "unload"}'})
+    reply = webservice.next_action(next_action_request(JSON_MIMETYPE, BODY))
+    assert (reply.status, json.loads(reply.body)) == (200, {'name': 'unload'})
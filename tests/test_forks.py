@@ -0,0 +1,41 @@
+import os
+import gc
+import weakref
+
+from src.forks import fork_safe_lock, _owners
+
+
+class Owner:
+    pass
+
+
+def run_in_child(fn):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if fn() else 1)
+        except BaseException:
+            os._exit(2)
+    _, status = os.waitpid(pid, 0)
+    return os.waitstatus_to_exitcode(status)
+
+
+def test_locks_held_at_fork_time_are_replaced_in_the_child():
+    owner = Owner()
+    lock = fork_safe_lock(owner)
+    fork_safe_lock(owner, '_other_lock')
+    with lock, owner._other_lock:
+        exit_code = run_in_child(lambda: owner._lock.acquire(timeout=1) and owner._other_lock.acquire(timeout=1))
+    assert exit_code == 0
+    # The parent keeps its own lock
+    assert owner._lock is lock
+
+
+def test_owners_are_not_kept_alive():
+    owner = Owner()
+    fork_safe_lock(owner)
+    reference = weakref.ref(owner)
+    del owner
+    gc.collect()
+    assert reference() is None
+    assert not any(isinstance(owner, Owner) for owner in _owners.keys())
@@ -0,0 +1,60 @@
+import time
+
+import pytest
+
+from src.jobs import JobQueue
+
+
+def wait_finished(queue, job):
+    deadline = time.monotonic() + 5
+    while job.finished_at is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The job is counted as finished once its executor releases it
+    while queue.stats()['pending'] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queue():
+    return JobQueue(1, 8, retention=600, max_finished=2)
+
+
+def test_oldest_finished_jobs_are_dropped_first(queue):
+    jobs = []
+    for i in range(4):
+        job = queue.submit('plan', {'i': i}, lambda i=i: i)
+        wait_finished(queue, job)
+        jobs.append(job)
+
+    assert [queue.get(job.job_id) for job in jobs] == [None, None, jobs[2], jobs[3]]
+    assert jobs[3].result == 3
+    stats = queue.stats()
+    assert (stats['finished'], stats['evicted']) == (2, 2)
+
+
+def test_finished_jobs_expire_after_the_retention():
+    queue = JobQueue(1, 8, retention=0.05)
+    job = queue.submit('plan', {}, lambda: 'zip')
+    wait_finished(queue, job)
+    assert queue.get(job.job_id) is job
+
+    time.sleep(0.1)
+    assert queue.get(job.job_id) is None
+    assert queue.stats()['finished'] == 0
+
+
+def test_running_jobs_are_never_dropped():
+    queue = JobQueue(2, 8, retention=600, max_finished=2)
+    slow = queue.submit('plan', {}, time.sleep, 0.3)
+    fast = []
+    for _ in range(3):
+        job = queue.submit('plan', {}, lambda: None)
+        while job.finished_at is None:
+            time.sleep(0.01)
+        fast.append(job)
+    assert queue.get(slow.job_id) is slow
+
+    wait_finished(queue, slow)
+    # The slow job finished last, so it is kept and the oldest fast job goes
+    assert queue.get(slow.job_id) is slow
+    assert [queue.get(job.job_id) for job in fast] == [None, None, fast[2]]
@@ -0,0 +1,145 @@
+import os
+import time
+import threading
+
+import pytest
+
+from src.plan_cache import PlanCache, planner_settings
+
+
+class Planner:
+
+    def __init__(self, max_steps):
+        self.max_steps = max_steps
+        self._internal = object()
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + 5
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert condition()
+
+
+def test_miss_then_hit():
+    cache = PlanCache()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return b'zip', 'ok', True
+
+    assert cache.get_or_compute('k', compute) == (b'zip', 'ok', 'miss')
+    assert cache.get_or_compute('k', compute) == (b'zip', 'ok', 'hit')
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats['misses'], stats['hits'], stats['stored']) == (1, 1, 1)
+
+
+def test_outputs_that_cannot_be_cached_are_not_stored():
+    cache = PlanCache()
+    assert cache.get_or_compute('k', lambda: (b'empty', 'timeout', False)) == (b'empty', 'timeout', 'miss')
+    assert cache.get_or_compute('k', lambda: (b'zip', 'ok', True)) == (b'zip', 'ok', 'miss')
+    assert cache.stats()['stored'] == 1
+
+
+def run_follower(cache, key, results):
+    def follow():
+        try:
+            results.append(cache.get_or_compute(key, lambda: pytest.fail('identical calls must not compute')))
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=follow)
+    thread.start()
+    wait_until(lambda: cache.stats()['shared'] == 1)
+    return thread
+
+
+def test_identical_calls_in_flight_share_the_result():
+    cache = PlanCache()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        return b'zip', 'ok', True
+
+    leader_results = []
+    leader = threading.Thread(target=lambda: leader_results.append(cache.get_or_compute('k', compute)))
+    leader.start()
+    wait_until(lambda: cache.stats()['in_flight'] == 1)
+
+    follower_results = []
+    follower = run_follower(cache, 'k', follower_results)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert leader_results == [(b'zip', 'ok', 'miss')]
+    assert follower_results == [(b'zip', 'ok', 'shared')]
+    assert cache.stats()['in_flight'] == 0
+
+
+def test_leader_errors_reach_the_followers_and_are_not_cached():
+    cache = PlanCache()
+    release = threading.Event()
+
+    def compute():
+        release.wait(5)
+        raise RuntimeError('planner failure')
+
+    leader_results = []
+
+    def lead():
+        try:
+            cache.get_or_compute('k', compute)
+        except RuntimeError as e:
+            leader_results.append(e)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    wait_until(lambda: cache.stats()['in_flight'] == 1)
+
+    follower_results = []
+    follower = run_follower(cache, 'k', follower_results)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(leader_results) == 1
+    assert len(follower_results) == 1 and isinstance(follower_results[0], RuntimeError)
+    assert cache.stats()['stored'] == 0
+    assert cache.get_or_compute('k', lambda: (b'zip', 'ok', True)) == (b'zip', 'ok', 'miss')
+
+
+def test_disk_store_drops_the_oldest_files_over_the_limit(tmp_path):
+    cache = PlanCache(str(tmp_path), max_disk_bytes=25)
+    for age, key in enumerate(['k1', 'k2']):
+        cache.put(key, b'0123456789')
+        os.utime(cache.path(key), (age + 1, age + 1))
+    cache.put('k3', b'0123456789')
+
+    assert sorted(os.listdir(tmp_path)) == ['k2.zip', 'k3.zip']
+    assert cache.stats()['evicted_files'] == 1
+
+    # The remaining files are still served after the memory is cleared
+    cache.clear()
+    assert cache.get('k2') == b'0123456789'
+    assert cache.get('k1') is None
+    assert cache.stats()['disk_hits'] == 1
+
+
+def test_key_depends_on_the_planner_and_the_time_budget():
+    key = PlanCache.key('problem', 'Planner:{}:1', 10.0)
+    assert PlanCache.key('problem', 'Planner:{}:1', 10.0) == key
+    assert PlanCache.key('other', 'Planner:{}:1', 10.0) != key
+    assert PlanCache.key('problem', 'Planner:{}:2', 10.0) != key
+    assert PlanCache.key('problem', 'Planner:{}:1', 5.0) != key
+    assert PlanCache.key('problem', 'Planner:{}:1') != key
+    # No budget and a zero budget both mean no limit
+    assert PlanCache.key('problem', 'Planner:{}:1') == PlanCache.key('problem', 'Planner:{}:1', 0)
+
+
+def test_planner_settings_are_the_public_scalar_attributes():
+    assert planner_settings(Planner(10)) == '{"max_steps": 10}'
+    assert planner_settings(Planner(10)) != planner_settings(Planner(20))
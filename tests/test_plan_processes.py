@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from src.plan_processes import PlanProcessPool, PlanTimeout
+
+
+class Logic:
+    """
+    Business logic recording its setups, which plans slowly for the problem 'slow'.
+    """
+
+    def __init__(self):
+        self.submission_ids = []
+
+    def setup(self, submission_id):
+        self.submission_ids.append(submission_id)
+
+    def plan(self, submission_id, problem_id, input_files, output_files):
+        if problem_id == 'slow':
+            time.sleep(30)
+        output_files['setups'] = ','.join(self.submission_ids).encode()
+        return True
+
+
+@pytest.fixture
+def pool():
+    pool = PlanProcessPool(Logic, 1)
+    yield pool
+    pool.shutdown()
+
+
+def worker_pid(pool):
+    worker = pool._idle.get()
+    pool._idle.put(worker)
+    return worker.process.pid
+
+
+def test_plans_are_computed_by_the_workers(pool):
+    pool.setup('s1')
+    assert pool.plan('s1', 'p1', {}, time_budget=5) == {'setups': b's1'}
+
+
+def test_workers_over_the_budget_are_replaced(pool):
+    pool.setup('s1')
+    pool.setup('s2')
+    pid = worker_pid(pool)
+
+    start = time.monotonic()
+    with pytest.raises(PlanTimeout) as e:
+        pool.plan('s1', 'slow', {}, time_budget=0.2)
+    assert time.monotonic() - start < 5
+    assert e.value.time_budget == 0.2
+
+    # The replacement worker has replayed the setups and serves the next calls
+    assert worker_pid(pool) != pid
+    assert pool.plan('s1', 'p1', {}, time_budget=5) == {'setups': b's1,s2'}
+
+
+def test_workers_start_with_the_given_submissions():
+    pool = PlanProcessPool(Logic, 2, ['s1'])
+    try:
+        assert pool.plan('s1', 'p1', {}) == {'setups': b's1'}
+    finally:
+        pool.shutdown()
@@ -0,0 +1,85 @@
+import hashlib
+
+from src.problem_cache import ProblemCache, problem_hash
+
+
+class Decoder:
+    """
+    Decodes raw problems into their text, counting the calls.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, raw_problem):
+        self.calls += 1
+        return {'decoded': raw_problem.decode()}
+
+
+def test_identical_problems_are_decoded_once():
+    cache = ProblemCache()
+    decode = Decoder()
+    prb = cache.get_or_decode(b'{"name": "p1"}', decode)
+    assert cache.get_or_decode(b'{"name": "p1"}', decode) is prb
+    assert decode.calls == 1
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 1)
+
+
+def test_different_problems_miss():
+    cache = ProblemCache()
+    decode = Decoder()
+    first = cache.get_or_decode(b'{"name": "p1"}', decode)
+    second = cache.get_or_decode(b'{"name": "p2"}', decode)
+    assert first is not second
+    assert decode.calls == 2
+    assert cache.stats()['misses'] == 2
+
+
+def test_problems_are_keyed_by_their_sha256():
+    assert problem_hash(b'{}') == hashlib.sha256(b'{}').hexdigest()
+    assert problem_hash('{}') == problem_hash(b'{}')
+
+
+def test_least_recently_used_problems_are_evicted_by_count():
+    cache = ProblemCache(max_entries=2)
+    decode = Decoder()
+    for raw_problem in (b'p1', b'p2', b'p1', b'p3'):
+        cache.get_or_decode(raw_problem, decode)
+
+    # p2 was the least recently used
+    cache.get_or_decode(b'p1', decode)
+    assert decode.calls == 3
+    cache.get_or_decode(b'p2', decode)
+    assert decode.calls == 4
+    assert cache.stats()['evictions'] == 2
+
+
+def test_least_recently_used_problems_are_evicted_by_size():
+    cache = ProblemCache(max_bytes=10)
+    decode = Decoder()
+    cache.get_or_decode(b'aaaa', decode)
+    cache.get_or_decode(b'bbbb', decode)
+    cache.get_or_decode(b'cccc', decode)
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (2, 8, 1)
+
+    cache.get_or_decode(b'bbbb', decode)
+    assert decode.calls == 3
+
+
+def test_problems_over_the_limit_are_not_cached():
+    cache = ProblemCache(max_bytes=4)
+    decode = Decoder()
+    cache.get_or_decode(b'too large', decode)
+    cache.get_or_decode(b'too large', decode)
+    assert decode.calls == 2
+    assert cache.stats()['entries'] == 0
+
+
+def test_disabled_cache_always_decodes():
+    cache = ProblemCache(enabled=False)
+    decode = Decoder()
+    cache.get_or_decode(b'p1', decode)
+    cache.get_or_decode(b'p1', decode)
+    assert decode.calls == 2
@@ -0,0 +1,65 @@
+import os
+import time
+import threading
+
+from src.retention import RetentionManager
+
+
+def persist(retention, execution_path, failed=False):
+    for name in ('input', 'output', 'temp'):
+        os.makedirs(os.path.join(execution_path, name), exist_ok=True)
+    with open(os.path.join(execution_path, 'output', 'plan.json'), 'w') as f:
+        f.write('{}')
+    retention.record(execution_path, failed)
+
+
+def wait_deleted(retention, count):
+    deadline = time.monotonic() + 5
+    while retention.stats()['deleted_executions'] < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert retention.stats()['deleted_executions'] == count
+
+
+def test_executions_are_not_deleted_while_written(tmp_path):
+    retention = RetentionManager(str(tmp_path), mode='none')
+    execution_path = os.path.join(tmp_path, 'sub', 'problems', 'p1')
+    persist(retention, execution_path)
+
+    # An identical request writes the same path before the deletion runs
+    writing = threading.Event()
+    kept = []
+
+    def write():
+        with retention.writing(execution_path):
+            writing.set()
+            time.sleep(0.1)
+            kept.append(os.path.exists(os.path.join(execution_path, 'output')))
+            persist(retention, execution_path)
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    writing.wait(5)
+    retention.start()
+    thread.join(5)
+    assert kept == [True]
+
+    wait_deleted(retention, 2)
+    assert not os.path.exists(os.path.join(tmp_path, 'sub'))
+
+
+def test_failures_written_after_a_success_are_kept(tmp_path):
+    retention = RetentionManager(str(tmp_path), mode='failures')
+    execution_path = os.path.join(tmp_path, 'sub', 'problems', 'p1')
+    persist(retention, execution_path)
+    persist(retention, execution_path, failed=True)
+
+    retention.start()
+    time.sleep(0.1)
+    assert os.path.exists(os.path.join(execution_path, 'temp', 'failed'))
+
+    # A later success replaces the failure, and is deleted
+    persist(retention, execution_path)
+    deadline = time.monotonic() + 5
+    while os.path.exists(execution_path) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not os.path.exists(execution_path)
@@ -0,0 +1,98 @@
+import time
+
+import pytest
+
+from src.rollouts import RolloutPool
+
+# Value of the rollouts of the action that never completes in time
+STUCK = 'stuck'
+
+
+def sum_rollout(prb, state, action, horizon, rng):
+    return state + action * horizon + rng.random()
+
+
+def slow_rollout(prb, state, action, horizon, rng):
+    time.sleep(action)
+    return action
+
+
+def stuck_rollout(prb, state, action, horizon, rng):
+    if action == STUCK:
+        time.sleep(30)
+    return 1.0
+
+
+class Problem:
+    """
+    Problem counting how many times it is pickled.
+    """
+
+    pickled = 0
+
+    def __getstate__(self):
+        Problem.pickled += 1
+        return self.__dict__
+
+
+class State:
+
+    def __init__(self, prb):
+        self.prb = prb
+
+
+def problem_rollout(prb, state, action, horizon, rng):
+    # The state refers to the copy of the problem held by the worker
+    return 1.0 if state.prb is prb else 0.0
+
+
+@pytest.fixture
+def pool():
+    pool = RolloutPool(2)
+    yield pool
+    pool.shutdown()
+
+
+def test_same_results_inline_and_in_processes(pool):
+    inline = RolloutPool(0).evaluate(None, sum_rollout, 1, [1, 2, 3], 4, time_budget=None, samples=8, seed=7)
+    parallel = pool.evaluate(None, sum_rollout, 1, [1, 2, 3], 4, time_budget=None, samples=8, seed=7)
+    for expected, stats in zip(inline, parallel):
+        assert (stats.count, stats.min, stats.max) == (expected.count, expected.min, expected.max)
+        assert stats.mean == pytest.approx(expected.mean)
+        assert stats.std == pytest.approx(expected.std)
+    assert [stats.count for stats in parallel] == [8, 8, 8]
+
+
+def test_time_budget_is_required(pool):
+    with pytest.raises(TypeError):
+        pool.evaluate(None, sum_rollout, 1, [1], 4)
+
+
+def test_rollouts_stop_at_the_deadline(pool):
+    start = time.monotonic()
+    stats = pool.evaluate(None, slow_rollout, 0, [0.1, 0.1], 1, time_budget=0.35, samples=20)
+    assert time.monotonic() - start < 2
+    # Every worker completes the rollouts that fit in the budget
+    assert 2 <= sum(entry.count for entry in stats) < 40
+    assert pool.stats()['recycled'] == 0
+
+
+def test_stuck_workers_are_recycled(pool):
+    start = time.monotonic()
+    stats = pool.evaluate(None, stuck_rollout, 0, [STUCK, 'fast'], 1, time_budget=0.2)
+    assert time.monotonic() - start < 5
+    assert stats[0].count == 0
+    assert pool.stats()['recycled'] >= 1
+
+    # The replaced workers serve the next batches
+    stats = pool.evaluate(None, sum_rollout, 1, [1, 2], 1, time_budget=None, samples=4)
+    assert [entry.count for entry in stats] == [4, 4]
+
+
+def test_problem_references_are_not_sent_with_the_states(pool):
+    prb = Problem()
+    for _ in range(3):
+        stats = pool.evaluate(prb, problem_rollout, State(prb), [1, 2], 1, time_budget=None, samples=4)
+        assert [(entry.count, entry.mean) for entry in stats] == [(4, 1.0), (4, 1.0)]
+    # The problem is only sent once to each worker
+    assert Problem.pickled <= pool.size
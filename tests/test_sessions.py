@@ -0,0 +1,154 @@
+import sys
+import json
+import types
+
+import pytest
+
+from src import sessions as sessions_module
+from src import business_logic
+from src.sessions import SessionRegistry
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class Problem:
+    pass
+
+
+class Planner:
+
+    def __init__(self, prb):
+        self.prb = prb
+        self.episodes = 0
+        self.steps = []
+
+    def setup_episode(self):
+        self.episodes += 1
+
+    def next_action(self, state, metadata):
+        self.steps.append((state, metadata))
+        return Action()
+
+
+class Action:
+
+    def to_json_obj(self):
+        return {'name': 'unload'}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(sessions_module, 'time', clock)
+    return clock
+
+
+def add_session(registry, submission_id, simulation_id):
+    prb = Problem()
+    return registry.add_session(submission_id, 'p1', simulation_id, prb, Planner(prb))
+
+
+def test_idle_entries_expire(clock):
+    registry = SessionRegistry(idle_timeout=60)
+    prb = Problem()
+    registry.add_problem('s', 'p1', prb, Planner(prb))
+    add_session(registry, 's', 'sim1')
+    add_session(registry, 's', 'sim2')
+
+    clock.now += 45
+    assert registry.get_session('s', 'p1', 'sim1') is not None
+    clock.now += 30
+    # sim1 was used 30s ago, sim2 and the problem 75s ago
+    assert registry.get_session('s', 'p1', 'sim1') is not None
+    assert registry.get_session('s', 'p1', 'sim2') is None
+    assert registry.get_problem('s', 'p1') is None
+
+
+def test_least_recently_used_entries_go_over_the_caps(clock):
+    registry = SessionRegistry(max_sessions=2, max_problems=1)
+    first = add_session(registry, 'a', 'sim1')
+    add_session(registry, 'b', 'sim1')
+    registry.get_session('a', 'p1', 'sim1')
+    add_session(registry, 'c', 'sim1')
+    assert registry.get_session('a', 'p1', 'sim1') is first
+    assert registry.get_session('b', 'p1', 'sim1') is None
+
+    for problem_id in ('p1', 'p2'):
+        prb = Problem()
+        registry.add_problem('a', problem_id, prb, Planner(prb))
+    assert registry.get_problem('a', 'p1') is None
+    assert registry.get_problem('a', 'p2') is not None
+    assert registry.stats() == {'problems': 1, 'sessions': 2}
+
+
+def test_sessions_are_capped_per_submission(clock):
+    registry = SessionRegistry(max_sessions=10, max_submission_sessions=2)
+    other = add_session(registry, 'b', 'sim1')
+    for simulation_id in ('sim1', 'sim2', 'sim3'):
+        add_session(registry, 'a', simulation_id)
+
+    # Only the oldest simulation of the submission over its cap is discarded
+    assert registry.get_session('a', 'p1', 'sim1') is None
+    assert registry.get_session('a', 'p1', 'sim2') is not None
+    assert registry.get_session('a', 'p1', 'sim3') is not None
+    assert registry.get_session('b', 'p1', 'sim1') is other
+
+
+def test_simulations_get_their_own_planner_sharing_the_problem(clock):
+    registry = SessionRegistry()
+    prb = Problem()
+    setup = registry.add_problem('s', 'p1', prb, Planner(prb))
+    first, second = setup.new_planner(), setup.new_planner()
+
+    assert first is not setup.planner and first is not second
+    assert first.prb is prb and second.prb is prb
+    first.steps.append('step')
+    assert setup.planner.steps == [] and second.steps == []
+
+
+@pytest.fixture
+def toolkit(monkeypatch):
+    """
+    Minimal stand-ins for the toolkit classes used by next_action.
+    """
+    problem_state = types.ModuleType('beluga_lib.problem_state')
+    problem_state.BelugaProblemState = types.SimpleNamespace(from_json_obj=lambda state_obj, prb: ('state', prb))
+    planner_api = types.ModuleType('evaluation.planner_api')
+    planner_api.ProbabilisticPlanningMetatada = types.SimpleNamespace(from_json_obj=lambda obj: obj)
+    monkeypatch.setitem(sys.modules, 'beluga_lib', types.ModuleType('beluga_lib'))
+    monkeypatch.setitem(sys.modules, 'beluga_lib.problem_state', problem_state)
+    monkeypatch.setitem(sys.modules, 'evaluation', types.ModuleType('evaluation'))
+    monkeypatch.setitem(sys.modules, 'evaluation.planner_api', planner_api)
+
+
+def test_next_action_starts_the_missing_simulation(monkeypatch, toolkit):
+    registry = SessionRegistry()
+    monkeypatch.setattr(business_logic, 'session_registry', registry)
+    prb = Problem()
+    setup = registry.add_problem('s', 'p1', prb, Planner(prb))
+
+    logic = business_logic.CompetitorModelBusinessLogic()
+    input_files = {'state_and_metadata.json': json.dumps({'state': {}, 'metadata': {'step': 0}}).encode()}
+    output_files = {}
+    assert logic.next_action('s', 'p1', 'sim1', 'a1', input_files, output_files)
+    assert json.loads(output_files['action.json']) == {'name': 'unload'}
+
+    session = registry.get_session('s', 'p1', 'sim1')
+    assert session is not None and session.prb is prb
+    assert session.planner is not setup.planner
+    assert session.planner.episodes == 1
+    assert session.planner.steps == [(('state', prb), {'step': 0})]
+
+
+def test_next_action_fails_for_problems_not_set_up(monkeypatch, toolkit):
+    monkeypatch.setattr(business_logic, 'session_registry', SessionRegistry())
+    logic = business_logic.CompetitorModelBusinessLogic()
+    input_files = {'state_and_metadata.json': b'{"state": {}, "metadata": {}}'}
+    assert logic.next_action('s', 'p1', 'sim1', 'a1', input_files, {}) is False
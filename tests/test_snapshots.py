@@ -0,0 +1,103 @@
+import os
+import pickle
+
+import pytest
+
+from src import snapshots as snapshots_module
+from src.snapshots import SnapshotStore, planner_name
+
+
+class Problem:
+
+    def __init__(self, name):
+        self.name = name
+
+
+class Planner:
+
+    def __init__(self, prb=None):
+        self.prb = prb
+
+
+class OtherPlanner(Planner):
+    pass
+
+
+PLANNER = planner_name(Planner())
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SnapshotStore(str(tmp_path), version='1')
+
+
+def save(store, problem_hash='hash'):
+    prb = Problem('p1')
+    assert store.save('sub', 'p1', problem_hash, prb, Planner(prb), layout='layout')
+    return store.path('sub', 'p1')
+
+
+def test_round_trip(store, tmp_path):
+    path = save(store)
+    assert os.path.dirname(path) == os.path.realpath(tmp_path)
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+    prb, planner, layout = store.load('sub', 'p1', PLANNER, 'hash')
+    assert prb.name == 'p1' and layout == 'layout'
+    # The planner still shares the problem object
+    assert planner.prb is prb
+    assert store.stats()['restored'] == 1
+
+
+def test_ids_cannot_point_outside_of_the_directory(store, tmp_path):
+    prb = Problem('p1')
+    assert store.save('../..', '../escape', 'hash', prb, Planner(prb))
+    assert os.listdir(tmp_path) == [os.path.basename(store.path('../..', '../escape'))]
+    assert store.load('../..', '../escape', PLANNER, 'hash') is not None
+
+
+def test_missing_snapshots_are_not_loaded(store):
+    assert store.load('sub', 'p1', PLANNER) is None
+    assert store.stats()['invalidated'] == 0
+
+
+@pytest.mark.parametrize('change', ['format', 'version', 'planner', 'problem_hash'])
+def test_stale_snapshots_are_discarded(store, monkeypatch, change):
+    path = save(store)
+    planner = PLANNER
+    problem_hash = 'hash'
+    if change == 'format':
+        monkeypatch.setattr(snapshots_module, 'SNAPSHOT_FORMAT', snapshots_module.SNAPSHOT_FORMAT + 1)
+    elif change == 'version':
+        store.version = '2'
+    elif change == 'planner':
+        planner = planner_name(OtherPlanner())
+    else:
+        problem_hash = 'other'
+
+    assert store.load('sub', 'p1', planner, problem_hash) is None
+    assert not os.path.exists(path)
+    assert store.stats()['invalidated'] == 1
+
+
+def test_problem_hash_is_optional(store):
+    save(store)
+    assert store.load('sub', 'p1', PLANNER) is not None
+
+
+@pytest.mark.parametrize('corrupt', ['truncated', 'garbage', 'header_only'])
+def test_corrupt_snapshots_are_deleted(store, corrupt):
+    path = save(store)
+    with open(path, 'rb') as f:
+        content = f.read()
+    if corrupt == 'truncated':
+        content = content[:len(content) - 10]
+    elif corrupt == 'garbage':
+        content = b'not a snapshot'
+    else:
+        content = pickle.dumps(store._header(PLANNER, 'hash'))
+    with open(path, 'wb') as f:
+        f.write(content)
+
+    assert store.load('sub', 'p1', PLANNER, 'hash') is None
+    assert not os.path.exists(path)
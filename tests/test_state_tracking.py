@@ -0,0 +1,102 @@
+import pytest
+
+from src.state_tracking import StateMismatch, StateTracker, merge_patch, state_checksum
+
+STATE = {'jigs': {'j1': {'type': 'typeA', 'empty': False}}, 'racks': {'r1': ['j1']}, 'step': 0}
+NEXT_STATE = {'jigs': {'j1': {'type': 'typeA', 'empty': True}}, 'racks': {'r1': ['j1']}, 'step': 1}
+DELTA = {'jigs': {'j1': {'empty': True}}, 'step': 1}
+
+
+class State:
+    """
+    Decoded state, comparable to the JSON state it comes from.
+    """
+
+    def __init__(self, state_obj):
+        self.state_obj = state_obj
+
+    def to_json_obj(self):
+        return self.state_obj
+
+
+class Planner:
+
+    def __init__(self, prediction):
+        self.prediction = prediction
+
+    def predict_state(self, state, action):
+        return State(self.prediction)
+
+
+@pytest.fixture
+def tracker():
+    tracker = StateTracker()
+    tracker.resolve({'state': STATE}, None, State)
+    return tracker
+
+
+def test_merge_patch_deletes_members_set_to_null():
+    target = {'a': 1, 'b': {'c': 2, 'd': 3}}
+    assert merge_patch(target, {'b': {'c': None}, 'e': [4]}) == {'a': 1, 'b': {'d': 3}, 'e': [4]}
+    assert merge_patch(target, {'a': None, 'missing': None}) == {'b': {'c': 2, 'd': 3}}
+    assert target == {'a': 1, 'b': {'c': 2, 'd': 3}}
+
+
+def test_same_full_state_is_not_decoded_again(tracker):
+    state = tracker.state
+    assert tracker.resolve({'state': dict(STATE)}, None, State) is state
+    assert (tracker.hits, tracker.decodes) == (1, 1)
+
+
+def test_delta_is_applied_to_the_cached_state(tracker):
+    state = tracker.resolve({'state_delta': DELTA, 'base_checksum': state_checksum(STATE)}, None, State)
+    assert state.state_obj == NEXT_STATE
+    assert tracker.checksum == state_checksum(NEXT_STATE)
+    assert tracker.decodes == 2
+
+
+def test_delta_is_checked_against_the_patched_checksum(tracker):
+    state = tracker.resolve({'state_delta': DELTA, 'checksum': state_checksum(NEXT_STATE)}, None, State)
+    assert state.state_obj == NEXT_STATE
+
+
+def test_mismatching_delta_falls_back_to_the_full_state(tracker):
+    data = {'state_delta': DELTA, 'base_checksum': 'stale', 'state': NEXT_STATE}
+    assert tracker.resolve(data, None, State).state_obj == NEXT_STATE
+
+    tracker.resolve({'state': STATE}, None, State)
+    data = {'state_delta': DELTA, 'checksum': 'wrong', 'state': NEXT_STATE}
+    assert tracker.resolve(data, None, State).state_obj == NEXT_STATE
+
+
+def test_mismatching_delta_without_full_state_is_refused(tracker):
+    with pytest.raises(StateMismatch):
+        tracker.resolve({'state_delta': DELTA, 'base_checksum': 'stale'}, None, State)
+    with pytest.raises(StateMismatch):
+        StateTracker().resolve({'state_delta': DELTA, 'base_checksum': state_checksum(STATE)}, None, State)
+
+
+def test_delta_without_checksums_is_refused(tracker):
+    with pytest.raises(StateMismatch):
+        tracker.resolve({'state_delta': DELTA}, None, State)
+    assert tracker.state.state_obj == STATE
+
+
+def test_predicted_state_is_reused(tracker):
+    tracker.advance(Planner(NEXT_STATE), 'unload')
+    predicted = tracker.predicted
+    assert tracker.resolve({'state': NEXT_STATE}, None, State) is predicted
+    assert (tracker.hits, tracker.decodes) == (1, 1)
+
+
+def test_wrong_prediction_is_decoded(tracker):
+    tracker.advance(Planner({'step': 99}), 'unload')
+    state = tracker.resolve({'state': NEXT_STATE}, None, State)
+    assert state is not tracker.predicted
+    assert state.state_obj == NEXT_STATE
+    assert (tracker.hits, tracker.decodes) == (0, 2)
+
+
+def test_planners_without_prediction_are_supported(tracker):
+    tracker.advance(object(), 'unload')
+    assert tracker.predicted is None and tracker.predicted_checksum is None
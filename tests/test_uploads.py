@@ -0,0 +1,107 @@
+import io
+import os
+import struct
+import zipfile
+
+import pytest
+
+from src.uploads import UploadLimits, UploadRejected, extract_archive, read_archive, spool_body
+
+LIMITS = UploadLimits(max_body_bytes=4096, max_uncompressed_bytes=4096, max_entries=8, spool_bytes=1024)
+
+UNSAFE_NAMES = ['../escape.txt', 'inputs/../../escape.txt', '/etc/escape.txt', '\\escape.txt', 'C:/escape.txt',
+                'C:\\escape.txt', 'C:escape.txt', '..\\escape.txt']
+
+
+def make_zip(files):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for name, content in files.items():
+            zip_ref.writestr(zipfile.ZipInfo(name), content, zipfile.ZIP_DEFLATED)
+    return buffer.getvalue()
+
+
+def understate_sizes(data, file_size):
+    """
+    Rewrites the uncompressed size declared by the local and central headers of
+    every entry of an archive.
+    """
+    data = bytearray(data)
+    for signature, offset in ((b'PK\x03\x04', 22), (b'PK\x01\x02', 24)):
+        start = data.find(signature)
+        while start != -1:
+            struct.pack_into('<I', data, start + offset, file_size)
+            start = data.find(signature, start + 1)
+    return bytes(data)
+
+
+@pytest.mark.parametrize('name', UNSAFE_NAMES)
+def test_read_rejects_unsafe_paths(name):
+    with pytest.raises(UploadRejected) as e:
+        read_archive(make_zip({'ok.txt': b'ok', name: b'escaped'}), LIMITS)
+    assert e.value.status == 400
+
+
+@pytest.mark.parametrize('name', UNSAFE_NAMES)
+def test_extract_rejects_unsafe_paths(tmp_path, name):
+    destination = tmp_path / 'inputs' / 'nested'
+    destination.mkdir(parents=True)
+    with pytest.raises(UploadRejected) as e:
+        extract_archive(make_zip({name: b'escaped'}), str(destination), LIMITS)
+    assert e.value.status == 400
+    assert [files for _, _, files in os.walk(tmp_path)] == [[], [], []]
+
+
+def test_safe_nested_paths_are_extracted(tmp_path):
+    extract_archive(make_zip({'a/b.txt': b'b', 'a/./c/../d.txt': b'd'}), str(tmp_path), LIMITS)
+    assert (tmp_path / 'a' / 'b.txt').read_bytes() == b'b'
+    assert (tmp_path / 'a' / 'd.txt').read_bytes() == b'd'
+
+
+def test_declared_sizes_over_the_limit_are_rejected():
+    with pytest.raises(UploadRejected) as e:
+        read_archive(make_zip({'big.txt': b'\0' * 5000}), LIMITS)
+    assert e.value.status == 413
+
+
+@pytest.mark.parametrize('reader', ['read', 'extract'])
+def test_understated_sizes_are_rejected(tmp_path, reader):
+    # 64 KiB of zeros compress to a few hundred bytes, and claim to be 16 bytes
+    data = understate_sizes(make_zip({'bomb.txt': b'\0' * 65536}), 16)
+    assert len(data) < LIMITS.max_body_bytes
+    with pytest.raises(UploadRejected) as e:
+        if reader == 'read':
+            read_archive(data, LIMITS)
+        else:
+            extract_archive(data, str(tmp_path), LIMITS)
+    # The entry is never decompressed past its declared size, which then fails its CRC
+    assert e.value.status == 400
+    assert not (tmp_path / 'bomb.txt').exists() or (tmp_path / 'bomb.txt').stat().st_size <= 16
+
+
+def test_too_many_entries_are_rejected():
+    with pytest.raises(UploadRejected) as e:
+        read_archive(make_zip({f'{i}.txt': b'' for i in range(9)}), LIMITS)
+    assert e.value.status == 413
+
+
+def test_body_over_the_limit_without_content_length():
+    chunks = iter([b'x' * 1000] * 5)
+    with pytest.raises(UploadRejected) as e:
+        spool_body(chunks, None, LIMITS)
+    assert e.value.status == 413
+
+
+def test_body_over_the_limit_with_a_wrong_content_length():
+    with pytest.raises(UploadRejected) as e:
+        spool_body(iter([b'x' * 1000] * 5), 100, LIMITS)
+    assert e.value.status == 413
+
+
+def test_body_within_the_limit_is_spooled_to_disk():
+    body = spool_body(iter([b'x' * 1000] * 4), None, LIMITS)
+    try:
+        assert body.read() == b'x' * 4000
+        assert body._rolled
+    finally:
+        body.close()
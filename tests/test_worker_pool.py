@@ -0,0 +1,66 @@
+import time
+import threading
+
+from src.worker_pool import LogicPool
+
+
+class Worker:
+    """
+    Business logic object recording its calls, and failing when used by two
+    callers at once.
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.in_use = threading.Lock()
+
+    def call(self, name):
+        assert self.in_use.acquire(blocking=False), 'worker used by two callers at once'
+        try:
+            time.sleep(0.001)
+            self.calls.append(name)
+        finally:
+            self.in_use.release()
+
+
+def test_broadcasts_reach_every_worker_while_requests_acquire_them():
+    pool = LogicPool(Worker, 3)
+    stop = threading.Event()
+    errors = []
+
+    def serve():
+        try:
+            while not stop.is_set():
+                with pool.acquire() as worker:
+                    worker.call('request')
+        except Exception as e:
+            errors.append(e)
+
+    def broadcast(name):
+        try:
+            pool.broadcast(lambda worker: worker.call(name))
+        except Exception as e:
+            errors.append(e)
+
+    requests = [threading.Thread(target=serve) for _ in range(6)]
+    broadcasts = [threading.Thread(target=broadcast, args=(f'setup{i}',)) for i in range(4)]
+    for thread in requests + broadcasts:
+        thread.start()
+    for thread in broadcasts:
+        thread.join(10)
+    stop.set()
+    for thread in requests:
+        thread.join(10)
+
+    assert not any(thread.is_alive() for thread in requests + broadcasts), 'deadlock'
+    assert errors == []
+    for worker in pool._workers:
+        setups = sorted(name for name in worker.calls if name != 'request')
+        assert setups == ['setup0', 'setup1', 'setup2', 'setup3']
+    assert pool.busy() == 0
+
+
+def test_broadcast_returns_the_result_of_every_worker():
+    pool = LogicPool(Worker, 2)
+    results = pool.broadcast(lambda worker: id(worker))
+    assert sorted(results) == sorted(id(worker) for worker in pool._workers)
@@ -0,0 +1,207 @@
+"""
+Asyncio variant of the webservice, with the same routes and query parameters.
+
+Requests are served on an event loop, so idle or slow connections (e.g.
+simulations waiting between two steps) do not hold a thread. Request bodies
+are read asynchronously, and the request handlers, which block on business
+logic calls, zip handling and file writes, run on a thread pool of
+configuration.async_threads threads.
+
+The routes, their handlers (validation, logging, error statuses) and the
+business logic objects, pools and caches are those of webservice.py; this
+module only adapts the requests and responses to Quart. Run it with:
+
+    python async_webservice.py
+
+or with any ASGI server, e.g. hypercorn async_webservice:app
+"""
+import os
+import time
+import signal
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from quart import Quart, Response, g, request, send_from_directory, jsonify
+
+import webservice
+from webservice import (REQUESTS, REQUESTS_IN_FLIGHT, REQUEST_SECONDS, ROUTES, ApiRequest, configuration, metrics,
+                        profiles, upload_limits)
+from src.uploads import UploadRejected, add_chunk, body_bytes, check_content_length, spooled_buffer
+
+app = Quart(__name__)
+# Bodies are read by read_upload, within the limits of the Flask service
+app.config['MAX_CONTENT_LENGTH'] = None
+
+logger = logging.getLogger(__name__)
+
+# Threads running the blocking work, so that it never stalls the event loop
+executor = ThreadPoolExecutor(max_workers=configuration.async_threads, thread_name_prefix='offload')
+
+async def offload(fn, *args, **kwargs):
+    """
+    Runs a blocking call on the thread pool and waits for its result.
+    """
+    return await asyncio.get_running_loop().run_in_executor(executor, functools.partial(fn, *args, **kwargs))
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_serving
+async def start_services():
+    await offload(webservice.start_services)
+
+@app.after_serving
+async def stop_services():
+    await offload(webservice.stop_services)
+    executor.shutdown(wait=True)
+
+@app.before_request
+async def reject_large_bodies():
+    # Rejected from the headers, before the body is read
+    try:
+        check_content_length(request.content_length, upload_limits)
+    except UploadRejected as e:
+        logger.warning(f"[UPLOAD] - {str(e)}: {request.path}")
+        return jsonify({"error": str(e)}), e.status
+
+@app.before_request
+async def start_request_metrics():
+    if metrics.enabled or webservice.traffic is not None:
+        g.request_start = time.perf_counter()
+    if metrics.enabled:
+        REQUESTS_IN_FLIGHT.inc(endpoint=_route())
+
+@app.after_request
+async def record_request_metrics(response):
+    if metrics.enabled and 'request_start' in g:
+        route = _route()
+        REQUESTS.inc(endpoint=route, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=route)
+    if webservice.traffic is not None and request.method == 'POST' and 'request_start' in g:
+        try:
+            body = body_bytes(g.upload) if 'upload' in g else await request.get_data()
+            await offload(webservice.traffic.record, request.method, request.path, request.args.to_dict(),
+                          request.content_type, body, response.status_code,
+                          time.perf_counter() - g.request_start)
+        except Exception as e:
+            logger.error(f"[TRAFFIC] - Failed to record request {request.path}. Exception: {str(e)}")
+    return response
+
+@app.teardown_request
+async def end_request_metrics(exception=None):
+    if metrics.enabled and 'request_start' in g:
+        REQUESTS_IN_FLIGHT.dec(endpoint=_route())
+
+@app.teardown_request
+async def close_upload(exception=None):
+    upload = g.pop('upload', None)
+    if upload is not None:
+        upload.close()
+
+async def read_upload():
+    """
+    Reads the body of the current request chunk by chunk into a spooled buffer,
+    within the upload limits (see webservice.read_upload). Chunks are appended
+    on the event loop while the buffer is in memory, and on the thread pool once
+    it is spooled to disk.
+    """
+    if 'upload' not in g:
+        check_content_length(request.content_length, upload_limits)
+        buffer = spooled_buffer(upload_limits)
+        try:
+            async for chunk in request.body:
+                if buffer.tell() + len(chunk) > upload_limits.spool_bytes:
+                    await offload(add_chunk, buffer, chunk, upload_limits)
+                else:
+                    add_chunk(buffer, chunk, upload_limits)
+        except BaseException:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        g.upload = buffer
+    return g.upload
+
+async def api_request():
+    """
+    Returns the ApiRequest of the current request. The body of POST requests is
+    read here, asynchronously; a rejected body is reported by the handler when
+    it asks for it, as with the Flask service.
+    """
+    upload, rejected = None, None
+    if request.method == 'POST':
+        try:
+            upload = await read_upload()
+        except UploadRejected as e:
+            rejected = e
+
+    def read_body():
+        if rejected is not None:
+            raise rejected
+        return upload
+
+    return ApiRequest(request.args, request.headers, request.content_type, request.mimetype, request.content_length,
+                      read_body)
+
+def quart_response(reply):
+    """
+    Turns the Reply of a request handler into a Quart response; streamed bodies
+    are iterated on the thread pool.
+    """
+    if reply.body is None:
+        response = jsonify(reply.json_obj)
+    elif isinstance(reply.body, (bytes, bytearray, str)):
+        response = Response(reply.body, mimetype=reply.mimetype)
+    else:
+        response = Response(offload_stream(iter(reply.body)), mimetype=reply.mimetype)
+    response.status_code = reply.status
+    response.headers.update(reply.headers)
+    return response
+
+async def offload_stream(chunks):
+    """
+    Iterates a blocking generator on the thread pool.
+    """
+    while True:
+        chunk = await offload(next, chunks, None)
+        if chunk is None:
+            break
+        yield chunk
+
+def quart_view(handler):
+    async def view(**kwargs):
+        # The handlers of webservice.py block, so they run on the thread pool
+        return quart_response(await offload(handler, await api_request(), **kwargs))
+    view.__doc__ = handler.__doc__
+    return view
+
+for rule, methods, handler in ROUTES:
+    app.add_url_rule(rule, handler.__name__, quart_view(handler), methods=methods)
+
+@app.route('/profiles/<name>', methods=['GET'])
+async def download_profile(name):
+    """
+    Endpoint to download a captured profile (.prof pstats dump or .txt summary).
+    """
+    return await send_from_directory(os.path.abspath(profiles.directory), name, as_attachment=True)
+
+
+if __name__ == '__main__':
+    from hypercorn.asyncio import serve
+    from hypercorn.config import Config
+
+    config = Config()
+    config.bind = [f"0.0.0.0:{os.environ.get('BELUGA_PORT', 80)}"]
+    config.keep_alive_timeout = int(os.environ.get('BELUGA_KEEPALIVE', 5))
+    config.graceful_timeout = int(os.environ.get('BELUGA_GRACEFUL_TIMEOUT', 30))
+
+    async def main():
+        # Stop accepting connections on SIGTERM/SIGINT, and let the requests complete
+        shutdown = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, shutdown.set)
+        await serve(app, config, shutdown_trigger=shutdown.wait)
+
+    logger.info("Starting asyncio application.")
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""
+Production server configuration, used by the Dockerfile:
+
+    gunicorn --config gunicorn.conf.py webservice:app
+
+The application is preloaded in the master process, so that the toolkit
+imports and the construction of the business logic objects happen once, and
+are shared copy-on-write by the forked workers. With BELUGA_PREWARM, the
+planners are also built in the master before the workers are forked. The plan
+worker processes and the retention thread are started in every worker after
+the fork.
+
+Problem setups and simulations are kept in the memory of the worker that
+served them, so running more than one worker process requires the requests of
+a submission to be routed to the same worker; BELUGA_SERVER_THREADS scales a
+single worker instead.
+"""
+from src.business_logic import _env_flag, _env_int
+
+
+bind = f"0.0.0.0:{_env_int('BELUGA_PORT', 80)}"
+
+# Worker processes, each serving requests on a pool of threads
+workers = _env_int('BELUGA_SERVER_WORKERS', 1)
+worker_class = 'gthread'
+threads = _env_int('BELUGA_SERVER_THREADS', 8)
+preload_app = _env_flag('BELUGA_PRELOAD', True)
+
+# Seconds for which idle connections are kept open
+keepalive = _env_int('BELUGA_KEEPALIVE', 5)
+# Seconds after which an unresponsive worker is restarted, and seconds given to
+# the workers to finish their requests on shutdown or restart
+timeout = _env_int('BELUGA_SERVER_TIMEOUT', 120)
+graceful_timeout = _env_int('BELUGA_GRACEFUL_TIMEOUT', 30)
+
+accesslog = None
+errorlog = '-'
+loglevel = 'info'
+
+
+def when_ready(server):
+    # Called in the master before the workers are forked
+    if preload_app:
+        import webservice
+        webservice.prewarm_before_fork()
+
+
+def post_fork(server, worker):
+    import webservice
+    webservice.start_services()
+
+
+def worker_exit(server, worker):
+    import webservice
+    webservice.stop_services()
@@ -1,15 +1,49 @@
+import io
 import os
+import json
+import math
+import time
 import zipfile
-import shutil
 import logging
-from flask import Flask, request, send_file, jsonify
-from src.business_logic import CompetitorModelBusinessLogic
+import posixpath
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, g, request, send_from_directory, jsonify
+
+# msgpack is optional, and only needed for msgpack bodies on the fast path
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+from src.startup import startup
+from src.business_logic import CompetitorModelBusinessLogic, configuration, empty_plan_files
+from src.worker_pool import LogicPool
+from src.plan_processes import PlanProcessPool, PlanTimeout
+from src.jobs import JobQueue, JobQueueFull
+from src.admission import AdmissionController, AdmissionRejected, PriorityClass, PRIORITIES, INTERACTIVE, SETUP, BATCH
+from src.retention import RetentionManager
+from src.metrics import registry as metrics, stage
+from src.profiling import ProfileStore, profiled
+from src.traffic import TrafficRecorder
+from src.uploads import (UploadLimits, UploadRejected, body_bytes, check_content_length, copy_body, extract_archive,
+                         read_archive, spool_body, stream_chunks)
+from src.business_logic import problem_cache, session_registry, snapshots, rollout_pool
+from src.problem_cache import problem_hash
+from src.plan_cache import PlanCache, planner_settings
+from src.snapshots import planner_name
+
+startup.mark('imports')
 
 app = Flask(__name__)
 
 # Base path for executions
 BASE_PATH = os.path.join('..', 'res', 'executions')
 
+# Content types of the /next_action and /start_simulation fast path, which skips the zip wrapping
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s')
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(levelname)s: %(message)s')
@@ -18,354 +52,1282 @@ logger = logging.getLogger(__name__)
 
 logging.disable(logging.DEBUG)
 
-# Build the business logic object
-competitor_logic = CompetitorModelBusinessLogic()
+# Build the pool of business logic objects; every request checks one out for
+# the duration of its business logic call
+planner_pool = LogicPool(CompetitorModelBusinessLogic, configuration.workers)
+startup.mark('worker_pool')
+
+# Business logic calls are admitted by priority: simulation steps first, then
+# setups, then planning and explain calls
+admission = AdmissionController(configuration.admission_capacity,
+                                [PriorityClass(priority, *configuration.admission_limits[priority]) for priority in PRIORITIES],
+                                enabled=configuration.admission_enabled)
+
+# With the process backend, /plan runs on dedicated worker processes, which can
+# be killed when they exceed the time budget (created by start_services)
+plan_processes = None
+
+# With the thread backend, /plan_batch plans on worker processes of its own, so
+# that the problems of a batch run on several cores (created by the first batch,
+# see batch_plan_processes)
+batch_processes = None
+
+# Submissions set up in this process, replayed on the batch processes when they start
+_setup_submission_ids = []
+
+# Retention policy of the executions persisted under BASE_PATH
+retention = RetentionManager(BASE_PATH, configuration.retention_mode, configuration.retention_keep_last,
+                             configuration.retention_minutes, configuration.retention_sweep_interval)
+
+# Process in which start_services last ran
+_services_pid = None
+_services_lock = threading.Lock()
+
+# Whether the planners were pre-warmed before the workers were forked
+_prewarmed_before_fork = False
+
+def start_services():
+    """
+    Starts the parts of the service that cannot be shared with forked processes:
+    the plan worker processes and the retention thread. It runs before the first
+    request served by a process, so that a preloading server (see
+    gunicorn.conf.py) only starts them in its workers, after the fork.
+    """
+    global plan_processes, _services_pid
+    with _services_lock:
+        if _services_pid == os.getpid():
+            return
+        if configuration.plan_backend == 'process':
+            plan_processes = PlanProcessPool(CompetitorModelBusinessLogic, configuration.plan_processes)
+        retention.start()
+        _services_pid = os.getpid()
+        logger.info(f"[SERVICES] - Background services started in process {_services_pid}")
+        startup.mark('services')
+        if configuration.prewarm and not _prewarmed_before_fork:
+            startup.prewarm(prewarm)
+        else:
+            startup.mark_ready()
+
+def batch_plan_processes():
+    """
+    Returns the worker processes planning the problems of /plan_batch: those of
+    the process backend or, with the thread backend, the batch processes, which
+    are started on first use. Returns None when batches run on the worker pool.
+    """
+    global batch_processes
+    if plan_processes is not None:
+        return plan_processes
+    with _services_lock:
+        if batch_processes is None and configuration.batch_processes > 0:
+            batch_processes = PlanProcessPool(CompetitorModelBusinessLogic, configuration.batch_processes,
+                                              _setup_submission_ids)
+        return batch_processes
+
+def prewarm_before_fork():
+    """
+    Pre-warms the planners in the preloading master process (see
+    gunicorn.conf.py), before the workers are forked, so that they share the
+    planners copy-on-write instead of each building its own after the fork.
+    """
+    global _prewarmed_before_fork
+    if configuration.prewarm and not _prewarmed_before_fork:
+        # No thread survives the fork, so the master waits for the planners
+        startup.prewarm(prewarm, background=False)
+        _prewarmed_before_fork = True
+
+def prewarm():
+    """
+    Imports the toolkit and builds the planners of every worker ahead of the
+    first requests (otherwise this happens on first use).
+    """
+    planners = ('det', 'prob') if configuration.prewarm == 'all' else (configuration.prewarm,)
+    planner_pool.broadcast(lambda competitor_logic: competitor_logic.warm_up(planners))
 
-@app.route('/explain', methods=['POST'])
-def explain():
+def stop_services():
+    """
+    Stops the plan, batch and rollout worker processes, once the calls they are serving are complete.
+    """
+    global plan_processes, batch_processes
+    with _services_lock:
+        if plan_processes is not None and _services_pid == os.getpid():
+            plan_processes.shutdown()
+            plan_processes = None
+        if batch_processes is not None and _services_pid == os.getpid():
+            batch_processes.shutdown()
+            batch_processes = None
+        rollout_pool.shutdown()
+
+# Profiles of the planner calls, captured on request or by sampling
+profiles = ProfileStore(configuration.profile_dir, configuration.profile_sample_rate, configuration.profile_max_files)
+
+# Background jobs for the asynchronous /jobs API
+job_queue = JobQueue(configuration.job_executors, configuration.job_queue_size, configuration.job_retention,
+                     configuration.job_max_finished)
+
+# Results of /plan, served again for identical requests
+plan_cache = PlanCache(configuration.plan_cache_dir or None, configuration.plan_cache_max_entries,
+                       configuration.plan_cache_max_disk_mb * 1024 * 1024, enabled=configuration.plan_cache_enabled)
+
+# Identity of the deterministic planner in the plan cache keys, computed on first use
+_plan_identity = None
+
+# Recording of the API traffic, for replay by the load test
+traffic = TrafficRecorder(configuration.record_traffic) if configuration.record_traffic else None
+
+# Limits of the uploaded bodies and archives
+MB = 1024 * 1024
+upload_limits = UploadLimits(configuration.max_upload_mb * MB, configuration.max_uncompressed_mb * MB,
+                             configuration.max_archive_entries, configuration.upload_spool_mb * MB)
+
+# Request metrics, labelled by route
+REQUESTS = metrics.counter('beluga_requests_total', 'Number of requests served', ['endpoint', 'status'])
+REQUESTS_IN_FLIGHT = metrics.gauge('beluga_requests_in_flight', 'Number of requests being served', ['endpoint'])
+REQUEST_SECONDS = metrics.histogram('beluga_request_seconds', 'Latency of the requests in seconds', ['endpoint'])
+
+def _route():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+@app.before_request
+def ensure_services():
+    if _services_pid != os.getpid():
+        start_services()
+
+@app.before_request
+def reject_large_bodies():
+    # Rejected from the headers, before the body is read
+    try:
+        check_content_length(request.content_length, upload_limits)
+    except UploadRejected as e:
+        logger.warning(f"[UPLOAD] - {str(e)}: {request.path}")
+        return jsonify({"error": str(e)}), e.status
+
+@app.before_request
+def start_request_metrics():
+    if metrics.enabled or traffic is not None:
+        g.request_start = time.perf_counter()
+    if metrics.enabled:
+        REQUESTS_IN_FLIGHT.inc(endpoint=_route())
+
+@app.after_request
+def record_request_metrics(response):
+    if metrics.enabled and 'request_start' in g:
+        route = _route()
+        REQUESTS.inc(endpoint=route, status=response.status_code)
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, endpoint=route)
+    if traffic is not None and request.method == 'POST' and 'request_start' in g:
+        try:
+            body = body_bytes(g.upload) if 'upload' in g else request.get_data(cache=True)
+            traffic.record(request.method, request.path, request.args.to_dict(), request.content_type,
+                           body, response.status_code, time.perf_counter() - g.request_start)
+        except Exception as e:
+            logger.error(f"[TRAFFIC] - Failed to record request {request.path}. Exception: {str(e)}")
+    return response
+
+@app.teardown_request
+def end_request_metrics(exception=None):
+    if metrics.enabled and 'request_start' in g:
+        REQUESTS_IN_FLIGHT.dec(endpoint=_route())
+
+@app.teardown_request
+def close_upload(exception=None):
+    upload = g.pop('upload', None)
+    if upload is not None:
+        upload.close()
+
+def collect_service_metrics():
+    """
+    Reports the state of the caches, pools and queues at scraping time.
+    """
+    cache = problem_cache.stats()
+    sessions = session_registry.stats()
+    jobs = job_queue.stats()
+    usage = retention.stats()['usage']
+    snapshot_stats = snapshots.stats()
+    startup_status = startup.status()
+    rollout_stats = rollout_pool.stats()
+    admission_classes = admission.stats()['classes']
+    plan_cache_stats = plan_cache.stats()
+    return [
+        ('beluga_ready', 'gauge', 'Whether the service is ready', [({}, int(startup_status['ready']))]),
+        ('beluga_startup_seconds', 'gauge', 'Duration of the startup phases',
+         [({'phase': phase}, seconds) for phase, seconds in startup_status['phases'].items()]),
+        ('beluga_problem_cache_entries', 'gauge', 'Number of cached problems', [({}, cache['entries'])]),
+        ('beluga_problem_cache_bytes', 'gauge', 'Size of the cached problem files', [({}, cache['bytes'])]),
+        ('beluga_problem_cache_hits_total', 'counter', 'Problem cache hits', [({}, cache['hits'])]),
+        ('beluga_problem_cache_misses_total', 'counter', 'Problem cache misses', [({}, cache['misses'])]),
+        ('beluga_plan_cache_entries', 'gauge', 'Number of plans cached in memory', [({}, plan_cache_stats['entries'])]),
+        ('beluga_plan_cache_hits_total', 'counter', 'Plans served from the cache',
+         [({'store': 'memory'}, plan_cache_stats['hits']), ({'store': 'disk'}, plan_cache_stats['disk_hits'])]),
+        ('beluga_plan_cache_misses_total', 'counter', 'Plans computed through the cache', [({}, plan_cache_stats['misses'])]),
+        ('beluga_plan_cache_shared_total', 'counter', 'Plan calls that waited for an identical call in flight',
+         [({}, plan_cache_stats['shared'])]),
+        ('beluga_plan_cache_evicted_files_total', 'counter', 'Cached plan files deleted to fit the disk limit',
+         [({}, plan_cache_stats['evicted_files'])]),
+        ('beluga_snapshots_saved_total', 'counter', 'Problem snapshots saved', [({}, snapshot_stats['saved'])]),
+        ('beluga_snapshots_restored_total', 'counter', 'Problem snapshots restored', [({}, snapshot_stats['restored'])]),
+        ('beluga_snapshots_invalidated_total', 'counter', 'Stale problem snapshots discarded', [({}, snapshot_stats['invalidated'])]),
+        ('beluga_rollouts_total', 'counter', 'Monte-Carlo rollouts completed', [({}, rollout_stats['rollouts'])]),
+        ('beluga_rollout_batches_total', 'counter', 'Batches of Monte-Carlo rollouts', [({}, rollout_stats['batches'])]),
+        ('beluga_rollout_workers_recycled_total', 'counter', 'Rollout workers killed for exceeding the time budget',
+         [({}, rollout_stats['recycled'])]),
+        ('beluga_problem_setups', 'gauge', 'Number of problem setups in memory', [({}, sessions['problems'])]),
+        ('beluga_sessions', 'gauge', 'Number of simulations in memory', [({}, sessions['sessions'])]),
+        ('beluga_workers_busy', 'gauge', 'Number of business logic workers in use', [({}, planner_pool.busy())]),
+        ('beluga_workers', 'gauge', 'Number of business logic workers', [({}, planner_pool.size)]),
+        ('beluga_admission_running', 'gauge', 'Number of admitted calls running, per priority class',
+         [({'priority': name}, entry['running']) for name, entry in admission_classes.items()]),
+        ('beluga_admission_queued', 'gauge', 'Number of calls waiting for admission, per priority class',
+         [({'priority': name}, entry['queued']) for name, entry in admission_classes.items()]),
+        ('beluga_admission_rejected_total', 'counter', 'Calls shed by the admission control',
+         [({'priority': name, 'reason': reason}, entry[f'rejected_{reason}'])
+          for name, entry in admission_classes.items() for reason in ('full', 'timeout')]),
+        ('beluga_jobs_pending', 'gauge', 'Number of queued or running jobs', [({}, jobs['pending'])]),
+        ('beluga_jobs_finished', 'gauge', 'Number of finished jobs kept for their results', [({}, jobs['finished'])]),
+        ('beluga_jobs_evicted_total', 'counter', 'Finished jobs dropped to fit the limit', [({}, jobs['evicted'])]),
+        ('beluga_executions_disk_bytes', 'gauge', 'Disk usage of the persisted executions', [({}, usage['bytes'])]),
+        ('beluga_executions_disk_files', 'gauge', 'Number of files of the persisted executions', [({}, usage['files'])]),
+    ]
+
+metrics.add_collector(collect_service_metrics)
+
+class ApiRequest:
+    """
+    The parts of a Flask or Quart request used by the request handlers: query
+    parameters, headers, content type and length, and the body returned by
+    body() (a spooled buffer, see read_upload).
+    """
+
+    def __init__(self, args, headers, content_type, mimetype, content_length, read_body):
+        self.args = args
+        self.headers = headers
+        self.content_type = content_type
+        self.mimetype = mimetype
+        self.content_length = content_length
+        self._read_body = read_body
+
+    def body(self):
+        return self._read_body()
+
+
+class Reply:
+    """
+    Response of a request handler, turned into a Flask or Quart response by the
+    service: the JSON object json_obj, or a body given as bytes or as an
+    iterable of chunks to stream.
+    """
+
+    def __init__(self, status=200, json_obj=None, body=None, mimetype=JSON_MIMETYPE, headers=None):
+        self.status = status
+        self.json_obj = json_obj
+        self.body = body
+        self.mimetype = mimetype
+        self.headers = dict(headers or {})
+
+
+def error_reply(message, status, headers=None):
+    return Reply(status, {"error": message}, headers=headers)
+
+def shed_reply(e):
+    """
+    Reply to a call shed by the admission control, telling the client when to retry.
+    """
+    return error_reply(str(e), e.status, {'Retry-After': str(e.retry_after)})
+
+def zip_reply(zip_data, headers=None):
+    """
+    Sends a zip archive (bytes or an iterable of chunks) as the output.zip attachment.
+    """
+    return Reply(body=zip_data, mimetype='application/octet-stream',
+                 headers={'Content-Disposition': 'attachment; filename=output.zip', **(headers or {})})
+
+def ready(req):
+    """
+    Readiness probe: 200 once the service has started (and pre-warmed, if
+    enabled), 503 before. The body reports the startup timings.
+    """
+    return Reply(200 if startup.is_ready() else 503, startup.status())
+
+def admission_stats(req):
+    """
+    Endpoint to report the limits, load, rejections and queue wait times of the priority classes.
+    """
+    return Reply(200, admission.stats())
+
+def metrics_endpoint(req):
+    """
+    Endpoint exposing the service metrics in the Prometheus text format.
+    """
+    return Reply(body=metrics.render(), mimetype='text/plain; version=0.0.4')
+
+def explain(req):
     """
     Endpoint to handle the explainer process for a submission and plan.
     """
-    logger.info(f"[EXPLAIN REQUEST] - Received /explain request with query parameters: {request.args}")
+    logger.info(f"[EXPLAIN REQUEST] - Received /explain request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
-    plan_id = request.args.get('plan_id')
+    submission_id = req.args.get('submission_id')
+    plan_id = req.args.get('plan_id')
 
     if not submission_id or not plan_id:
         logger.error(f"[EXPLAIN REQUEST] - Missing required query parameters: submission_id or plan_id")
-        return jsonify({"error": "Missing required query parameters"}), 400
+        return error_reply("Missing required query parameters", 400)
 
-    # Define paths for input, output, and temporary files
+    # Define the path used when executions are persisted
     execution_path = os.path.join(BASE_PATH, submission_id, "explain", plan_id)
-    input_path = os.path.join(execution_path, 'input')
-    output_path = os.path.join(execution_path, 'output')
-    temp_path = os.path.join(execution_path, 'temp')
-
-    # Create directories if they don't exist
-    os.makedirs(input_path, exist_ok=True)
-    os.makedirs(output_path, exist_ok=True)
-    os.makedirs(temp_path, exist_ok=True)
-    logger.info(f"[EXPLAIN REQUEST] - Directories set up: input={input_path}, output={output_path}, temp={temp_path}")
+    zip_file = None
 
     try:
         # Check content type for zip file
-        if request.content_type != 'application/octet-stream':
+        if req.content_type != 'application/octet-stream':
             logger.error(
-                f"[EXPLAIN REQUEST] - Invalid content type: {request.content_type}. Expected application/octet-stream.")
-            return jsonify({"error": "Invalid content-type. Expected application/octet-stream"}), 400
+                f"[EXPLAIN REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
 
-        # Save the uploaded zip file from request body
+        # Read the uploaded zip file from request body
         logger.info(f"[EXPLAIN REQUEST] - Receiving zip file from request body.")
-        zip_file = request.data
-        zip_file_path = os.path.join(temp_path, 'uploaded.zip')
-
-        with open(zip_file_path, 'wb') as f:
-            f.write(zip_file)
-        logger.info(f"[EXPLAIN REQUEST] - Zip file saved to: {zip_file_path}")
-
-        # Unzip the file
-        unzip_file(zip_file_path, input_path)
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
 
         # Call business logic for the explain process
         logger.info(
             f"[EXPLAIN REQUEST] - Calling business logic for explain. Submission ID: {submission_id}, Plan ID: {plan_id}")
-        competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.explain(submission_id, plan_id, input_path, output_path)
+        output_files = run_explain(submission_id, plan_id, input_files)
         logger.info(
             f"[EXPLAIN REQUEST] - Business logic completed for Submission ID: {submission_id}, Plan ID: {plan_id}")
 
-        # Zip the output directory
-        output_zip = zip_directory(output_path, os.path.join(temp_path, "output"))
+        # Zip the output files
+        output_zip = zip_payload(output_files)
+        if configuration.persist_executions:
+            persist_execution(execution_path, zip_file, output_files, output_zip, failed=not output_files)
 
         # Send the zipped output file as the response
-        logger.info(f"[EXPLAIN REQUEST] - Sending zipped output: {output_zip}")
-        return send_file(output_zip, as_attachment=True, mimetype='application/octet-stream')
+        logger.info(f"[EXPLAIN REQUEST] - Sending zipped output ({len(output_zip)} bytes)")
+        return zip_reply(output_zip)
+
+    except UploadRejected as e:
+        logger.warning(f"[EXPLAIN REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except AdmissionRejected as e:
+        logger.warning(f"[EXPLAIN REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[EXPLAIN REQUEST] - Error occurred during explaining process: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        if configuration.persist_executions and zip_file is not None:
+            persist_execution(execution_path, zip_file, failed=True)
+        return error_reply(str(e), 500)
 
-@app.route('/plan', methods=['POST'])
-def plan():
+def plan(req):
     """
     Endpoint to handle the planning process for a submission and problem.
     """
-    logger.debug(f"[PLAN REQUEST] - Received /plan request with query parameters: {request.args}")
+    logger.debug(f"[PLAN REQUEST] - Received /plan request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
-    problem_id = request.args.get('problem_id')
+    submission_id = req.args.get('submission_id')
+    problem_id = req.args.get('problem_id')
 
     if not submission_id or not problem_id:
         logger.error(f"[PLAN REQUEST] - Missing required query parameters: submission_id or problem_id")
-        return jsonify({"error": "Missing required query parameters"}), 400
+        return error_reply("Missing required query parameters", 400)
 
-    # Define paths for input, output, and temporary files
-    execution_path = os.path.join(BASE_PATH, submission_id, "problems", problem_id)
-    input_path = os.path.join(execution_path, 'input')
-    output_path = os.path.join(execution_path, 'output')
-    temp_path = os.path.join(execution_path, 'temp')
+    try:
+        time_budget = requested_time_budget(req)
+    except ValueError as e:
+        logger.error(f"[PLAN REQUEST] - {str(e)}")
+        return error_reply(str(e), 400)
 
-    # Create directories if they don't exist
-    os.makedirs(input_path, exist_ok=True)
-    os.makedirs(output_path, exist_ok=True)
-    os.makedirs(temp_path, exist_ok=True)
-    logger.debug(f"[PLAN REQUEST] - Directories set up: input={input_path}, output={output_path}, temp={temp_path}")
+    # Define the path used when executions are persisted
+    execution_path = os.path.join(BASE_PATH, submission_id, "problems", problem_id)
+    zip_file = None
 
     try:
         # Check content type for zip file
-        if request.content_type != 'application/octet-stream':
+        if req.content_type != 'application/octet-stream':
             logger.error(
-                f"[PLAN REQUEST] - Invalid content type: {request.content_type}. Expected application/octet-stream.")
-            return jsonify({"error": "Invalid content-type. Expected application/octet-stream"}), 400
+                f"[PLAN REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
 
-        # Save the uploaded zip file from request body
+        # Read the uploaded zip file from request body
         logger.debug(f"[PLAN REQUEST] - Receiving zip file from request body.")
-        zip_file = request.data
-        zip_file_path = os.path.join(temp_path, 'uploaded.zip')
-
-        with open(zip_file_path, 'wb') as f:
-            f.write(zip_file)
-        logger.debug(f"[PLAN REQUEST] - Zip file saved to: {zip_file_path}")
-
-        # Unzip the file
-        unzip_file(zip_file_path, input_path)
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
 
         # Call business logic for the plan process
         logger.debug(
             f"[PLAN REQUEST] - Calling business logic for plan. Submission ID: {submission_id}, Problem ID: {problem_id}")
-        # competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.plan(submission_id, problem_id, input_path, output_path)
+        profile_path = requested_profile_path(req, 'plan', submission_id, problem_id)
+        output_zip, plan_status, cache_status = run_cached_plan(submission_id, problem_id, input_files, time_budget,
+                                                                profile_path)
         logger.debug(
-            f"[PLAN REQUEST] - Business logic completed for Submission ID: {submission_id}, Problem ID: {problem_id}")
+            f"[PLAN REQUEST] - Business logic completed for Submission ID: {submission_id}, Problem ID: {problem_id}, Status: {plan_status}, Cache: {cache_status}")
 
-        # Zip the output directory
-        output_zip = zip_directory(output_path, os.path.join(temp_path, "output"))
+        if configuration.persist_executions:
+            output_files = unzip_payload(output_zip)
+            persist_execution(execution_path, zip_file, output_files, output_zip,
+                              failed=configuration.plan_file_name not in output_files)
 
         # Send the zipped output file as the response
-        logger.debug(f"[PLAN REQUEST] - Sending zipped output: {output_zip}")
-        return send_file(output_zip, as_attachment=True, mimetype='application/octet-stream')
+        logger.debug(f"[PLAN REQUEST] - Sending zipped output ({len(output_zip)} bytes)")
+        headers = {'X-Plan-Status': plan_status, 'X-Plan-Cache': cache_status}
+        if profile_path is not None:
+            headers['X-Profile'] = os.path.basename(profile_path) + '.prof'
+        # The thread backend does not enforce the budget
+        if time_budget and plan_processes is not None:
+            headers['X-Plan-Time-Budget'] = str(time_budget)
+        return zip_reply(output_zip, headers)
+
+    except UploadRejected as e:
+        logger.warning(f"[PLAN REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except AdmissionRejected as e:
+        logger.warning(f"[PLAN REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[PLAN REQUEST] - Error occurred during planning process: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        if configuration.persist_executions and zip_file is not None:
+            persist_execution(execution_path, zip_file, failed=True)
+        return error_reply(str(e), 500)
+
+
+def plan_batch(req):
+    """
+    Endpoint to plan many problems of a submission in one request. The uploaded
+    archive contains a <problem_id>/problem.json file per problem; the response
+    archive is streamed back with a <problem_id>/plan.json file per problem, plus
+    a report.json file with the status and timing of each of them.
+    """
+    logger.debug(f"[PLAN BATCH REQUEST] - Received /plan_batch request with query parameters: {req.args}")
+
+    # Extract query parameters
+    submission_id = req.args.get('submission_id')
+
+    if not submission_id:
+        logger.error(f"[PLAN BATCH REQUEST] - Missing required query parameter: submission_id")
+        return error_reply("Missing required query parameter: submission_id", 400)
 
+    try:
+        time_budget = requested_time_budget(req)
+    except ValueError as e:
+        logger.error(f"[PLAN BATCH REQUEST] - {str(e)}")
+        return error_reply(str(e), 400)
+
+    try:
+        # Check content type for zip file
+        if req.content_type != 'application/octet-stream':
+            logger.error(f"[PLAN BATCH REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
+
+        # Group the uploaded files by problem
+        problems = {}
+        for name, content in unzip_payload(req.body()).items():
+            problem_id, file_name = posixpath.split(name)
+            if problem_id:
+                problems.setdefault(problem_id, {})[file_name] = content
+        problems = {problem_id: input_files for problem_id, input_files in problems.items()
+                    if configuration.problem_file_name in input_files}
+
+        if not problems:
+            logger.error(f"[PLAN BATCH REQUEST] - No <problem_id>/{configuration.problem_file_name} file in the uploaded archive")
+            return error_reply(f"No <problem_id>/{configuration.problem_file_name} file in the uploaded archive", 400)
+
+        logger.debug(f"[PLAN BATCH REQUEST] - Planning {len(problems)} problems for Submission ID: {submission_id}")
+        return zip_reply(stream_plan_batch(submission_id, problems, time_budget))
+
+    except UploadRejected as e:
+        logger.warning(f"[PLAN BATCH REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
 
-@app.route('/setup', methods=['POST'])
-def setup():
+    except Exception as e:
+        logger.error(f"[PLAN BATCH REQUEST] - Error occurred during batch planning: {str(e)}", exc_info=True)
+        return error_reply(str(e), 500)
+
+
+def stream_plan_batch(submission_id, problems, time_budget):
+    """
+    Plans the problems in parallel, on the plan or batch worker processes when
+    there are any, and yields the response archive as the plans are computed.
+    Errors are reported per problem in report.json.
+    """
+    processes = batch_plan_processes()
+
+    def plan_one(problem_id, input_files):
+        start = time.monotonic()
+        try:
+            output_zip, plan_status, _ = run_cached_plan(submission_id, problem_id, input_files, time_budget,
+                                                         processes=processes)
+            output_files = unzip_payload(output_zip)
+            if configuration.plan_file_name in output_files:
+                entry = {'status': plan_status}
+            else:
+                entry = {'status': 'failed', 'error': 'No plan was produced'}
+        except AdmissionRejected as e:
+            logger.warning(f"[PLAN BATCH] - Problem ID: {problem_id} was not planned: {str(e)}")
+            output_files, entry = {}, {'status': 'rejected', 'error': str(e)}
+        except Exception as e:
+            logger.error(f"[PLAN BATCH] - Error while planning Problem ID: {problem_id}: {str(e)}", exc_info=True)
+            output_files, entry = {}, {'status': 'failed', 'error': str(e)}
+        entry['seconds'] = round(time.monotonic() - start, 6)
+        return problem_id, output_files, entry
+
+    stream = _ZipStream()
+    report = {}
+    # The threads only wait for the worker processes, when there are any
+    parallelism = processes.size if processes is not None else planner_pool.size
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED) as zip_ref, \
+            ThreadPoolExecutor(max_workers=min(parallelism, len(problems))) as executor:
+        futures = [executor.submit(plan_one, problem_id, input_files) for problem_id, input_files in problems.items()]
+        for future in as_completed(futures):
+            problem_id, output_files, entry = future.result()
+            report[problem_id] = entry
+            for name, content in output_files.items():
+                zip_ref.writestr(posixpath.join(problem_id, name), content)
+            yield stream.pop()
+        zip_ref.writestr('report.json', json.dumps(report, indent=2))
+    yield stream.pop()
+
+    logger.debug(f"[PLAN BATCH] - Completed {len(report)} problems for Submission ID: {submission_id}")
+
+
+class _ZipStream:
+    """
+    Write-only buffer used to stream a zip archive while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def setup(req):
     """
     Endpoint to handle setup for a submission.
     """
-    logger.debug(f"[SETUP REQUEST] - Received /setup request with query parameters: {request.args}")
+    logger.debug(f"[SETUP REQUEST] - Received /setup request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
+    submission_id = req.args.get('submission_id')
 
     if not submission_id:
         logger.error(f"[SETUP REQUEST] - Missing required query parameter: submission_id")
-        return jsonify({"error": "Missing required query parameter: submission_id"}), 400
+        return error_reply("Missing required query parameter: submission_id", 400)
 
     try:
         # Call setup business logic
         logger.debug(f"[SETUP REQUEST] - Calling setup business logic for Submission ID: {submission_id}")
-        # competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.setup(submission_id)
+        run_setup(submission_id)
         logger.debug(f"[SETUP REQUEST] - Setup completed for Submission ID: {submission_id}")
 
-        return jsonify({"message": "Setup completed successfully"}), 200
+        return Reply(200, {"message": "Setup completed successfully"})
+
+    except AdmissionRejected as e:
+        logger.warning(f"[SETUP REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[SETUP REQUEST] - Error occurred during setup process: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return error_reply(str(e), 500)
 
 
-@app.route('/setup_problem', methods=['POST'])
-def setup_problem():
+def setup_problem(req):
     """
     Endpoint to handle the setup process for a submission and problem.
     """
-    logger.debug(f"[SETUP PROBLEM REQUEST] - Received /setup_problem request with query parameters: {request.args}")
+    logger.debug(f"[SETUP PROBLEM REQUEST] - Received /setup_problem request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
-    problem_id = request.args.get('problem_id')
+    submission_id = req.args.get('submission_id')
+    problem_id = req.args.get('problem_id')
 
     if not submission_id or not problem_id:
         logger.error(f"[SETUP PROBLEM REQUEST] - Missing required query parameters: submission_id or problem_id")
-        return jsonify({"error": "Missing required query parameters"}), 400
+        return error_reply("Missing required query parameters", 400)
 
-    # Define paths for input, output, and temporary files
+    # Define the path used when executions are persisted
     execution_path = os.path.join(BASE_PATH, submission_id, "problems", problem_id)
-    input_path = os.path.join(execution_path, 'input')
-    output_path = os.path.join(execution_path, 'output')
-    temp_path = os.path.join(execution_path, 'temp')
-
-    # Create directories if they don't exist
-    os.makedirs(input_path, exist_ok=True)
-    os.makedirs(output_path, exist_ok=True)
-    os.makedirs(temp_path, exist_ok=True)
-    logger.debug(f"[SETUP PROBLEM REQUEST] - Directories set up: input={input_path}, output={output_path}, temp={temp_path}")
+    zip_file = None
 
     try:
         # Check content type for zip file
-        if request.content_type != 'application/octet-stream':
-            logger.error(f"[SETUP PROBLEM REQUEST] - Invalid content type: {request.content_type}. Expected application/octet-stream.")
-            return jsonify({"error": "Invalid content-type. Expected application/octet-stream"}), 400
+        if req.content_type != 'application/octet-stream':
+            logger.error(f"[SETUP PROBLEM REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
 
-        # Save the uploaded zip file from request body
+        # Read the uploaded zip file from request body
         logger.debug(f"[SETUP PROBLEM REQUEST] - Receiving zip file from request body.")
-        zip_file = request.data
-        zip_file_path = os.path.join(temp_path, 'uploaded.zip')
-
-        with open(zip_file_path, 'wb') as f:
-            f.write(zip_file)
-        logger.debug(f"[SETUP PROBLEM REQUEST] - Zip file saved to: {zip_file_path}")
-
-        # Unzip the file
-        unzip_file(zip_file_path, input_path)
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
 
         # Call business logic for the setup process
         logger.debug(f"[SETUP PROBLEM REQUEST] - Calling business logic for setup. Submission ID: {submission_id}, Problem ID: {problem_id}")
-        # competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.setup_problem(submission_id, problem_id, input_path)
+        success = run_setup_problem(submission_id, problem_id, input_files)
+        if configuration.persist_executions:
+            persist_execution(execution_path, zip_file, failed=success is False)
         logger.debug(f"[SETUP PROBLEM REQUEST] - Business logic completed for Submission ID: {submission_id}, Problem ID: {problem_id}")
 
         # Return a simple 200 status
-        return jsonify({"message": "Setup Problem completed successfully"}), 200
+        return Reply(200, {"message": "Setup Problem completed successfully"})
+
+    except UploadRejected as e:
+        logger.warning(f"[SETUP PROBLEM REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except AdmissionRejected as e:
+        logger.warning(f"[SETUP PROBLEM REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[SETUP PROBLEM REQUEST] - Error occurred during setup process: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        if configuration.persist_executions and zip_file is not None:
+            persist_execution(execution_path, zip_file, failed=True)
+        return error_reply(str(e), 500)
 
 
-@app.route('/start_simulation', methods=['POST'])
-def start_simulation():
+def start_simulation(req):
     """
     Endpoint to start a simulation.
     """
     logger.debug(
-        f"[START SIMULATION REQUEST] - Received /start_simulation request with query parameters: {request.args}")
+        f"[START SIMULATION REQUEST] - Received /start_simulation request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
-    problem_id = request.args.get('problem_id')
-    simulation_id = request.args.get('simulation_id')
+    submission_id = req.args.get('submission_id')
+    problem_id = req.args.get('problem_id')
+    simulation_id = req.args.get('simulation_id')
 
     if not submission_id or not problem_id or not simulation_id:
         logger.debug(
             "[START SIMULATION REQUEST] - Missing required query parameters: submission_id, problem_id, or simulation_id")
-        return jsonify({"error": "Missing required query parameters"}), 400
+        return error_reply("Missing required query parameters", 400)
 
     try:
+        # An optional JSON or msgpack body can carry the initial state of the simulation
+        if req.mimetype in MSGPACK_MIMETYPES and msgpack is None:
+            logger.error(f"[START SIMULATION REQUEST] - msgpack bodies require the msgpack package")
+            return error_reply("msgpack bodies require the msgpack package", 415)
+        initial_state = None
+        if req.content_length and req.mimetype in (JSON_MIMETYPE, *MSGPACK_MIMETYPES):
+            initial_state = decode_fast_payload(body_bytes(req.body()), req.mimetype).get('state')
+
         # Call business logic for start_simulation
         logger.debug(
             f"[START SIMULATION REQUEST] - Calling business logic for start_simulation. Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}")
-        # competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.start_simulation(submission_id, problem_id, simulation_id)
+        run_start_simulation(submission_id, problem_id, simulation_id, initial_state)
         logger.debug(
             f"[START SIMULATION REQUEST] - Simulation started successfully for Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}")
 
-        return jsonify({"message": "Simulation started successfully"}), 200
+        if req.mimetype in MSGPACK_MIMETYPES:
+            return encode_fast_payload({"message": "Simulation started successfully"}, req.mimetype)
+        return Reply(200, {"message": "Simulation started successfully"})
+
+    except UploadRejected as e:
+        logger.warning(f"[START SIMULATION REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except AdmissionRejected as e:
+        logger.warning(f"[START SIMULATION REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[START SIMULATION REQUEST] - Error occurred during simulation start: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        return error_reply(str(e), 500)
 
-@app.route('/next_action', methods=['POST'])
-def next_action():
+def next_action(req):
     """
     Endpoint to handle the next action process for a submission, problem, simulation, and action.
     """
-    logger.debug(f"[NEXT ACTION REQUEST] - Received /next_action request with query parameters: {request.args}")
+    logger.debug(f"[NEXT ACTION REQUEST] - Received /next_action request with query parameters: {req.args}")
 
     # Extract query parameters
-    submission_id = request.args.get('submission_id')
-    problem_id = request.args.get('problem_id')
-    simulation_id = request.args.get('simulation_id')
-    action_id = request.args.get('action_id')
+    submission_id = req.args.get('submission_id')
+    problem_id = req.args.get('problem_id')
+    simulation_id = req.args.get('simulation_id')
+    action_id = req.args.get('action_id')
 
     # Validate that all parameters are present
     if not submission_id or not problem_id or not simulation_id or not action_id:
         logger.error(f"[NEXT ACTION REQUEST] - Missing required query parameters: submission_id, problem_id, simulation_id, or action_id")
-        return jsonify({"error": "Missing required query parameters"}), 400
+        return error_reply("Missing required query parameters", 400)
 
-    # Define paths for input, output, and temporary files
+    # Define the path used when executions are persisted
     execution_path = os.path.join(BASE_PATH, submission_id, "problems", problem_id, "simulations", simulation_id, "actions", action_id)
-    input_path = os.path.join(execution_path, 'input')
-    output_path = os.path.join(execution_path, 'output')
-    temp_path = os.path.join(execution_path, 'temp')
-
-    # Create directories if they don't exist
-    os.makedirs(input_path, exist_ok=True)
-    os.makedirs(output_path, exist_ok=True)
-    os.makedirs(temp_path, exist_ok=True)
-    logger.debug(f"[NEXT ACTION REQUEST] - Directories set up: input={input_path}, output={output_path}, temp={temp_path}")
+    zip_file = None
 
     try:
+        # JSON and msgpack bodies skip the zip wrapping altogether
+        if req.mimetype in MSGPACK_MIMETYPES and msgpack is None:
+            logger.error(f"[NEXT ACTION REQUEST] - msgpack bodies require the msgpack package")
+            return error_reply("msgpack bodies require the msgpack package", 415)
+        if req.mimetype == JSON_MIMETYPE or req.mimetype in MSGPACK_MIMETYPES:
+            return next_action_fast_path(req, submission_id, problem_id, simulation_id, action_id, execution_path)
+
         # Check content type for zip file
-        if request.content_type != 'application/octet-stream':
+        if req.content_type != 'application/octet-stream':
             logger.error(
-                f"[NEXT ACTION REQUEST] - Invalid content type: {request.content_type}. Expected application/octet-stream.")
-            return jsonify({"error": "Invalid content-type. Expected application/octet-stream"}), 400
+                f"[NEXT ACTION REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream, {JSON_MIMETYPE} or {MSGPACK_MIMETYPES[0]}.")
+            return error_reply(f"Invalid content-type. Expected application/octet-stream, {JSON_MIMETYPE} or {MSGPACK_MIMETYPES[0]}", 400)
 
-        # Save the uploaded zip file from request body
+        # Read the uploaded zip file from request body
         logger.debug(f"[NEXT ACTION REQUEST] - Receiving zip file from request body.")
-        zip_file = request.data
-        zip_file_path = os.path.join(temp_path, 'uploaded.zip')
-
-        with open(zip_file_path, 'wb') as f:
-            f.write(zip_file)
-        logger.debug(f"[NEXT ACTION REQUEST] - Zip file saved to: {zip_file_path}")
-
-        # Unzip the file
-        unzip_file(zip_file_path, input_path)
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
 
         # Call business logic for the next action process
         logger.debug(
             f"[NEXT ACTION REQUEST] - Calling business logic for next action. Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
-        # competitor_logic = CompetitorModelBusinessLogic()
-        competitor_logic.next_action(submission_id, problem_id, simulation_id, action_id, input_path, output_path)
+        profile_path = requested_profile_path(req, 'next_action', submission_id, problem_id, simulation_id, action_id)
+        output_files = run_next_action(submission_id, problem_id, simulation_id, action_id, input_files, profile_path)
         logger.debug(
             f"[NEXT ACTION REQUEST] - Business logic completed for Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
 
-        # Zip the output directory
-        output_zip = zip_directory(output_path, os.path.join(temp_path, "output"))
+        # Zip the output files
+        output_zip = zip_payload(output_files)
+        if configuration.persist_executions:
+            persist_execution(execution_path, zip_file, output_files, output_zip,
+                              failed=configuration.action_file_name not in output_files)
 
         # Send the zipped output file as the response
-        logger.debug(f"[NEXT ACTION REQUEST] - Sending zipped output: {output_zip}")
-        return send_file(output_zip, as_attachment=True, mimetype='application/octet-stream')
+        logger.debug(f"[NEXT ACTION REQUEST] - Sending zipped output ({len(output_zip)} bytes)")
+        headers = {'X-Profile': os.path.basename(profile_path) + '.prof'} if profile_path is not None else None
+        return zip_reply(output_zip, headers)
+
+    except UploadRejected as e:
+        logger.warning(f"[NEXT ACTION REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except AdmissionRejected as e:
+        logger.warning(f"[NEXT ACTION REQUEST] - {str(e)}")
+        return shed_reply(e)
 
     except Exception as e:
         logger.error(f"[NEXT ACTION REQUEST] - Error occurred during next action process: {str(e)}", exc_info=True)
-        return jsonify({"error": str(e)}), 500
+        if configuration.persist_executions and zip_file is not None:
+            persist_execution(execution_path, zip_file, failed=True)
+        return error_reply(str(e), 500)
 
 
-def unzip_file(zip_file_path, extract_to):
+def retention_stats(req):
+    """
+    Endpoint to report the retention policy, the deletions and the disk usage of the executions folder.
+    """
+    return Reply(200, retention.stats())
+
+
+def list_profiles(req):
+    """
+    Endpoint to list the captured profiles, most recent first.
     """
-    Unzips the file from the given zip_file_path into the extract_to directory.
+    return Reply(200, profiles.list())
+
+
+def next_action_fast_path(req, submission_id, problem_id, simulation_id, action_id, execution_path):
+    """
+    Handles /next_action for JSON and msgpack bodies: the body is the content of
+    state_and_metadata.json and the response is the content of action.json, in
+    the same encoding as the request.
+    """
+    mimetype = req.mimetype
+    data = body_bytes(req.body())
+    if mimetype == JSON_MIMETYPE:
+        input_files = {configuration.state_and_metadata_name: data}
+    else:
+        input_files = {configuration.state_and_metadata_name: json.dumps(decode_fast_payload(data, mimetype))}
+
+    profile_path = requested_profile_path(req, 'next_action', submission_id, problem_id, simulation_id, action_id)
+    output_files = run_next_action(submission_id, problem_id, simulation_id, action_id, input_files, profile_path)
+
+    failed = configuration.action_file_name not in output_files
+    if configuration.persist_executions:
+        persist_execution(execution_path, zip_payload(input_files), output_files, failed=failed)
+
+    # As on the zip path, a step without an action gets an empty response
+    if failed:
+        logger.warning(f"[NEXT ACTION REQUEST] - No action was produced for Submission ID: {submission_id}, Problem ID: {problem_id}, Simulation ID: {simulation_id}, Action ID: {action_id}")
+        return Reply(body=b'', mimetype=mimetype)
+
+    action = output_files[configuration.action_file_name]
+    if mimetype == JSON_MIMETYPE:
+        reply = Reply(body=action, mimetype=JSON_MIMETYPE)
+    else:
+        reply = encode_fast_payload(json.loads(action), mimetype)
+    if profile_path is not None:
+        reply.headers['X-Profile'] = os.path.basename(profile_path) + '.prof'
+    return reply
+
+def decode_fast_payload(data, mimetype):
+    """
+    Decodes a JSON or msgpack request body.
+    """
+    if mimetype == JSON_MIMETYPE:
+        return json.loads(data)
+    return msgpack.unpackb(data)
+
+def encode_fast_payload(obj, mimetype):
+    """
+    Encodes a response body in the same format as the request.
     """
+    if mimetype == JSON_MIMETYPE:
+        return Reply(200, obj)
+    return Reply(body=msgpack.packb(obj), mimetype=mimetype)
+
+
+def submit_plan_job(req):
+    """
+    Endpoint to submit a planning job, taking the same query parameters and body as /plan.
+    """
+    logger.debug(f"[PLAN JOB REQUEST] - Received /jobs/plan request with query parameters: {req.args}")
+
+    # Extract query parameters
+    submission_id = req.args.get('submission_id')
+    problem_id = req.args.get('problem_id')
+
+    if not submission_id or not problem_id:
+        logger.error(f"[PLAN JOB REQUEST] - Missing required query parameters: submission_id or problem_id")
+        return error_reply("Missing required query parameters", 400)
+
     try:
-        with zipfile.ZipFile(zip_file_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_to)
-        logging.debug(f"Unzipped file to {extract_to}")
-    except zipfile.BadZipFile:
-        logging.error(f"Error: The file {zip_file_path} is not a valid zip file.")
+        time_budget = requested_time_budget(req)
+    except ValueError as e:
+        logger.error(f"[PLAN JOB REQUEST] - {str(e)}")
+        return error_reply(str(e), 400)
+    execution_path = os.path.join(BASE_PATH, submission_id, "problems", problem_id)
+
+    try:
+        # Check content type for zip file
+        if req.content_type != 'application/octet-stream':
+            logger.error(f"[PLAN JOB REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
+
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
+
+        # The body is closed with the request, jobs only keep it to persist it
+        zip_data = body_bytes(zip_file) if configuration.persist_executions else None
+        job = job_queue.submit('plan', {'submission_id': submission_id, 'problem_id': problem_id},
+                               plan_job, submission_id, problem_id, zip_data, input_files, time_budget, execution_path)
+        logger.debug(f"[PLAN JOB REQUEST] - Job {job.job_id} submitted for Submission ID: {submission_id}, Problem ID: {problem_id}")
+        return Reply(202, job.to_json_obj())
+
+    except UploadRejected as e:
+        logger.warning(f"[PLAN JOB REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except JobQueueFull as e:
+        logger.warning(f"[PLAN JOB REQUEST] - {str(e)}")
+        return error_reply(str(e), 429)
+
+    except Exception as e:
+        logger.error(f"[PLAN JOB REQUEST] - Error occurred while submitting the job: {str(e)}", exc_info=True)
+        return error_reply(str(e), 500)
+
+
+def submit_explain_job(req):
+    """
+    Endpoint to submit an explain job, taking the same query parameters and body as /explain.
+    """
+    logger.info(f"[EXPLAIN JOB REQUEST] - Received /jobs/explain request with query parameters: {req.args}")
+
+    # Extract query parameters
+    submission_id = req.args.get('submission_id')
+    plan_id = req.args.get('plan_id')
+
+    if not submission_id or not plan_id:
+        logger.error(f"[EXPLAIN JOB REQUEST] - Missing required query parameters: submission_id or plan_id")
+        return error_reply("Missing required query parameters", 400)
+
+    execution_path = os.path.join(BASE_PATH, submission_id, "explain", plan_id)
+
+    try:
+        # Check content type for zip file
+        if req.content_type != 'application/octet-stream':
+            logger.error(f"[EXPLAIN JOB REQUEST] - Invalid content type: {req.content_type}. Expected application/octet-stream.")
+            return error_reply("Invalid content-type. Expected application/octet-stream", 400)
+
+        zip_file = req.body()
+        input_files = unzip_payload(zip_file)
+
+        # The body is closed with the request, jobs only keep it to persist it
+        zip_data = body_bytes(zip_file) if configuration.persist_executions else None
+        job = job_queue.submit('explain', {'submission_id': submission_id, 'plan_id': plan_id},
+                               explain_job, submission_id, plan_id, zip_data, input_files, execution_path)
+        logger.info(f"[EXPLAIN JOB REQUEST] - Job {job.job_id} submitted for Submission ID: {submission_id}, Plan ID: {plan_id}")
+        return Reply(202, job.to_json_obj())
+
+    except UploadRejected as e:
+        logger.warning(f"[EXPLAIN JOB REQUEST] - {str(e)}")
+        return error_reply(str(e), e.status)
+
+    except JobQueueFull as e:
+        logger.warning(f"[EXPLAIN JOB REQUEST] - {str(e)}")
+        return error_reply(str(e), 429)
+
+    except Exception as e:
+        logger.error(f"[EXPLAIN JOB REQUEST] - Error occurred while submitting the job: {str(e)}", exc_info=True)
+        return error_reply(str(e), 500)
+
+
+def job_status(req, job_id):
+    """
+    Endpoint to poll the status of a job.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return error_reply(f"Unknown job: {job_id}", 404)
+    return Reply(200, job.to_json_obj())
+
+
+def job_result(req, job_id):
+    """
+    Endpoint to download the result of a job, i.e. the zip that /plan or /explain would return.
+    """
+    job = job_queue.get(job_id)
+    if job is None:
+        return error_reply(f"Unknown job: {job_id}", 404)
+    if job.status == 'failed':
+        return Reply(500, job.to_json_obj())
+    if job.status != 'done':
+        # Not ready yet, the client should keep polling
+        return Reply(202, job.to_json_obj())
+
+    output_zip, headers = job.result
+    return zip_reply(output_zip, headers)
+
+
+# Routes served by both the Flask service and its asyncio variant, bound to
+# their handlers (which take an ApiRequest and return a Reply)
+ROUTES = (
+    ('/ready', ['GET'], ready),
+    ('/admission', ['GET'], admission_stats),
+    ('/metrics', ['GET'], metrics_endpoint),
+    ('/explain', ['POST'], explain),
+    ('/plan', ['POST'], plan),
+    ('/plan_batch', ['POST'], plan_batch),
+    ('/setup', ['POST'], setup),
+    ('/setup_problem', ['POST'], setup_problem),
+    ('/start_simulation', ['POST'], start_simulation),
+    ('/next_action', ['POST'], next_action),
+    ('/retention', ['GET'], retention_stats),
+    ('/profiles', ['GET'], list_profiles),
+    ('/jobs/plan', ['POST'], submit_plan_job),
+    ('/jobs/explain', ['POST'], submit_explain_job),
+    ('/jobs/<job_id>', ['GET'], job_status),
+    ('/jobs/<job_id>/result', ['GET'], job_result),
+)
+
+
+
+def plan_job(submission_id, problem_id, zip_file, input_files, time_budget, execution_path):
+    """
+    Background job for /jobs/plan, returning the output zip and the response headers.
+    """
+    output_zip, plan_status, cache_status = run_cached_plan(submission_id, problem_id, input_files, time_budget)
+    if configuration.persist_executions:
+        output_files = unzip_payload(output_zip)
+        persist_execution(execution_path, zip_file, output_files, output_zip,
+                          failed=configuration.plan_file_name not in output_files)
+    return output_zip, {'X-Plan-Status': plan_status, 'X-Plan-Cache': cache_status}
+
+def explain_job(submission_id, plan_id, zip_file, input_files, execution_path):
+    """
+    Background job for /jobs/explain, returning the output zip and the response headers.
+    """
+    output_files = run_explain(submission_id, plan_id, input_files)
+    output_zip = zip_payload(output_files)
+    if configuration.persist_executions:
+        persist_execution(execution_path, zip_file, output_files, output_zip, failed=not output_files)
+    return output_zip, {}
+
+def run_setup(submission_id):
+    """
+    Runs the setup business logic on every worker (each owns its own planners)
+    and plan or batch process.
+    """
+    with admission.admit(SETUP, submission_id):
+        planner_pool.broadcast(lambda competitor_logic: competitor_logic.setup(submission_id))
+        # Batch processes started later replay the setup
+        with _services_lock:
+            if submission_id not in _setup_submission_ids:
+                _setup_submission_ids.append(submission_id)
+            pools = [pool for pool in (plan_processes, batch_processes) if pool is not None]
+        for pool in pools:
+            pool.setup(submission_id)
+
+def run_setup_problem(submission_id, problem_id, input_files):
+    """
+    Runs the problem setup business logic on the worker pool.
+    """
+    with admission.admit(SETUP, submission_id), planner_pool.acquire() as competitor_logic:
+        return competitor_logic.setup_problem(submission_id, problem_id, input_files)
+
+def run_start_simulation(submission_id, problem_id, simulation_id, initial_state=None):
+    """
+    Runs the start simulation business logic on the worker pool.
+    """
+    with admission.admit(INTERACTIVE, submission_id), planner_pool.acquire() as competitor_logic:
+        competitor_logic.start_simulation(submission_id, problem_id, simulation_id, initial_state)
+
+def run_explain(submission_id, plan_id, input_files):
+    """
+    Runs the explain business logic on the worker pool and returns the output files.
+    """
+    output_files = {}
+    with admission.admit(BATCH, submission_id), planner_pool.acquire() as competitor_logic:
+        competitor_logic.explain(submission_id, plan_id, input_files, output_files)
+    return output_files
+
+def run_next_action(submission_id, problem_id, simulation_id, action_id, input_files, profile_path=None):
+    """
+    Runs the next action business logic on the worker pool and returns the
+    output files. The call is profiled when profile_path is given.
+    """
+    output_files = {}
+    # Concurrent steps of a simulation wait for the session lock first, so that
+    # they hold neither an admission slot nor a worker while they wait
+    session = session_registry.get_session(submission_id, problem_id, simulation_id)
+    with session.lock if session is not None else nullcontext(), admission.admit(INTERACTIVE, submission_id), \
+            planner_pool.acquire() as competitor_logic, profiled(profile_path):
+        competitor_logic.next_action(submission_id, problem_id, simulation_id, action_id, input_files, output_files)
+    return output_files
+
+def requested_time_budget(req):
+    """
+    Returns the time budget of a plan call, in seconds: the time_budget query
+    parameter, or the configured default. Raises a ValueError if the parameter
+    is not a finite, positive number.
+    """
+    value = req.args.get('time_budget')
+    if value is None:
+        return configuration.plan_time_budget
+    try:
+        time_budget = float(value)
+    except ValueError:
+        raise ValueError(f"Invalid time_budget: {value!r}. Expected a number of seconds")
+    if not math.isfinite(time_budget) or time_budget <= 0:
+        raise ValueError(f"Invalid time_budget: {value!r}. Expected a finite, positive number of seconds")
+    return time_budget
+
+def requested_profile_path(req, kind, *ids):
+    """
+    Returns the path of the profile to capture for the request req, or None if
+    it is not profiled. Profiling is requested with the profile
+    query parameter or the X-Profile header, or happens by sampling.
+    """
+    flag = req.args.get('profile') or req.headers.get('X-Profile') or ''
+    if not profiles.should_profile(flag.strip().lower() in ('1', 'true', 'yes', 'on')):
+        return None
+    return profiles.new_path(kind, *ids)
+
+def run_cached_plan(submission_id, problem_id, input_files, time_budget=None, profile_path=None, processes=None):
+    """
+    Runs the planning business logic through the plan cache. Returns the output
+    zip, the plan status and the cache status: 'hit', 'shared' (the result of
+    an identical call in flight), 'miss', or 'bypass' for profiled calls and
+    when the cache is disabled. Only successful plans are cached.
+    """
+    raw_problem = input_files.get(configuration.problem_file_name)
+    if not plan_cache.enabled or raw_problem is None or profile_path is not None:
+        output_files, plan_status = run_plan(submission_id, problem_id, input_files, time_budget, profile_path,
+                                             processes)
+        return zip_payload(output_files), plan_status, 'bypass'
+
+    def compute():
+        output_files, plan_status = run_plan(submission_id, problem_id, input_files, time_budget, processes=processes)
+        cacheable = plan_status == 'ok' and configuration.plan_file_name in output_files
+        return zip_payload(output_files), plan_status, cacheable
+
+    # Calls with another budget may end differently, so they are not shared
+    key = plan_cache.key(problem_hash(raw_problem), plan_identity(), time_budget)
+    return plan_cache.get_or_compute(key, compute)
+
+def plan_identity():
+    """
+    Returns the identity of the deterministic planner used in the plan cache
+    keys: its class, its settings (see planner_settings) and the configured
+    version.
+    """
+    global _plan_identity
+    if _plan_identity is None:
+        with planner_pool.acquire() as competitor_logic:
+            det_planner = competitor_logic.det_planner
+            _plan_identity = (f"{planner_name(det_planner)}:{planner_settings(det_planner)}:"
+                              f"{configuration.plan_cache_version}")
+    return _plan_identity
+
+def run_plan(submission_id, problem_id, input_files, time_budget=None, profile_path=None, processes=None):
+    """
+    Runs the planning business logic on the given pool of worker processes, or
+    on the configured backend. Returns the output files and the plan status:
+    'ok', or 'timeout' when the time budget was exceeded (in which case an
+    empty plan is returned, as for null plans). The call is profiled when
+    profile_path is given.
+    """
+    if processes is None:
+        processes = plan_processes
+    with admission.admit(BATCH, submission_id):
+        return _run_plan(submission_id, problem_id, input_files, time_budget, profile_path, processes)
+
+def _run_plan(submission_id, problem_id, input_files, time_budget, profile_path, processes):
+    if processes is None:
+        if time_budget:
+            logger.warning(f"[PLAN] - The time budget is only enforced by the process backend - Submission ID: {submission_id}, Problem ID: {problem_id}")
+        output_files = {}
+        with planner_pool.acquire() as competitor_logic, profiled(profile_path):
+            competitor_logic.plan(submission_id, problem_id, input_files, output_files)
+        return output_files, 'ok'
+
+    try:
+        with stage('plan_process'):
+            return processes.plan(submission_id, problem_id, input_files, time_budget or None, profile_path), 'ok'
+    except PlanTimeout as e:
+        logger.warning(f"[PLAN] - {str(e)} - Submission ID: {submission_id}, Problem ID: {problem_id}")
+        return empty_plan_files(), 'timeout'
+
+def read_upload():
+    """
+    Reads the body of the current request in chunks into a spooled buffer (in
+    memory for small bodies, in a temporary file beyond), within the upload
+    limits. The buffer is closed at the end of the request.
+    """
+    if 'upload' not in g:
+        with stage('read_body'):
+            g.upload = spool_body(stream_chunks(request.stream), request.content_length, upload_limits)
+    return g.upload
+
+def api_request():
+    """
+    Returns the ApiRequest of the current Flask request, whose body is read on
+    first use.
+    """
+    return ApiRequest(request.args, request.headers, request.content_type, request.mimetype, request.content_length,
+                      read_upload)
+
+def flask_response(reply):
+    """
+    Turns the Reply of a request handler into a Flask response.
+    """
+    if reply.body is None:
+        response = jsonify(reply.json_obj)
+    else:
+        response = Response(reply.body, mimetype=reply.mimetype)
+    response.status_code = reply.status
+    response.headers.update(reply.headers)
+    return response
+
+def flask_view(handler):
+    def view(**kwargs):
+        return flask_response(handler(api_request(), **kwargs))
+    view.__doc__ = handler.__doc__
+    return view
+
+for rule, methods, handler in ROUTES:
+    app.add_url_rule(rule, handler.__name__, flask_view(handler), methods=methods)
+
+@app.route('/profiles/<name>', methods=['GET'])
+def download_profile(name):
+    """
+    Endpoint to download a captured profile (.prof pstats dump or .txt summary).
+    """
+    return send_from_directory(os.path.abspath(profiles.directory), name, as_attachment=True)
+
+def unzip_payload(zip_data):
+    """
+    Reads the files of a zip archive (bytes or a spooled body), returning a
+    dictionary that maps their names to their raw content. Archives exceeding
+    the upload limits, or with unsafe paths, are rejected.
+    """
+    try:
+        with stage('unzip'):
+            files = read_archive(zip_data, upload_limits)
+        logging.debug(f"Unzipped {len(files)} files from the request body")
+        return files
+    except UploadRejected as e:
+        logging.error(f"Error: The request body was rejected: {str(e)}")
         raise
 
-def zip_directory(directory_path, output_zip_path):
+def zip_payload(files):
     """
-    Zips the content of a directory and saves it as a zip file in the output_zip_path.
+    Builds an in-memory zip archive from a dictionary that maps file names to their content.
     """
     try:
-        shutil.make_archive(output_zip_path, 'zip', directory_path)
-        logging.debug(f"Zipping output from {output_zip_path}")
-        return f"{output_zip_path}.zip"
+        buffer = io.BytesIO()
+        with stage('zip'), zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for name, content in files.items():
+                zip_ref.writestr(name, content)
+        logging.debug(f"Zipped {len(files)} output files")
+        return buffer.getvalue()
     except Exception as e:
-        logging.error(f"Error: Failed to zip directory {directory_path}. Exception: {str(e)}")
+        logging.error(f"Error: Failed to zip output files. Exception: {str(e)}")
+        raise
+
+def persist_execution(execution_path, zip_data, output_files=None, output_zip=None, failed=False):
+    """
+    Stores the uploaded archive, its content and the produced output under the
+    execution path, using the input/output/temp layout. Only used for debugging
+    and auditing, since requests are processed in memory. The execution is then
+    handed over to the retention policy.
+    """
+    input_path = os.path.join(execution_path, 'input')
+    output_path = os.path.join(execution_path, 'output')
+    temp_path = os.path.join(execution_path, 'temp')
+
+    try:
+        # Identical requests write to the same path, which retention must not delete meanwhile
+        with stage('persist'), retention.writing(execution_path):
+            # Create directories if they don't exist
+            os.makedirs(input_path, exist_ok=True)
+            os.makedirs(output_path, exist_ok=True)
+            os.makedirs(temp_path, exist_ok=True)
+
+            zip_file_path = os.path.join(temp_path, 'uploaded.zip')
+            copy_body(zip_data, zip_file_path)
+            unzip_file(zip_file_path, input_path)
+
+            for name, content in (output_files or {}).items():
+                with open(os.path.join(output_path, name), 'wb') as f:
+                    f.write(content)
+            if output_zip is not None:
+                with open(os.path.join(temp_path, 'output.zip'), 'wb') as f:
+                    f.write(output_zip)
+            retention.record(execution_path, failed)
+        logging.debug(f"Execution persisted to {execution_path}")
+    except Exception as e:
+        # Persisting is only a debugging aid and should never fail a request
+        logging.error(f"Error: Failed to persist execution to {execution_path}. Exception: {str(e)}")
+
+def unzip_file(zip_file_path, extract_to):
+    """
+    Unzips the file from the given zip_file_path into the extract_to directory,
+    within the upload limits and without writing outside of it.
+    """
+    try:
+        with open(zip_file_path, 'rb') as f:
+            extract_archive(f, extract_to, upload_limits)
+        logging.debug(f"Unzipped file to {extract_to}")
+    except UploadRejected as e:
+        logging.error(f"Error: The file {zip_file_path} could not be extracted: {str(e)}")
         raise
 
 
 if __name__ == '__main__':
+    # Development server; use gunicorn.conf.py for production serving
     logger.info("Starting Flask application.")
-    app.run(host='0.0.0.0', port=80, debug=True)
+    # With the reloader, the services only run in the child process serving the
+    # requests, not in the parent watching the files
+    if not configuration.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_services()
+    app.run(host='0.0.0.0', port=80, debug=configuration.debug, threaded=True)